@@ -0,0 +1,167 @@
+"""
+📊 Баланс MMO RPG v2 — пакетная симуляция боёв на NumPy
+Тысячи боёв за один проход: винрейт, распределение раундов, статистика урона
+для пары бойцов, сетки класс × уровень × монстр зоны и этажей башни.
+
+    python balance.py zones --levels 1,10,22,35,50 --fights 2000
+    python balance.py tower --levels 20,50,80 --floors 1-100 --workers 4
+
+Пары режутся на блоки по _CHUNK, у каждого блока свой дочерний поток SeedSequence:
+при фиксированном --seed результат не зависит от числа процессов.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from game_data import (
+    CLASSES, ZONES, MAX_COMBAT_ROUNDS,
+    get_class_stats, get_total_stats, get_tower_monster,
+)
+
+_STATS = ("hp", "attack", "defense", "crit")
+_CHUNK = 64  # пар на задачу воркера
+
+
+def _columns(fighters: list) -> dict:
+    """Список бойцов {hp, attack, defense, crit} -> столбцы формы (m, 1)"""
+    return {k: np.array([float(f.get(k, 5 if k == "crit" else 0)) for f in fighters])[:, None] for k in _STATS}
+
+
+def _simulate(atk: dict, dfn: dict, n: int, rng: np.random.Generator) -> dict:
+    """Ядро: m пар бойцов по n боёв. Повторяет правила simulate_combat:
+    урон = max(1, int(атака × U(0.8, 1.2) − защита × 0.3)), крит ×2 только у атакующего,
+    враг бьёт в ответ, если выжил, не больше MAX_COMBAT_ROUNDS раундов."""
+    m = atk["hp"].shape[0]
+    shape = (m, n)
+    atk_hp = np.broadcast_to(atk["hp"], shape).astype(np.int64)
+    def_hp = np.broadcast_to(dfn["hp"], shape).astype(np.int64)
+    rounds = np.zeros(shape, np.int64)
+    dealt = np.zeros(shape, np.int64)
+    received = np.zeros(shape, np.int64)
+    crits = np.zeros(shape, np.int64)
+    for _ in range(MAX_COMBAT_ROUNDS):
+        active = (atk_hp > 0) & (def_hp > 0)
+        if not active.any():
+            break
+        rounds += active
+        is_crit = rng.random(shape) * 100 < atk["crit"]
+        dmg = np.maximum(1, np.trunc(atk["attack"] * rng.uniform(0.8, 1.2, shape) - dfn["defense"] * 0.3)).astype(np.int64)
+        dmg = np.where(is_crit, dmg * 2, dmg) * active
+        def_hp -= dmg
+        dealt += dmg
+        crits += is_crit & active
+        back = active & (def_hp > 0)
+        dmg_b = np.maximum(1, np.trunc(dfn["attack"] * rng.uniform(0.8, 1.2, shape) - atk["defense"] * 0.3)).astype(np.int64) * back
+        atk_hp -= dmg_b
+        received += dmg_b
+    return {"won": def_hp <= 0, "rounds": rounds, "dealt": dealt, "received": received,
+            "crits": crits, "hp_left": np.maximum(0, atk_hp)}
+
+
+def _summary(res: dict, i: int) -> dict:
+    won, rounds = res["won"][i], res["rounds"][i]
+    dealt, received = res["dealt"][i], res["received"][i]
+    return {
+        "win_rate": float(won.mean()),
+        "rounds_mean": float(rounds.mean()),
+        "rounds_hist": np.bincount(rounds, minlength=MAX_COMBAT_ROUNDS + 1).tolist(),
+        "timeout_rate": float(((rounds == MAX_COMBAT_ROUNDS) & ~won & (res["hp_left"][i] > 0)).mean()),
+        "dealt_mean": float(dealt.mean()), "dealt_p50": float(np.percentile(dealt, 50)), "dealt_p95": float(np.percentile(dealt, 95)),
+        "received_mean": float(received.mean()), "received_p50": float(np.percentile(received, 50)), "received_p95": float(np.percentile(received, 95)),
+        "crits_mean": float(res["crits"][i].mean()),
+        "hp_left_mean": float(res["hp_left"][i].mean()),
+    }
+
+
+def simulate_batch(attacker: dict, defender: dict, n: int = 10000, seed=None) -> dict:
+    """n боёв одной пары бойцов (словари как у simulate_combat)"""
+    rng = np.random.default_rng(seed)
+    return _summary(_simulate(_columns([attacker]), _columns([defender]), n, rng), 0)
+
+
+def _run_chunk(job) -> list:
+    pairs, n, seed_seq = job
+    res = _simulate(_columns([a for a, _ in pairs]), _columns([d for _, d in pairs]), n, np.random.default_rng(seed_seq))
+    return [_summary(res, i) for i in range(len(pairs))]
+
+
+def simulate_matchups(pairs: list, n: int = 2000, seed=None, workers: int = 1) -> list:
+    """Пакет пар [(attacker, defender), ...] по n боёв каждая; workers > 1 — в нескольких процессах"""
+    if not pairs: return []
+    chunks = [pairs[i:i + _CHUNK] for i in range(0, len(pairs), _CHUNK)]
+    jobs = [(c, n, s) for c, s in zip(chunks, np.random.SeedSequence(seed).spawn(len(chunks)))]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(min(workers, len(jobs))) as ex:
+            parts = list(ex.map(_run_chunk, jobs))
+    else:
+        parts = map(_run_chunk, jobs)
+    return [r for part in parts for r in part]
+
+
+def player_stats(class_id: str, level: int, equip: dict = None) -> dict:
+    return get_total_stats(get_class_stats(class_id, level), equip or {})
+
+
+def zone_grid(levels, n: int = 2000, equip: dict = None, seed=None, workers: int = 1) -> list:
+    """Класс × уровень × монстр (и босс) каждой доступной зоны"""
+    rows, pairs = [], []
+    for cid in CLASSES:
+        for lvl in levels:
+            ps = player_stats(cid, lvl, equip)
+            for z in ZONES:
+                if lvl < z["min_level"]: continue
+                for mon, is_boss in [(m, False) for m in z["monsters"]] + [(z["boss"], True)]:
+                    ms = {"hp": mon["hp"], "attack": mon["attack"], "defense": mon["defense"], "crit": 5.0 if is_boss else 3.0}
+                    rows.append({"class": cid, "level": lvl, "zone": z["id"], "monster": mon["name"], "boss": is_boss})
+                    pairs.append((ps, ms))
+    for row, stats in zip(rows, simulate_matchups(pairs, n, seed, workers)):
+        row.update(stats)
+    return rows
+
+
+def tower_grid(levels, floors=range(1, 101), n: int = 2000, equip: dict = None, seed=None, workers: int = 1) -> list:
+    """Класс × уровень × этаж башни"""
+    rows, pairs = [], []
+    monsters = {f: get_tower_monster(f) for f in floors}
+    for cid in CLASSES:
+        for lvl in levels:
+            ps = player_stats(cid, lvl, equip)
+            for f, m in monsters.items():
+                rows.append({"class": cid, "level": lvl, "floor": f, "boss": f % 10 == 0})
+                pairs.append((ps, m))
+    for row, stats in zip(rows, simulate_matchups(pairs, n, seed, workers)):
+        row.update(stats)
+    return rows
+
+
+def _int_list(text: str) -> list:
+    out = []
+    for part in text.split(","):
+        lo, _, hi = part.partition("-")
+        out += list(range(int(lo), int(hi) + 1)) if hi else [int(lo)]
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Пакетная симуляция боёв для баланса")
+    ap.add_argument("mode", choices=["zones", "tower"])
+    ap.add_argument("--levels", default="1,10,22,35,50,65,80,100")
+    ap.add_argument("--floors", default="1-100")
+    ap.add_argument("--fights", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--workers", type=int, default=1)
+    args = ap.parse_args()
+    levels = _int_list(args.levels)
+    if args.mode == "zones":
+        rows = zone_grid(levels, args.fights, seed=args.seed, workers=args.workers)
+        print(f"{'class':<9}{'lvl':>4}{'zone':>5}  {'monster':<24}{'win%':>7}{'rounds':>8}{'dmg in':>9}{'hp left':>9}")
+        for r in rows:
+            print(f"{r['class']:<9}{r['level']:>4}{r['zone']:>5}  {r['monster'][:23]:<24}{r['win_rate']*100:>6.1f}%{r['rounds_mean']:>8.1f}{r['received_mean']:>9.0f}{r['hp_left_mean']:>9.0f}")
+    else:
+        rows = tower_grid(levels, _int_list(args.floors), args.fights, seed=args.seed, workers=args.workers)
+        print(f"{'class':<9}{'lvl':>4}{'floor':>6}{'win%':>8}{'rounds':>8}{'dmg in':>9}")
+        for r in rows:
+            print(f"{r['class']:<9}{r['level']:>4}{r['floor']:>6}{r['win_rate']*100:>7.1f}%{r['rounds_mean']:>8.1f}{r['received_mean']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
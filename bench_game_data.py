@@ -0,0 +1,144 @@
+"""
+⏱ Микробенчмарки game_data MMO RPG v2
+Каждая функция гоняется по реалистичным входам: все классы и уровни, все зоны,
+этажи башни 1–100, все редкости и экспедиции. Время на вызов сравнивается с
+bench_baseline.json; код выхода 1, если что-то медленнее базы больше чем на --threshold.
+
+    python bench_game_data.py                 # сравнить с базой
+    python bench_game_data.py -k combat       # только бенчмарки с подстрокой в имени
+    python bench_game_data.py --update        # перезаписать базу
+
+Время хранится в единицах эталонного цикла на чистом Python (поле "rel"),
+так что база, снятая на одной машине, пригодна и на другой.
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import game_data as gd
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+_SEED = 20240101
+_TARGET = 0.01  # секунд на один замер
+
+
+def _inputs() -> dict:
+    """Имя бенчмарка -> (входы, функция(вход, rng)). Входы перебираются по кругу"""
+    rng = gd.RngStream(_SEED)
+    levels = [1, 5, 10, 20, 35, 50, 75, 100]
+    fighters = [gd.get_total_stats(gd.get_class_stats(c, lvl), {}) for c in gd.CLASSES for lvl in levels]
+    monsters = [{**m, "crit": 3.0} for z in gd.ZONES for m in z["monsters"]]
+    duels = [(f, m) for f in fighters for m in monsters]
+    items = [gd.generate_item(r, t, rng) for r in gd.RARITIES for t in gd.TYPE_EMOJI for _ in range(4)]
+    equips = [{"attack": i["bonus_attack"], "defense": i["bonus_defense"], "hp": i["bonus_hp"], "crit": i["bonus_crit"]} for i in items]
+    zones, floors = [z["id"] for z in gd.ZONES], list(range(1, 101))
+    return {
+        "simulate_combat": (duels, lambda d, r: gd.simulate_combat(d[0], d[1], r)),
+        "simulate_combat_tower": ([(f, gd.get_tower_monster(fl, rng)) for f in fighters for fl in range(1, 101, 9)],
+                                  lambda d, r: gd.simulate_combat(d[0], d[1], r)),
+        "pick_monster": (zones, gd.pick_monster),
+        "try_drop_item": (zones, gd.try_drop_item),
+        "get_available_zones": (list(range(1, 101)), lambda lvl, r: gd.get_available_zones(lvl)),
+        "get_tower_monster": (floors, gd.get_tower_monster),
+        "tower_rewards": (floors, gd.tower_rewards),
+        "get_class_stats": ([(c, lvl) for c in gd.CLASSES for lvl in range(1, 101)], lambda a, r: gd.get_class_stats(*a)),
+        "get_total_stats": ([(gd.get_class_stats(c, lvl), e) for c in gd.CLASSES for lvl in levels for e in equips[:10]],
+                            lambda a, r: gd.get_total_stats(*a)),
+        "xp_for_level": (list(range(1, 101)), lambda lvl, r: gd.xp_for_level(lvl)),
+        "generate_item": ([(rar, t) for rar in gd.RARITIES for t in gd.TYPE_EMOJI], lambda a, r: gd.generate_item(a[0], a[1], r)),
+        "gacha_pull": ([False, True], gd.gacha_pull),
+        "gacha_pull_10x": ([None], lambda _, r: gd.gacha_pull_10x(r)),
+        "spin_wheel": ([None], lambda _, r: gd.spin_wheel(r)),
+        "generate_daily_quests": ([1, 2, 3], gd.generate_daily_quests),
+        "generate_expedition_rewards": ([e["id"] for e in gd.EXPEDITIONS], gd.generate_expedition_rewards),
+        "format_item_short": (items, lambda i, r: gd.format_item_short(i)),
+        "format_item_stats": (items, lambda i, r: gd.format_item_stats(i)),
+        "hp_bar": ([(cur, 500) for cur in range(-50, 551, 7)], lambda a, r: gd.hp_bar(*a)),
+        "derive_seed": ([(uid, "hunt", s) for uid in range(10) for s in range(10)], lambda a, r: gd.derive_seed(*a)),
+        "rng_for": (list(range(100)), lambda uid, r: gd.rng_for(uid, "hunt")),
+    }
+
+
+def _loop(inputs, fn, rng, n) -> float:
+    """Время n вызовов; сборщик мусора выключен, как в timeit"""
+    k, gc_was = len(inputs), gc.isenabled()
+    gc.disable()
+    try:
+        t = time.perf_counter()
+        for i in range(n): fn(inputs[i % k], rng)
+        return time.perf_counter() - t
+    finally:
+        if gc_was: gc.enable()
+
+
+def _unit(x, rng):
+    """Эталонный цикл на чистом Python — единица для поля rel"""
+    s = 0
+    for j in range(100): s += j * x
+    return s
+
+
+def _calls(inputs, fn, rng) -> int:
+    """Сколько вызовов укладывается в _TARGET секунд"""
+    n = 1
+    while _loop(inputs, fn, rng, n) < _TARGET / 10: n *= 4
+    return max(1, int(n * _TARGET / max(_loop(inputs, fn, rng, n), 1e-9)))
+
+
+def measure(inputs, fn, repeat: int) -> tuple:
+    """(секунд на вызов, в единицах эталонного цикла). Замеры функции и эталона чередуются:
+    rel — медиана отношений соседних замеров, так что дрейф частоты процессора и
+    случайные задержки почти не влияют на сравнение с базой"""
+    rng, unit_in = gd.RngStream(_SEED), [1, 2, 3]
+    n, m = _calls(inputs, fn, rng), _calls(unit_in, _unit, rng)
+    times, ratios = [], []
+    for _ in range(repeat):
+        unit = _loop(unit_in, _unit, rng, m) / m
+        times.append(_loop(inputs, fn, rng, n) / n)
+        ratios.append(times[-1] / unit)
+    return min(times), statistics.median(ratios)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Микробенчмарки game_data")
+    ap.add_argument("-k", default="", help="только бенчмарки с подстрокой в имени")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--threshold", type=float, default=0.25, help="допустимое замедление (0.25 = +25%%)")
+    ap.add_argument("--update", action="store_true", help="записать результаты как новую базу")
+    ap.add_argument("--baseline", default=BASELINE)
+    args = ap.parse_args()
+
+    base = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f: base = json.load(f)["results"]
+    results, slow = {}, []
+    print(f"{'бенчмарк':<30}{'мкс/вызов':>11}{'rel':>9}{'база':>9}{'Δ':>8}")
+    for name, (inputs, fn) in _inputs().items():
+        if args.k not in name: continue
+        sec, rel = measure(inputs, fn, args.repeat)
+        results[name] = {"us": round(sec * 1e6, 3), "rel": round(rel, 4)}
+        was = base.get(name, {}).get("rel")
+        delta = f"{(rel / was - 1) * 100:+.0f}%" if was else "new"
+        if was and rel > was * (1 + args.threshold): slow.append(name); delta += " ❌"
+        print(f"{name:<30}{sec * 1e6:>11.2f}{rel:>9.3f}{f'{was:.3f}' if was else '—':>9}{delta:>8}")
+
+    if args.update:
+        merged = {**base, **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": merged},
+                      f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n💾 База обновлена: {args.baseline}")
+        return 0
+    if slow:
+        print(f"\n❌ Медленнее базы больше чем на {args.threshold:.0%}: {', '.join(slow)}")
+        return 1
+    print("\n✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,22 +3,26 @@
 Охота (8 зон, боссы), Арена PvP, Башня 100 этажей, Квесты,
 Экспедиции (AFK), Колесо фортуны, Гача, Крафт, Аукцион, Магазин Stars
 """
-import asyncio, logging, random
+import asyncio, logging, time
 from datetime import datetime
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, CommandStart
-from aiogram.types import InlineKeyboardMarkup as IKM, InlineKeyboardButton as IKB, LabeledPrice, PreCheckoutQuery
+from aiogram.types import InlineKeyboardMarkup as IKM, InlineKeyboardButton as IKB, LabeledPrice, PreCheckoutQuery, BufferedInputFile
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-import config, database as db
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+import config, database as db, metrics, profiler, sharding
+from scheduler import Scheduler
+from user_locks import UserLocks
 from game_data import (
-    CLASSES, ZONES, RARITY_EMOJI, RARITY_NAMES, SELL_PRICES, TYPE_EMOJI, TYPE_NAMES,
+    CLASSES, ZONES_BY_ID, EXPEDITIONS_BY_ID, RARITY_EMOJI, RARITY_NAMES, SELL_PRICES, TYPE_EMOJI, TYPE_NAMES,
     EXPEDITIONS, WHEEL_PRIZES, UPGRADE_COSTS, UPGRADE_NEXT, AUCTION_PRICE_TIERS,
     get_class_stats, get_available_zones, pick_monster, xp_for_level,
     simulate_combat, get_total_stats, gacha_pull, gacha_pull_10x,
     hp_bar, format_item_short, format_item_stats, try_drop_item,
     get_tower_monster, tower_rewards, generate_item, spin_wheel,
-    generate_daily_quests, generate_expedition_rewards,
+    generate_daily_quests, generate_expedition_rewards, rng_for,
     GACHA_FREE_COST, GACHA_PREM_COST, GACHA_10X_COST,
 )
 
@@ -26,6 +30,11 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
+# Очередь игрока — снаружи замера: повторные нажатия не попадают в время хэндлеров
+dp.callback_query.outer_middleware(UserLocks())
+dp.callback_query.outer_middleware(metrics.HandlerTimer())
+dp.message.outer_middleware(metrics.HandlerTimer(skip=("/perf",)))
+timers = Scheduler()
 
 # ======== КЛАВИАТУРЫ ========
 def kb_main():
@@ -41,10 +50,30 @@ def kb_main():
 def kb_back():
     return IKM(inline_keyboard=[[IKB(text="🏠 Меню", callback_data="menu")]])
 
+def combat_stats(player):
+    return get_total_stats(get_class_stats(player["class"], player["level"]), db.equipment_bonuses(player))
+
 async def get_combat_stats(user_id):
     player = await db.get_player(user_id)
     if not player: return {}
-    return get_total_stats(get_class_stats(player["class"], player["level"]), await db.get_equipment_bonuses(user_id))
+    return combat_stats(player)
+
+def action_rng(user_id, action):
+    """Поток ГСЧ для действия; сид в логе позволяет переиграть бой и лут: RngStream(seed)"""
+    rng = rng_for(user_id, action)
+    logger.info("rng %s user=%s seed=%s", action, user_id, rng.seed_value)
+    return rng
+
+async def commit_action(cb, act):
+    """Записать действие и ответить на колбэк. Если строку игрока успели изменить
+    (act.commit() вернул False), ничего не записано — сообщаем алертом"""
+    if await act.commit(): await cb.answer(); return True
+    await cb.answer("⚠️ Состояние изменилось, попробуй ещё раз", show_alert=True)
+    return False
+
+def snapshot_age(seconds):
+    if seconds is None: return "🕒 Рейтинг ещё считается"
+    return "🕒 Обновлено только что" if seconds < 60 else f"🕒 Обновлено {seconds // 60} мин назад"
 
 async def track_quest(user_id, qtype, amount=1):
     await db.update_quest_progress(user_id, qtype, amount)
@@ -113,39 +142,43 @@ async def cb_hunt(cb: types.CallbackQuery):
 async def cb_hz(cb: types.CallbackQuery):
     zid = int(cb.data[3:])
     uid = cb.from_user.id
-    p = await db.get_player(uid)
+    act = await db.action(uid); p = act.player
     if not p: return
-    zone = next((z for z in ZONES if z["id"]==zid), None)
+    zone = ZONES_BY_ID.get(zid)
     if not zone or p["level"]<zone["min_level"]: await cb.answer(f"Нужен Lv.{zone['min_level']}!",show_alert=True); return
     e = db.calculate_energy(p)
     if e < config.HUNT_ENERGY_COST: await cb.answer(f"⚡ Мало энергии! ({e}/{config.HUNT_ENERGY_COST})",show_alert=True); return
-    await cb.answer()
-    await db.spend_energy(uid, config.HUNT_ENERGY_COST, e)
-    monster, is_boss = pick_monster(zid)
-    ps = await get_combat_stats(uid)
+    act.spend_energy(config.HUNT_ENERGY_COST, e)
+    rng = action_rng(uid, "hunt")
+    monster, is_boss = pick_monster(zid, rng)
+    ps = combat_stats(p)
     ms = {"hp": monster["hp"], "attack": monster["attack"], "defense": monster["defense"], "crit": 5.0 if is_boss else 3.0}
-    r = simulate_combat(ps, ms)
+    r = simulate_combat(ps, ms, rng)
     boss_tag = " 👑БОСС!" if is_boss else ""
     if r["won"]:
         gold, xp = monster["gold"], monster["xp"]
         # Крит лут (10%)
-        crit_loot = random.randint(1,100) <= 10
+        crit_loot = rng.randint(1,100) <= 10
         if crit_loot: gold *= 2; xp = int(xp * 1.5)
-        await db.add_gold(uid, gold); lvls = await db.add_xp(uid, xp); await db.record_hunt(uid)
-        await track_quest(uid, "hunt")
-        drop = try_drop_item(zid)
+        act.add_gold(gold); lvls = act.add_xp(xp); act.record_hunt()
+        act.quest("hunt")
+        drop = try_drop_item(zid, rng)
         dt = ""
-        if drop: await db.add_item(uid, drop); dt = f"\n🎁 <b>Дроп:</b> {format_item_short(drop)} ({format_item_stats(drop)})"
+        if drop: act.add_item(drop); dt = f"\n🎁 <b>Дроп:</b> {format_item_short(drop)} ({format_item_stats(drop)})"
         lt = ""
         for l in lvls:
-            await db.add_gold(uid, config.GOLD_PER_LEVELUP); await db.add_crystals(uid, config.CRYSTALS_PER_LEVELUP)
+            act.add_gold(config.GOLD_PER_LEVELUP); act.add_crystals(config.CRYSTALS_PER_LEVELUP)
             lt += f"\n🎉 <b>Уровень {l}!</b> +{config.GOLD_PER_LEVELUP}💰 +{config.CRYSTALS_PER_LEVELUP}💎"
+        if not await commit_action(cb, act): return
+        schedule_energy(uid, db.energy_full_at(p))
         cl = crit_loot and "💎 <b>Критический лут! x2 золота!</b>\n" or ""
         log = "\n".join(r["log"][:5])
-        ne = db.calculate_energy(await db.get_player(uid))
+        ne = db.calculate_energy(p)
         t = f"⚔️ <b>{monster['emoji']} {monster['name']}</b>{boss_tag}\n\n{log}\n\n✅ <b>ПОБЕДА!</b> ({r['rounds']}р)\n❤️ {r['hp_left']}/{r['hp_max']} [{hp_bar(r['hp_left'],r['hp_max'])}]\n\n{cl}💰+{gold} ✨+{xp}XP{dt}{lt}\n⚡ {ne}/{p['max_energy']}"
     else:
-        ne = db.calculate_energy(await db.get_player(uid))
+        if not await commit_action(cb, act): return
+        schedule_energy(uid, db.energy_full_at(p))
+        ne = db.calculate_energy(p)
         log = "\n".join(r["log"][:5])
         t = f"⚔️ <b>{monster['emoji']} {monster['name']}</b>{boss_tag}\n\n{log}\n\n❌ <b>ПОРАЖЕНИЕ!</b>\n💡 Улучши экипировку!\n⚡ {ne}/{p['max_energy']}"
     kb = IKM(inline_keyboard=[[IKB(text="🗺 Ещё", callback_data="hunt")],[IKB(text="🏠 Меню", callback_data="menu")]])
@@ -170,14 +203,12 @@ async def cb_afight(cb: types.CallbackQuery):
     uid = cb.from_user.id
     fl = await db.get_arena_fights_left(uid)
     if fl <= 0: await cb.answer("Бои закончились!",show_alert=True); return
-    opp = await db.get_arena_opponent(uid)
+    rng = action_rng(uid, "arena")
+    opp = await db.get_arena_opponent(uid, rng)
     if not opp: await cb.answer("Нет противников!",show_alert=True); return
     await cb.answer()
     ms = await get_combat_stats(uid)
-    ob = get_class_stats(opp["class"], opp["level"])
-    oe = await db.get_equipment_bonuses(opp["user_id"])
-    os_ = get_total_stats(ob, oe)
-    r = simulate_combat(ms, os_)
+    r = simulate_combat(ms, opp["stats"], rng)
     oc = CLASSES[opp["class"]]; on = opp["first_name"] or opp["username"] or "???"
     log = "\n".join(r["log"][:5])
     if r["won"]:
@@ -210,29 +241,30 @@ async def cb_tower(cb: types.CallbackQuery):
 @dp.callback_query(F.data == "tw_go")
 async def cb_tw_go(cb: types.CallbackQuery):
     uid = cb.from_user.id
-    att = await db.get_tower_attempts(uid)
-    if att <= 0: await cb.answer("Попытки закончились!",show_alert=True); return
-    await cb.answer()
-    p = await db.get_player(uid); nf = p["tower_floor"] + 1
-    m = get_tower_monster(nf); ps = await get_combat_stats(uid)
+    act = await db.action(uid); p = act.player
+    if not p or db.daily_left(p, "tower") <= 0: await cb.answer("Попытки закончились!",show_alert=True); return
+    nf = p["tower_floor"] + 1
+    rng = action_rng(uid, "tower")
+    m = get_tower_monster(nf, rng); ps = combat_stats(p)
     ms = {"hp": m["hp"], "attack": m["attack"], "defense": m["defense"], "crit": m.get("crit",3)}
-    r = simulate_combat(ps, ms)
-    await db.use_tower_attempt(uid)
+    r = simulate_combat(ps, ms, rng)
+    act.use_tower_attempt()
     log = "\n".join(r["log"][:5])
     if r["won"]:
-        await db.advance_tower(uid)
-        rw = tower_rewards(nf)
-        await db.add_gold(uid, rw["gold"]); await db.add_crystals(uid, rw["crystals"])
-        await db.add_xp(uid, rw["xp"])
-        await track_quest(uid, "tower")
+        act.advance_tower()
+        rw = tower_rewards(nf, rng)
+        act.add_gold(rw["gold"]); act.add_crystals(rw["crystals"])
+        act.add_xp(rw["xp"])
+        act.quest("tower")
         dt = ""
         if rw["drop_item"]:
-            item = generate_item(rw["drop_rarity"])
-            await db.add_item(uid, item)
+            item = generate_item(rw["drop_rarity"], rng=rng)
+            act.add_item(item)
             dt = f"\n🎁 {format_item_short(item)} ({format_item_stats(item)})"
         t = f"🏰 <b>Этаж {nf}</b> — {m['name']}\n\n{log}\n\n✅ <b>ПРОЙДЕН!</b>\n💰+{rw['gold']} ✨+{rw['xp']}XP 💎+{rw['crystals']}{dt}"
     else:
         t = f"🏰 <b>Этаж {nf}</b> — {m['name']}\n\n{log}\n\n❌ <b>Не пройден!</b>\nСтань сильнее и попробуй снова!"
+    if not await commit_action(cb, act): return
     try: await cb.message.edit_text(t, reply_markup=IKM(inline_keyboard=[[IKB(text="🏰 Башня",callback_data="tower")],[IKB(text="🏠 Меню",callback_data="menu")]]))
     except: pass
 
@@ -243,9 +275,7 @@ async def cb_quests(cb: types.CallbackQuery):
     uid = cb.from_user.id
     quests = await db.get_daily_quests(uid)
     if not quests:
-        ql = generate_daily_quests(3)
-        await db.create_daily_quests(uid, ql)
-        quests = await db.get_daily_quests(uid)
+        quests = await db.create_daily_quests(uid, generate_daily_quests(3, action_rng(uid, "quests")))
     lines = ["📜 <b>Ежедневные квесты</b>\n"]
     btns = []
     for q in quests:
@@ -277,7 +307,7 @@ async def cb_exped(cb: types.CallbackQuery):
     if active:
         done = db.is_expedition_done(active)
         tl = db.expedition_time_left(active)
-        exp = next((e for e in EXPEDITIONS if e["id"]==active["exp_type"]),None)
+        exp = EXPEDITIONS_BY_ID.get(active["exp_type"])
         name = exp["name"] if exp else "???"
         btns = []
         if done:
@@ -296,13 +326,15 @@ async def cb_exped(cb: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("exps_"))
 async def cb_exp_start(cb: types.CallbackQuery):
     eid = cb.data[5:]
-    exp = next((e for e in EXPEDITIONS if e["id"]==eid), None)
+    exp = EXPEDITIONS_BY_ID.get(eid)
     if not exp: await cb.answer("Ошибка!",show_alert=True); return
     active = await db.get_active_expedition(cb.from_user.id)
     if active: await cb.answer("Уже есть активная экспедиция!",show_alert=True); return
     await cb.answer()
-    rewards = generate_expedition_rewards(eid)
-    await db.start_expedition(cb.from_user.id, eid, exp["duration"], rewards)
+    rewards = generate_expedition_rewards(eid, action_rng(cb.from_user.id, "expedition"))
+    started = await db.start_expedition(cb.from_user.id, eid, exp["duration"], rewards)
+    if not started: return
+    schedule_expedition(started)
     t = f"🌍 <b>Экспедиция начата!</b>\n\n📋 {exp['name']}\n⏰ Длительность: {exp['duration']} мин\n\nВозвращайся позже за наградой!"
     try: await cb.message.edit_text(t, reply_markup=IKM(inline_keyboard=[[IKB(text="🏠 Меню",callback_data="menu")]]))
     except: pass
@@ -312,16 +344,19 @@ async def cb_exp_collect(cb: types.CallbackQuery):
     uid = cb.from_user.id
     active = await db.get_active_expedition(uid)
     if not active or not db.is_expedition_done(active): await cb.answer("Ещё не готово!",show_alert=True); return
-    await cb.answer()
-    await db.collect_expedition(uid, active["id"])
-    await db.add_gold(uid, active["reward_gold"]); await db.add_crystals(uid, active["reward_crystals"])
-    await db.add_xp(uid, active["reward_xp"])
-    await track_quest(uid, "expedition")
+    act = await db.action(uid)
+    if not act.player: await cb.answer(); return
+    act.collect_expedition(active["id"])
+    act.add_gold(active["reward_gold"]); act.add_crystals(active["reward_crystals"])
+    act.add_xp(active["reward_xp"])
+    act.quest("expedition")
     dt = ""
     if active["reward_item_rarity"]:
-        item = generate_item(active["reward_item_rarity"])
-        await db.add_item(uid, item)
+        item = generate_item(active["reward_item_rarity"], rng=action_rng(uid, "expedition_item"))
+        act.add_item(item)
         dt = f"\n🎁 {format_item_short(item)} ({format_item_stats(item)})"
+    if not await commit_action(cb, act): return
+    timers.cancel(("exp", uid))
     t = f"🌍 <b>Экспедиция завершена!</b>\n\n💰+{active['reward_gold']} 💎+{active['reward_crystals']} ✨+{active['reward_xp']}XP{dt}"
     try: await cb.message.edit_text(t, reply_markup=IKM(inline_keyboard=[[IKB(text="🌍 Новая экспедиция",callback_data="exped")],[IKB(text="🏠 Меню",callback_data="menu")]]))
     except: pass
@@ -341,24 +376,26 @@ async def cb_wheel(cb: types.CallbackQuery):
 @dp.callback_query(F.data == "wspin")
 async def cb_wspin(cb: types.CallbackQuery):
     uid = cb.from_user.id
-    can = await db.can_spin_wheel(uid)
-    if not can: await cb.answer("Уже крутил сегодня!",show_alert=True); return
-    await cb.answer()
-    await db.use_wheel_spin(uid)
-    prize = spin_wheel()
+    act = await db.action(uid); p = act.player
+    if not p or not db.wheel_available(p): await cb.answer("Уже крутил сегодня!",show_alert=True); return
+    act.use_wheel_spin()
+    rng = action_rng(uid, "wheel")
+    prize = spin_wheel(rng)
     t = f"🎡 <b>Колесо крутится...</b>\n\n🎯 Выпало: <b>{prize['name']}</b>\n\n"
     if prize["type"] == "gold":
-        await db.add_gold(uid, prize["amount"]); t += f"💰 +{prize['amount']} золота!"
+        act.add_gold(prize["amount"]); t += f"💰 +{prize['amount']} золота!"
     elif prize["type"] == "crystals":
-        await db.add_crystals(uid, prize["amount"]); t += f"💎 +{prize['amount']} кристаллов!"
+        act.add_crystals(prize["amount"]); t += f"💎 +{prize['amount']} кристаллов!"
     elif prize["type"] == "energy":
-        p = await db.get_player(uid); cur = db.calculate_energy(p)
-        await db.set_energy(uid, min(p["max_energy"], cur + prize["amount"])); t += f"⚡ +{prize['amount']} энергии!"
+        cur = db.calculate_energy(p)
+        act.set_energy(min(p["max_energy"], cur + prize["amount"])); t += f"⚡ +{prize['amount']} энергии!"
     elif prize["type"] == "item":
-        item = generate_item(prize["rarity"]); await db.add_item(uid, item)
+        item = generate_item(prize["rarity"], rng=rng); act.add_item(item)
         t += f"🎁 {format_item_short(item)}\n{format_item_stats(item)}"
     else:
         t += "Увы, в этот раз не повезло... 😤"
+    if not await commit_action(cb, act): return
+    if prize["type"] == "energy": schedule_energy(uid, db.energy_full_at(p))
     try: await cb.message.edit_text(t, reply_markup=kb_back())
     except: pass
 
@@ -378,21 +415,21 @@ async def cb_gacha(cb: types.CallbackQuery):
 @dp.callback_query(F.data == "gfree")
 async def cb_gfree(cb: types.CallbackQuery):
     if not await db.spend_gold(cb.from_user.id, GACHA_FREE_COST): await cb.answer("Мало золота!",show_alert=True); return
-    await cb.answer(); item = gacha_pull(False); await db.add_item(cb.from_user.id, item); await track_quest(cb.from_user.id, "gacha")
+    await cb.answer(); item = gacha_pull(False, action_rng(cb.from_user.id, "gacha")); await db.add_item(cb.from_user.id, item); await track_quest(cb.from_user.id, "gacha")
     try: await cb.message.edit_text(f"🎰 <b>Призыв!</b>\n\n{format_item_short(item)}\n{RARITY_EMOJI[item['rarity']]} {RARITY_NAMES[item['rarity']]}\n📊 {format_item_stats(item)}", reply_markup=IKM(inline_keyboard=[[IKB(text="🎰 Ещё",callback_data="gacha")],[IKB(text="🏠 Меню",callback_data="menu")]]))
     except: pass
 
 @dp.callback_query(F.data == "gprem")
 async def cb_gprem(cb: types.CallbackQuery):
     if not await db.spend_crystals(cb.from_user.id, GACHA_PREM_COST): await cb.answer("Мало кристаллов!",show_alert=True); return
-    await cb.answer(); item = gacha_pull(True); await db.add_item(cb.from_user.id, item); await track_quest(cb.from_user.id, "gacha")
+    await cb.answer(); item = gacha_pull(True, action_rng(cb.from_user.id, "gacha")); await db.add_item(cb.from_user.id, item); await track_quest(cb.from_user.id, "gacha")
     try: await cb.message.edit_text(f"💎 <b>Премиум призыв!</b>\n\n{format_item_short(item)}\n{RARITY_EMOJI[item['rarity']]} {RARITY_NAMES[item['rarity']]}\n📊 {format_item_stats(item)}", reply_markup=IKM(inline_keyboard=[[IKB(text="🎰 Ещё",callback_data="gacha")],[IKB(text="🏠 Меню",callback_data="menu")]]))
     except: pass
 
 @dp.callback_query(F.data == "g10x")
 async def cb_g10x(cb: types.CallbackQuery):
     if not await db.spend_crystals(cb.from_user.id, GACHA_10X_COST): await cb.answer("Мало кристаллов!",show_alert=True); return
-    await cb.answer(); items = gacha_pull_10x()
+    await cb.answer(); items = gacha_pull_10x(action_rng(cb.from_user.id, "gacha10"))
     lines = []
     for item in items:
         await db.add_item(cb.from_user.id, item); lines.append(f"{format_item_short(item)} — {format_item_stats(item)}")
@@ -497,7 +534,7 @@ async def cb_upgr(cb: types.CallbackQuery):
     await cb.answer()
     to_delete = [i["id"] for i in items[:3]]
     await db.delete_items(to_delete)
-    new_item = generate_item(nr)
+    new_item = generate_item(nr, rng=action_rng(uid, "upgrade"))
     await db.add_item(uid, new_item)
     t = f"⛏️ <b>Улучшение!</b>\n\n3×{RARITY_EMOJI[r]} → {RARITY_EMOJI[nr]}\n\n🎁 Получен:\n{format_item_short(new_item)}\n📊 {format_item_stats(new_item)}\n\n💰 -{cost} золота"
     try: await cb.message.edit_text(t, reply_markup=IKM(inline_keyboard=[[IKB(text="⛏️ Ещё",callback_data="upgrade")],[IKB(text="🏠 Меню",callback_data="menu")]]))
@@ -596,7 +633,7 @@ async def cb_prof(cb: types.CallbackQuery):
     p = await db.get_player(uid)
     if not p or not p["class"]: return
     cls = CLASSES[p["class"]]; base = get_class_stats(p["class"],p["level"])
-    eq = await db.get_equipment_bonuses(uid); tot = get_total_stats(base, eq)
+    eq = db.equipment_bonuses(p); tot = get_total_stats(base, eq)
     e = db.calculate_energy(p); xn = xp_for_level(p["level"])
     eqi = await db.get_equipped_items(uid); ic = await db.count_inventory(uid)
     el = ""
@@ -614,22 +651,24 @@ async def cb_prof(cb: types.CallbackQuery):
 @dp.callback_query(F.data == "top")
 async def cb_top(cb: types.CallbackQuery):
     await cb.answer(); leaders = await db.get_leaderboard_xp(10); rank = await db.get_player_rank(cb.from_user.id)
+    age = await db.get_leaderboard_age("level")
     medals = ["🥇","🥈","🥉"]; lines = []
     for i,p in enumerate(leaders):
         m = medals[i] if i<3 else f"#{i+1}"; ce = CLASSES.get(p["class"],{}).get("name","?").split()[0]; n = p["first_name"] or "???"
         lines.append(f"{m} {ce} <b>{n}</b> Lv.{p['level']} 🏅{p['arena_rating']} 🏰{p['tower_floor']}")
-    t = "🏆 <b>Топ игроков</b>\n\n" + ("\n".join(lines) or "Пусто") + f"\n\n👤 Ты: #{rank}"
+    t = "🏆 <b>Топ игроков</b>\n\n" + ("\n".join(lines) or "Пусто") + f"\n\n👤 Ты: #{rank or '—'}\n{snapshot_age(age)}"
     try: await cb.message.edit_text(t, reply_markup=IKM(inline_keyboard=[[IKB(text="⚔️ Топ арены",callback_data="top_a")],[IKB(text="🏠 Меню",callback_data="menu")]]))
     except: pass
 
 @dp.callback_query(F.data == "top_a")
 async def cb_top_a(cb: types.CallbackQuery):
-    await cb.answer(); leaders = await db.get_leaderboard_arena(10)
+    await cb.answer(); leaders = await db.get_leaderboard_arena(10); rank = await db.get_player_rank(cb.from_user.id, "arena")
+    age = await db.get_leaderboard_age("arena")
     medals = ["🥇","🥈","🥉"]; lines = []
     for i,p in enumerate(leaders):
         m = medals[i] if i<3 else f"#{i+1}"; n = p["first_name"] or "???"; wr = round(p["arena_wins"]/max(1,p["arena_wins"]+p["arena_losses"])*100)
         lines.append(f"{m} <b>{n}</b> 🏅{p['arena_rating']} W/L:{p['arena_wins']}/{p['arena_losses']} ({wr}%)")
-    try: await cb.message.edit_text("⚔️ <b>Топ арены</b>\n\n"+("\n".join(lines) or "Пусто"), reply_markup=IKM(inline_keyboard=[[IKB(text="🏆 По уровню",callback_data="top")],[IKB(text="🏠 Меню",callback_data="menu")]]))
+    try: await cb.message.edit_text("⚔️ <b>Топ арены</b>\n\n"+("\n".join(lines) or "Пусто")+f"\n\n👤 Ты: #{rank or '—'}\n{snapshot_age(age)}", reply_markup=IKM(inline_keyboard=[[IKB(text="🏆 По уровню",callback_data="top")],[IKB(text="🏠 Меню",callback_data="menu")]]))
     except: pass
 
 # ======== МАГАЗИН ========
@@ -662,7 +701,7 @@ async def succ_pay(msg: types.Message):
         ak = "_".join(pl.split("_")[:2]); pr = config.STARS_SHOP.get(ak)
         if pr: await db.add_crystals(uid, pr["crystals"]); await msg.answer(f"🎉 +{pr['crystals']}💎!", reply_markup=kb_main())
     elif "energy" in pl:
-        await db.set_energy(uid, config.MAX_ENERGY); await msg.answer(f"🎉 ⚡{config.MAX_ENERGY}!", reply_markup=kb_main())
+        await db.set_energy(uid, config.MAX_ENERGY); schedule_energy(uid, None); await msg.answer(f"🎉 ⚡{config.MAX_ENERGY}!", reply_markup=kb_main())
 
 # ======== ПРОЧЕЕ ========
 @dp.callback_query(F.data == "noop")
@@ -681,12 +720,12 @@ async def cmd_prof(msg: types.Message):
 
 @dp.message(Command("top"))
 async def cmd_top(msg: types.Message):
-    leaders = await db.get_leaderboard_xp(10)
+    leaders = await db.get_leaderboard_xp(10); age = await db.get_leaderboard_age("level")
     lines = []
     for i,p in enumerate(leaders):
         m = ["🥇","🥈","🥉"][i] if i<3 else f"#{i+1}"
         lines.append(f"{m} <b>{p['first_name'] or '???'}</b> Lv.{p['level']} 🏅{p['arena_rating']}")
-    await msg.answer("🏆 <b>Топ</b>\n\n"+("\n".join(lines) or "Пусто"), reply_markup=kb_main())
+    await msg.answer("🏆 <b>Топ</b>\n\n"+("\n".join(lines) or "Пусто")+f"\n\n{snapshot_age(age)}", reply_markup=kb_main())
 
 @dp.message(Command("stats"))
 async def cmd_stats(msg: types.Message):
@@ -694,18 +733,146 @@ async def cmd_stats(msg: types.Message):
     s = await db.get_bot_stats()
     await msg.answer(f"📊 Игроков:{s['total_players']} Охот:{s['total_hunts']} Арен:{s['total_arena_fights']}")
 
+@dp.message(Command("eqcheck"))
+async def cmd_eqcheck(msg: types.Message):
+    if msg.from_user.id != config.ADMIN_ID: return
+    drift = await db.check_equipment_bonuses(fix=True)
+    lines = [f"{uid}: {s} → {a}" for uid, (s, a) in list(drift.items())[:20]]
+    await msg.answer(f"🔧 Расхождений бонусов экипировки: {len(drift)} (исправлено)\n" + "\n".join(lines))
+
+@dp.message(Command("perf"))
+async def cmd_perf(msg: types.Message):
+    """/perf [секунд] — семплирующий профайлер; ответ — collapsed stacks для flamegraph"""
+    if msg.from_user.id != config.ADMIN_ID: return
+    if profiler.busy(): await msg.answer("⏳ Профайлер уже запущен"); return
+    arg = (msg.text or "").split()[1:]
+    secs = max(1, min(int(arg[0]) if arg and arg[0].isdigit() else 30, config.PROFILE_MAX_SECONDS))
+    await msg.answer(f"🔬 Профилирую {secs}с...")
+    prof = await profiler.profile(secs, config.PROFILE_INTERVAL_MS / 1000, config.PROFILE_STALL_MS / 1000)
+    s = prof.summary()
+    await msg.answer_document(BufferedInputFile(prof.collapsed(), filename=f"profile-{datetime.now():%Y%m%d-%H%M%S}.collapsed"),
+        caption=f"🔬 Семплов: {s['samples']} (в блокировках: {s['stall_samples']})\n"
+                f"🧱 Блокировок цикла >{config.PROFILE_STALL_MS}мс: {s['stalls']}, макс. {s['max_stall'] * 1000:.0f}мс")
+
 @dp.message(F.text)
 async def handle_txt(msg: types.Message):
     p = await db.get_player(msg.from_user.id)
     if not p or not p["class"]: await msg.answer("👋 /start чтобы начать!")
     else: await msg.answer("⚔️ Используй кнопки!", reply_markup=kb_main())
 
+# ======== УВЕДОМЛЕНИЯ ========
+def schedule_expedition(exp):
+    """Таймер на конец экспедиции (ключ ("exp", user_id))"""
+    uid, exp_id = exp["user_id"], exp["id"]
+    if exp["ends_at"] != float("inf"):
+        timers.schedule(("exp", uid), exp["ends_at"], lambda: expedition_done(uid, exp_id))
+
+async def expedition_done(user_id, exp_id):
+    """Экспедиция завершилась: сообщить игроку (EXPEDITION_NOTIFY), если награда ещё не забрана"""
+    active = await db.get_active_expedition(user_id)
+    if not active or active["id"] != exp_id: return
+    logger.info("Expedition %s of %s done", exp_id, user_id)
+    if not config.EXPEDITION_NOTIFY: return
+    exp = EXPEDITIONS_BY_ID.get(active["exp_type"])
+    t = f"🌍 <b>Экспедиция завершена!</b>\n\n📋 {exp['name'] if exp else '???'}\nНаграда ждёт тебя!"
+    try: await bot.send_message(user_id, t, reply_markup=IKM(inline_keyboard=[[IKB(text="🎁 Забрать награду!", callback_data="exp_col")]]))
+    except Exception as e: logger.info("Notify %s failed: %s", user_id, e)
+
+def schedule_energy(user_id, at):
+    """Таймер на полное восстановление энергии (ключ ("energy", user_id)): каждая трата
+    переносит его, так что игрок получает одно сообщение, когда энергия полная"""
+    if at is None: timers.cancel(("energy", user_id))
+    elif config.ENERGY_NOTIFY: timers.schedule(("energy", user_id), at, lambda: energy_full(user_id))
+
+async def energy_full(user_id):
+    p = await db.get_player(user_id)
+    if not p: return
+    if db.calculate_energy(p) < p["max_energy"]: schedule_energy(user_id, db.energy_full_at(p)); return
+    try: await bot.send_message(user_id, f"⚡ Энергия восстановлена: {p['max_energy']}/{p['max_energy']}!",
+                                reply_markup=IKM(inline_keyboard=[[IKB(text="🗺 Охота", callback_data="hunt")]]))
+    except Exception as e: logger.info("Notify %s failed: %s", user_id, e)
+
 # ======== ЗАПУСК ========
+_started = time.monotonic()
+
+async def health(request):
+    return web.json_response({"status": "ok", "mode": config.RUN_MODE, "uptime": int(time.monotonic() - _started)})
+
+def add_health(app):
+    app.router.add_get("/health", health)
+
+async def serve_updates(host, port, path, secret, background=True):
+    """aiohttp-сервер: апдейты приходят POST-запросами на path. background — ответить сразу
+    и обработать в фоне, иначе ответить после обработки"""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret or None, handle_in_background=background).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    add_health(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+async def run_webhook():
+    if not config.WEBHOOK_URL: raise SystemExit("RUN_MODE=webhook требует WEBHOOK_URL")
+    runner = await serve_updates(config.WEB_HOST, config.WEB_PORT, config.WEBHOOK_PATH, config.WEBHOOK_SECRET)
+    await bot.set_webhook(config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH, secret_token=config.WEBHOOK_SECRET or None,
+                          allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=True)
+    logger.info("🌐 Webhook on %s:%s%s", config.WEB_HOST, config.WEB_PORT, config.WEBHOOK_PATH)
+    try: await asyncio.Event().wait()
+    finally: await runner.cleanup()
+
+async def run_worker():
+    """Воркер шардированного режима: апдейты своих игроков приходят от фронта (sharding.py).
+    Отвечаем после обработки: фронт шлёт следующий апдейт полосы только после ответа"""
+    port = config.SHARD_BASE_PORT + config.WORKER_ID
+    runner = await serve_updates("127.0.0.1", port, sharding.WORKER_PATH, config.SHARD_SECRET, background=False)
+    logger.info("🔀 Worker %s/%s on 127.0.0.1:%s", config.WORKER_ID, config.WORKERS, port)
+    try: await asyncio.Event().wait()
+    finally: await runner.cleanup()
+
 async def main():
-    logger.info("🗄 Init DB..."); await db.init_db()
-    logger.info("⚔️ Starting RPG bot...")
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    metrics.register_commands(dp)
+    worker = config.RUN_MODE == "worker"
+    if config.WORKERS > 1 and not worker:
+        # Схему готовит фронт, один раз: параллельные миграции воркеров мешали бы друг другу
+        logger.info("🗄 Migrate DB..."); await db.migrate_db()
+        await sharding.run_front(bot, dp.resolve_used_update_types(), add_health); return
+    # Фоновые циклы не замеряем: они работают всё время жизни процесса
+    metrics.instrument_module(db, skip=("leaderboard_refresher", "quest_flusher", "quest_rollover", "index_resyncer"))
+    logger.info("🗄 Init DB..."); await db.init_db(migrate=not worker)
+    logger.info("⚔️ Starting RPG bot (%s)...", config.RUN_MODE)
+    # Таймеры — только своих игроков (в шардированном режиме каждый воркер ведёт свою долю).
+    # Завершившиеся, пока бот был выключен, не уведомляем — игрок увидит их в меню
+    mine = lambda uid: sharding.shard_of(uid, config.WORKERS) == config.WORKER_ID
+    for exp in db.active_expeditions():
+        if mine(exp["user_id"]) and not db.is_expedition_done(exp): schedule_expedition(exp)
+    if config.ENERGY_NOTIFY:
+        for uid, at in await db.energy_refills():
+            if mine(uid): schedule_energy(uid, at)
+    timers.start()
+    metrics_port = config.METRICS_PORT + 1 + config.WORKER_ID if worker else config.METRICS_PORT
+    stats_server = await metrics.start_server(config.METRICS_HOST, metrics_port, add_health) if config.METRICS_PORT else None
+    # Прогресс квестов копит в памяти каждый процесс, и квесты на новый день каждый выдаёт своим
+    # игрокам; снимки рейтингов пишет только воркер 0
+    shard = (config.WORKER_ID, config.WORKERS) if worker else None
+    jobs = [asyncio.create_task(db.quest_flusher())]
+    if config.QUEST_PREGENERATE: jobs.append(asyncio.create_task(db.quest_rollover(shard)))
+    if config.WORKER_ID == 0: jobs.append(asyncio.create_task(db.leaderboard_refresher()))
+    if worker: jobs.append(asyncio.create_task(db.index_resyncer(shard)))
+    try:
+        if worker:
+            await run_worker()
+        elif config.RUN_MODE == "webhook":
+            await run_webhook()
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        for job in jobs: job.cancel()
+        await timers.stop()
+        if stats_server: await stats_server.cleanup()
+        await db.close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
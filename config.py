@@ -13,12 +13,56 @@ try:
 except ValueError:
     ADMIN_ID = 0
 
-DATABASE_PATH = "rpg_game.db"
+DATABASE_PATH = os.getenv("DATABASE_PATH", "rpg_game.db")
+DB_READERS = 4  # читающих соединений в пуле
+DB_WRITE_BATCH = 64  # максимум заданий писателя на один коммит
+DB_BEGIN_RETRIES = 4  # попыток взять блокировку записи (каждая ждёт busy_timeout), потом пачка получает ошибку
+
+# Режим запуска: polling — long polling, webhook — aiohttp-сервер принимает апдейты от Telegram
+# (worker — воркер шардированного режима, его задаёт фронт)
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # внешний адрес, например https://rpg.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # заголовок X-Telegram-Bot-Api-Secret-Token
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "8080"))
+
+# Шардирование: при WORKERS > 1 фронт-процесс принимает апдейты и раздаёт их воркерам по user_id % WORKERS
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_ID = int(os.getenv("WORKER_ID", "0"))  # задаёт фронт
+SHARD_SECRET = os.getenv("SHARD_SECRET", "")  # задаёт фронт
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8100"))  # воркер i слушает 127.0.0.1:порт+i
+SHARD_LANES = 16  # апдейтов одного воркера в обработке одновременно (игрок всегда в одной полосе)
+SHARD_RESYNC_SECONDS = 60  # воркеры подтягивают чужие изменения в индексы арены и рейтингов
+
+# Метрики: /metrics в формате Prometheus (порт 0 — не поднимать сервер; воркер i — порт+1+i)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Профайлер (/perf для админа)
+PROFILE_INTERVAL_MS = 5  # шаг семплирования
+PROFILE_STALL_MS = 100  # цикл событий без пульса дольше — блокировка
+PROFILE_MAX_SECONDS = 300
+
+# Кэш игроков в памяти
+PLAYER_CACHE_SIZE = 20000  # записей (LRU)
+PLAYER_CACHE_TTL = 300  # секунд
+
+# Профиль хранилища SQLite (применяется к каждому соединению при открытии)
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -16384,  # в КиБ (16 МБ)
+    "mmap_size": 268435456,  # 256 МБ
+    "temp_store": "MEMORY",
+}
 
 # Энергия
 MAX_ENERGY = 100
 HUNT_ENERGY_COST = 10
 ENERGY_REGEN_MINUTES = 3
+ENERGY_NOTIFY = os.getenv("ENERGY_NOTIFY", "1") == "1"  # писать игроку, когда энергия восстановилась полностью
 
 # Арена
 ARENA_FIGHTS_PER_DAY = 5
@@ -26,6 +70,19 @@ ARENA_WIN_GOLD = 200
 ARENA_WIN_CRYSTALS = 3
 ARENA_WIN_RATING = 15
 ARENA_LOSE_RATING = 10
+ARENA_LEVEL_SPREAD = 5  # соперник в пределах ±уровней
+ARENA_RATING_WINDOW = 10  # иначе — случайный из N ближайших по рейтингу
+
+# Рейтинги
+LEADERBOARD_REFRESH_SECONDS = 300  # снимки топа пересчитываются раз в N секунд
+LEADERBOARD_CHUNK = 500  # строк снимка на одно задание писателя
+
+# Квесты
+QUEST_FLUSH_SECONDS = 5  # прогресс квестов пишется в БД пачкой раз в N секунд
+QUEST_PREGENERATE = True  # в полночь выдавать квесты всем, у кого они были вчера
+
+# Экспедиции
+EXPEDITION_NOTIFY = os.getenv("EXPEDITION_NOTIFY", "1") == "1"  # писать игроку, когда экспедиция завершилась
 
 # Башня
 TOWER_ATTEMPTS_PER_DAY = 3
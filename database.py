@@ -2,396 +2,920 @@
 🗄 База данных MMO RPG v2
 Игроки, инвентарь, квесты, башня, экспедиции, аукцион
 """
+import asyncio
+import functools
+import logging
+import random
+import time
 import aiosqlite
-from datetime import datetime, timedelta
-from config import DATABASE_PATH, MAX_ENERGY, ENERGY_REGEN_MINUTES
-
-
-async def init_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""CREATE TABLE IF NOT EXISTS players (
-            user_id INTEGER PRIMARY KEY, username TEXT DEFAULT '', first_name TEXT DEFAULT '',
-            class TEXT DEFAULT '', level INTEGER DEFAULT 1, xp INTEGER DEFAULT 0,
-            gold INTEGER DEFAULT 500, crystals INTEGER DEFAULT 0,
-            energy INTEGER DEFAULT 100, max_energy INTEGER DEFAULT 100, energy_updated_at TEXT DEFAULT '',
-            arena_rating INTEGER DEFAULT 1000, arena_wins INTEGER DEFAULT 0, arena_losses INTEGER DEFAULT 0,
-            arena_fights_today INTEGER DEFAULT 0, arena_last_reset TEXT DEFAULT '',
-            total_hunts INTEGER DEFAULT 0, total_kills INTEGER DEFAULT 0,
-            tower_floor INTEGER DEFAULT 0, tower_attempts_today INTEGER DEFAULT 0, tower_last_reset TEXT DEFAULT '',
-            wheel_last_spin TEXT DEFAULT '',
-            daily_streak INTEGER DEFAULT 0, last_daily TEXT DEFAULT '',
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-        await db.execute("""CREATE TABLE IF NOT EXISTS inventory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            item_type TEXT, name TEXT, rarity TEXT,
-            bonus_attack INTEGER DEFAULT 0, bonus_defense INTEGER DEFAULT 0,
-            bonus_hp INTEGER DEFAULT 0, bonus_crit REAL DEFAULT 0,
-            is_equipped INTEGER DEFAULT 0, obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-        await db.execute("""CREATE TABLE IF NOT EXISTS quests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            quest_type TEXT, description TEXT, target INTEGER, progress INTEGER DEFAULT 0,
-            reward_gold INTEGER DEFAULT 0, reward_crystals INTEGER DEFAULT 0, reward_xp INTEGER DEFAULT 0,
-            is_completed INTEGER DEFAULT 0, is_claimed INTEGER DEFAULT 0, date TEXT
-        )""")
-        await db.execute("""CREATE TABLE IF NOT EXISTS expeditions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            exp_type TEXT, duration_minutes INTEGER, started_at TEXT,
-            reward_gold INTEGER DEFAULT 0, reward_xp INTEGER DEFAULT 0,
-            reward_crystals INTEGER DEFAULT 0, reward_item_rarity TEXT DEFAULT '',
-            is_collected INTEGER DEFAULT 0
-        )""")
-        await db.execute("""CREATE TABLE IF NOT EXISTS auction (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, seller_id INTEGER,
-            item_name TEXT, item_type TEXT, item_rarity TEXT,
-            item_attack INTEGER DEFAULT 0, item_defense INTEGER DEFAULT 0,
-            item_hp INTEGER DEFAULT 0, item_crit REAL DEFAULT 0,
-            price INTEGER, listed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-        await db.commit()
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+import metrics
+from cache import LRUCache
+from leaderboard import LEADER_FIELDS, Leaderboards
+from matchmaking import ArenaIndex
+from quest_engine import QuestEngine
+from config import (DATABASE_PATH, DB_READERS, DB_PRAGMAS, DB_WRITE_BATCH, DB_BEGIN_RETRIES, MAX_ENERGY, ENERGY_REGEN_MINUTES,
+                    PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL, ARENA_LEVEL_SPREAD, ARENA_RATING_WINDOW, LEADERBOARD_REFRESH_SECONDS, LEADERBOARD_CHUNK,
+                    ARENA_FIGHTS_PER_DAY, TOWER_ATTEMPTS_PER_DAY, QUEST_FLUSH_SECONDS, SHARD_RESYNC_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+# ======== ПУЛ СОЕДИНЕНИЙ ========
+# Долгоживущие соединения: одно пишущее и несколько читающих.
+# Все записи идут через очередь единственного писателя (_writer_loop),
+# который группирует задания из очереди в одну транзакцию и один коммит.
+# Открываются в init_db(), закрываются в close_db().
+#
+# Строки игроков кэшируются в _players. Каждое задание писателя перечисляет
+# user_id, чьи строки в players оно меняет; писатель перечитывает их в той же
+# транзакции и после коммита кладёт в кэш (write-through), в индекс арены (_arena)
+# и в рейтинги (_leaders).
+_writer = None
+_writer_task = None
+_write_queue = None
+_readers = None
+_reader_conns = []
+_players = LRUCache(PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL)
+# user_id -> [публикаций строки, читателей] — только пока идёт чтение промаха get_player:
+# если за это время строку опубликовали или сбросили, прочитанное уже устарело и в кэш не кладётся
+_player_reads = {}
+_arena = ArenaIndex()
+_leaders = Leaderboards()
+
+async def _connect(**kwargs):
+    conn = await aiosqlite.connect(DATABASE_PATH, **kwargs)
+    conn.row_factory = aiosqlite.Row
+    for name, value in DB_PRAGMAS.items():
+        await conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+async def open_pool():
+    global _writer, _writer_task, _write_queue, _readers
+    if _writer: return
+    # Писатель сам управляет транзакциями (BEGIN/SAVEPOINT/COMMIT)
+    _writer = await _connect(isolation_level=None)
+    _write_queue = asyncio.Queue()
+    _writer_task = asyncio.create_task(_writer_loop())
+    _writer_task.add_done_callback(functools.partial(_writer_stopped, _write_queue))
+    _readers = asyncio.Queue()
+    for _ in range(max(1, DB_READERS)):
+        conn = await _connect()
+        _reader_conns.append(conn)
+        _readers.put_nowait(conn)
+
+async def close_db():
+    global _writer, _writer_task, _write_queue, _readers
+    if not _writer: return
+    await flush_quests()
+    # Дописать всё, что уже в очереди, и остановить писателя
+    _write_queue.put_nowait((None, None, ()))
+    await _writer_task
+    for conn in _reader_conns:
+        await conn.close()
+    _reader_conns.clear()
+    await _writer.close()
+    _writer, _writer_task, _write_queue, _readers = None, None, None, None
+
+@asynccontextmanager
+async def _read():
+    t = time.perf_counter()
+    conn = await _readers.get()
+    metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - t); metrics.note_db_read()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
+
+async def _write(job, *touched):
+    """Выполнить job(db) в очереди писателя. Возвращает результат job после коммита.
+    touched — user_id игроков, чьи строки меняет job (обновятся в кэше)"""
+    if _writer_task is None or _writer_task.done(): raise RuntimeError("DB writer is not running")
+    fut = asyncio.get_running_loop().create_future()
+    metrics.note_db_write()
+    _write_queue.put_nowait((job, fut, touched))
+    return await fut
+
+def _player_changed(user_id):
+    if (reading := _player_reads.get(user_id)): reading[0] += 1
+
+def _forget_player(user_id):
+    """Сбросить строку игрока в кэше: следующий get_player перечитает её из БД"""
+    _player_changed(user_id)
+    _players.pop(user_id)
+
+def _publish(user_id, row):
+    """Строка игрока после коммита -> кэш и индексы в памяти. None — состояние неизвестно"""
+    if not row: _forget_player(user_id); return
+    _player_changed(user_id)
+    _players.put(user_id, row)
+    if row["class"]: _arena.put(_arena_entry(row)); _leaders.put(row)
+
+async def _begin():
+    """IMMEDIATE: блокировка записи берётся сразу. С отложенным BEGIN несколько процессов
+    (воркеры шардированного режима) сталкиваются на её повышении и получают «database is locked».
+    Если блокировку дольше busy_timeout держит другой процесс, пробуем ещё, с растущей паузой"""
+    for attempt in range(DB_BEGIN_RETRIES):
+        try:
+            await _writer.execute("BEGIN IMMEDIATE"); return
+        except aiosqlite.OperationalError as e:
+            if attempt == DB_BEGIN_RETRIES - 1 or "locked" not in str(e) and "busy" not in str(e): raise
+            logger.warning("BEGIN IMMEDIATE: %s, retry %s", e, attempt + 1)
+            await asyncio.sleep(0.05 * 2 ** attempt)
+
+async def _write_batch(batch):
+    """Одна транзакция на пачку. Возвращает [(fut, результат, ошибка, [(user_id, строка)])]"""
+    done = []
+    await _begin()
+    for job, fut, touched in batch:
+        if job is None or fut.cancelled(): continue
+        # Каждое задание в своей точке сохранения: ошибка одного не откатывает остальные
+        await _writer.execute("SAVEPOINT job")
+        try:
+            res, err = await job(_writer), None
+            rows = [(uid, await _fetch_player(_writer, uid)) for uid in touched]
+            await _writer.execute("RELEASE job")
+        except Exception as e:
+            res, err, rows = None, e, []
+            await _writer.execute("ROLLBACK TO job"); await _writer.execute("RELEASE job")
+        done.append((fut, res, err, rows))
+    await _writer.execute("COMMIT")
+    metrics.DB_COMMITS.inc(); metrics.DB_WRITE_BATCH.observe(len(batch))
+    return done
+
+async def _writer_loop():
+    stop = False
+    while not stop:
+        batch = [await _write_queue.get()]
+        while len(batch) < DB_WRITE_BATCH and not _write_queue.empty():
+            batch.append(_write_queue.get_nowait())
+        stop = any(job is None for job, _, _ in batch)
+        try:
+            done = await _write_batch(batch)
+        except Exception as e:
+            # Сбой вне заданий (BEGIN, COMMIT, откат уже прерванной транзакции): пачка не записана,
+            # её задания получают ошибку, строки их игроков в кэше сбрасываются. Писатель работает дальше
+            logger.error("Write batch of %s failed: %r", len(batch), e)
+            if _writer.in_transaction:
+                try: await _writer.execute("ROLLBACK")
+                except Exception as e2: logger.error("Rollback failed: %r", e2)
+            done = [(fut, None, e, [(uid, None) for uid in touched]) for job, fut, touched in batch if job is not None]
+        for fut, res, err, rows in done:
+            for uid, row in rows:
+                _publish(uid, row)
+            if fut.cancelled(): continue
+            if err: fut.set_exception(err)
+            else: fut.set_result(res)
+
+def _writer_stopped(queue, task):
+    """Писатель завершился: задания, оставшиеся в очереди, уже не выполнятся — вернуть им ошибку"""
+    if not task.cancelled() and task.exception(): logger.error("DB writer died: %r", task.exception())
+    while not queue.empty():
+        job, fut, _ = queue.get_nowait()
+        if fut and not fut.done(): fut.set_exception(RuntimeError("DB writer is not running"))
+
+async def _create_schema(db):
+    await db.execute("""CREATE TABLE IF NOT EXISTS players (
+        user_id INTEGER PRIMARY KEY, username TEXT DEFAULT '', first_name TEXT DEFAULT '',
+        class TEXT DEFAULT '', level INTEGER DEFAULT 1, xp INTEGER DEFAULT 0,
+        gold INTEGER DEFAULT 500, crystals INTEGER DEFAULT 0,
+        energy INTEGER DEFAULT 100, max_energy INTEGER DEFAULT 100, energy_updated_at TEXT DEFAULT '',
+        arena_rating INTEGER DEFAULT 1000, arena_wins INTEGER DEFAULT 0, arena_losses INTEGER DEFAULT 0,
+        arena_fights_today INTEGER DEFAULT 0, arena_last_reset TEXT DEFAULT '',
+        total_hunts INTEGER DEFAULT 0, total_kills INTEGER DEFAULT 0,
+        tower_floor INTEGER DEFAULT 0, tower_attempts_today INTEGER DEFAULT 0, tower_last_reset TEXT DEFAULT '',
+        wheel_last_spin TEXT DEFAULT '',
+        daily_streak INTEGER DEFAULT 0, last_daily TEXT DEFAULT '',
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS inventory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+        item_type TEXT, name TEXT, rarity TEXT,
+        bonus_attack INTEGER DEFAULT 0, bonus_defense INTEGER DEFAULT 0,
+        bonus_hp INTEGER DEFAULT 0, bonus_crit REAL DEFAULT 0,
+        is_equipped INTEGER DEFAULT 0, obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS quests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+        quest_type TEXT, description TEXT, target INTEGER, progress INTEGER DEFAULT 0,
+        reward_gold INTEGER DEFAULT 0, reward_crystals INTEGER DEFAULT 0, reward_xp INTEGER DEFAULT 0,
+        is_completed INTEGER DEFAULT 0, is_claimed INTEGER DEFAULT 0, date TEXT
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS expeditions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+        exp_type TEXT, duration_minutes INTEGER, started_at TEXT,
+        reward_gold INTEGER DEFAULT 0, reward_xp INTEGER DEFAULT 0,
+        reward_crystals INTEGER DEFAULT 0, reward_item_rarity TEXT DEFAULT '',
+        is_collected INTEGER DEFAULT 0
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS auction (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, seller_id INTEGER,
+        item_name TEXT, item_type TEXT, item_rarity TEXT,
+        item_attack INTEGER DEFAULT 0, item_defense INTEGER DEFAULT 0,
+        item_hp INTEGER DEFAULT 0, item_crit REAL DEFAULT 0,
+        price INTEGER, listed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    await _migrate(db)
+
+async def migrate_db():
+    """Создать таблицы и применить миграции отдельным соединением, без пула.
+    Фронт шардированного режима делает это один раз до запуска воркеров"""
+    db = await _connect(isolation_level=None)
+    try:
+        await db.execute("BEGIN IMMEDIATE")
+        try: await _create_schema(db)
+        except Exception:
+            await db.execute("ROLLBACK"); raise
+        await db.execute("COMMIT")
+    finally:
+        await db.close()
+
+async def init_db(migrate=True):
+    """Открыть пул и загрузить состояние в память. migrate=False — схему уже подготовил
+    migrate_db() (воркеры шардированного режима)"""
+    await open_pool()
+    if migrate: await _write(_create_schema)
+    await load_player_indexes()
+    await load_expeditions()
+
+
+# ======== МИГРАЦИИ ========
+# Пересчёт бонусов экипировки игрока из inventory (по покрывающему индексу)
+_EQUIP_RECALC_SQL = """UPDATE players SET (eq_attack,eq_defense,eq_hp,eq_crit) = (
+    SELECT COALESCE(SUM(bonus_attack),0),COALESCE(SUM(bonus_defense),0),COALESCE(SUM(bonus_hp),0),COALESCE(SUM(bonus_crit),0)
+    FROM inventory WHERE inventory.user_id=players.user_id AND is_equipped=1) WHERE user_id=?"""
+
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция — список SQL,
+# применяется один раз и в той же транзакции, что и смена версии.
+_MIGRATIONS = [
+    # 1: вторичные индексы под горячие запросы
+    [
+        "CREATE INDEX IF NOT EXISTS idx_inventory_equipped ON inventory(user_id,is_equipped,bonus_attack,bonus_defense,bonus_hp,bonus_crit)",
+        "CREATE INDEX IF NOT EXISTS idx_inventory_rarity ON inventory(user_id,rarity,is_equipped)",
+        "CREATE INDEX IF NOT EXISTS idx_quests_user_date ON quests(user_id,date,quest_type)",
+        "CREATE INDEX IF NOT EXISTS idx_expeditions_active ON expeditions(user_id,is_collected)",
+        "CREATE INDEX IF NOT EXISTS idx_auction_listed ON auction(listed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_auction_seller ON auction(seller_id)",
+        "CREATE INDEX IF NOT EXISTS idx_players_level ON players(level,arena_rating)",
+        "CREATE INDEX IF NOT EXISTS idx_players_arena ON players(arena_rating)",
+    ],
+    # 2: суммарные бонусы надетой экипировки хранятся в строке игрока
+    [
+        "ALTER TABLE players ADD COLUMN eq_attack INTEGER DEFAULT 0",
+        "ALTER TABLE players ADD COLUMN eq_defense INTEGER DEFAULT 0",
+        "ALTER TABLE players ADD COLUMN eq_hp INTEGER DEFAULT 0",
+        "ALTER TABLE players ADD COLUMN eq_crit REAL DEFAULT 0",
+        _EQUIP_RECALC_SQL.replace("WHERE user_id=?", ""),
+    ],
+    # 3: снимки рейтингов с готовыми местами (пишет refresh_leaderboards)
+    [
+        """CREATE TABLE IF NOT EXISTS leaderboard_snapshot (
+            board TEXT, pos INTEGER, rank INTEGER, user_id INTEGER, username TEXT, first_name TEXT, class TEXT,
+            level INTEGER, arena_rating INTEGER, arena_wins INTEGER, arena_losses INTEGER,
+            total_kills INTEGER, tower_floor INTEGER,
+            PRIMARY KEY (board, pos)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_snapshot_user ON leaderboard_snapshot(board,user_id,rank)",
+        "CREATE TABLE IF NOT EXISTS leaderboard_meta (board TEXT PRIMARY KEY, refreshed_at INTEGER)",
+    ],
+    # 4: дневные счётчики с номером дня (дней с 1970-01-01) вместо строк дат
+    [
+        "ALTER TABLE players ADD COLUMN arena_day INTEGER DEFAULT 0",
+        "ALTER TABLE players ADD COLUMN tower_day INTEGER DEFAULT 0",
+        "ALTER TABLE players ADD COLUMN wheel_day INTEGER DEFAULT 0",
+        "ALTER TABLE players ADD COLUMN daily_day INTEGER DEFAULT 0",
+        """UPDATE players SET
+            arena_day=COALESCE(CAST(julianday(NULLIF(arena_last_reset,'')) - 2440587.5 AS INTEGER),0),
+            tower_day=COALESCE(CAST(julianday(NULLIF(tower_last_reset,'')) - 2440587.5 AS INTEGER),0),
+            wheel_day=COALESCE(CAST(julianday(NULLIF(wheel_last_spin,'')) - 2440587.5 AS INTEGER),0),
+            daily_day=COALESCE(CAST(julianday(NULLIF(last_daily,'')) - 2440587.5 AS INTEGER),0)""",
+    ],
+    # 5: выборка игроков с квестами за день (предгенерация на новый день)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_quests_date ON quests(date,user_id)",
+    ],
+    # 6: время траты энергии и начала экспедиции — секунды epoch вместо ISO-строк
+    # (строки хранились в локальном времени, отсюда модификатор 'utc')
+    [
+        "ALTER TABLE players ADD COLUMN energy_ts INTEGER DEFAULT 0",
+        "ALTER TABLE expeditions ADD COLUMN started_ts INTEGER DEFAULT 0",
+        "UPDATE players SET energy_ts=COALESCE(CAST(strftime('%s',NULLIF(energy_updated_at,''),'utc') AS INTEGER),0)",
+        "UPDATE expeditions SET started_ts=COALESCE(CAST(strftime('%s',NULLIF(started_at,''),'utc') AS INTEGER),0)",
+    ],
+    # 7: журнал изменённых игроков для индексов других процессов (пишут только воркеры, см. index_resyncer)
+    [
+        "CREATE TABLE IF NOT EXISTS player_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, ts INTEGER)",
+        "CREATE INDEX IF NOT EXISTS idx_player_changes_ts ON player_changes(ts)",
+    ],
+    # 8: какой воркер записал изменение — свои записи при пересинхронизации пропускаются
+    [
+        "ALTER TABLE player_changes ADD COLUMN worker INTEGER DEFAULT -1",
+    ],
+    # 9: поколения снимков рейтингов: новый пишется рядом со старым, читается текущее из leaderboard_meta
+    # (старые снимки — производные данные, пересоздаются первым refresh_leaderboards)
+    [
+        "DROP TABLE IF EXISTS leaderboard_snapshot",
+        """CREATE TABLE leaderboard_snapshot (
+            board TEXT, gen INTEGER, pos INTEGER, rank INTEGER, user_id INTEGER, username TEXT, first_name TEXT, class TEXT,
+            level INTEGER, arena_rating INTEGER, arena_wins INTEGER, arena_losses INTEGER,
+            total_kills INTEGER, tower_floor INTEGER,
+            PRIMARY KEY (board, gen, pos)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX idx_snapshot_user ON leaderboard_snapshot(board,gen,user_id,rank)",
+        "DELETE FROM leaderboard_meta",
+        "ALTER TABLE leaderboard_meta ADD COLUMN gen INTEGER DEFAULT 0",
+    ],
+    # 10: удалить строковые столбцы, заменённые миграциями 4 и 6. Перед удалением — повторный
+    # перенос строк, которые успел записать старый код уже после тех миграций
+    [
+        """UPDATE players SET
+            energy_ts=CASE WHEN energy_ts=0 THEN COALESCE(CAST(strftime('%s',NULLIF(energy_updated_at,''),'utc') AS INTEGER),0) ELSE energy_ts END,
+            arena_day=CASE WHEN arena_day=0 THEN COALESCE(CAST(julianday(NULLIF(arena_last_reset,'')) - 2440587.5 AS INTEGER),0) ELSE arena_day END,
+            tower_day=CASE WHEN tower_day=0 THEN COALESCE(CAST(julianday(NULLIF(tower_last_reset,'')) - 2440587.5 AS INTEGER),0) ELSE tower_day END,
+            wheel_day=CASE WHEN wheel_day=0 THEN COALESCE(CAST(julianday(NULLIF(wheel_last_spin,'')) - 2440587.5 AS INTEGER),0) ELSE wheel_day END,
+            daily_day=CASE WHEN daily_day=0 THEN COALESCE(CAST(julianday(NULLIF(last_daily,'')) - 2440587.5 AS INTEGER),0) ELSE daily_day END""",
+        "UPDATE expeditions SET started_ts=COALESCE(CAST(strftime('%s',NULLIF(started_at,''),'utc') AS INTEGER),0) WHERE started_ts=0",
+        *(f"ALTER TABLE players DROP COLUMN {c}" for c in ("energy_updated_at", "arena_last_reset", "tower_last_reset", "wheel_last_spin", "last_daily")),
+        "ALTER TABLE expeditions DROP COLUMN started_at",
+    ],
+]
+
+async def _migrate(db):
+    version = (await (await db.execute("PRAGMA user_version")).fetchone())[0]
+    for v, statements in enumerate(_MIGRATIONS[version:], start=version + 1):
+        for sql in statements:
+            await db.execute(sql)
+        await db.execute(f"PRAGMA user_version={v}")
+        logger.info("DB migrated to v%s", v)
 
 
 # ======== ИГРОКИ ========
+async def _fetch_player(db, user_id):
+    cur = await db.execute("SELECT * FROM players WHERE user_id = ?", (user_id,))
+    row = await cur.fetchone()
+    return dict(row) if row else None
+
 async def get_player(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM players WHERE user_id = ?", (user_id,))
-        row = await cur.fetchone()
-        return dict(row) if row else None
+    player = _players.get(user_id)
+    if player is None:
+        reading = _player_reads.setdefault(user_id, [0, 0])
+        gen = reading[0]; reading[1] += 1
+        try:
+            async with _read() as db:
+                player = await _fetch_player(db, user_id)
+        finally:
+            reading[1] -= 1
+            if not reading[1]: del _player_reads[user_id]
+        if not player: return None
+        # Пока шло чтение, писатель мог опубликовать более новую строку — её не затираем
+        if reading[0] == gen: _players.put(user_id, player)
+    return dict(player)
 
 async def create_player(user_id, username, first_name, class_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        now = datetime.now().isoformat()
-        await db.execute("INSERT OR IGNORE INTO players (user_id,username,first_name,class,energy_updated_at) VALUES (?,?,?,?,?)",
-                         (user_id, username, first_name, class_id, now))
-        await db.commit()
+    await _write(lambda db: db.execute("INSERT OR IGNORE INTO players (user_id,username,first_name,class,energy_ts) VALUES (?,?,?,?,?)",
+                                       (user_id, username, first_name, class_id, int(time.time()))), user_id)
 
 async def update_player_name(user_id, username, first_name):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET username=?,first_name=? WHERE user_id=?", (username, first_name, user_id))
-        await db.commit()
+    await _write(lambda db: db.execute("UPDATE players SET username=?,first_name=? WHERE user_id=?", (username, first_name, user_id)), user_id)
 
 # ======== ЭНЕРГИЯ ========
+# Время последней траты — energy_ts, секунды epoch; 0 — энергию ещё не тратили
 def calculate_energy(player):
     stored, max_e = player["energy"], player["max_energy"]
     if stored >= max_e: return max_e
-    updated = player.get("energy_updated_at", "")
-    if not updated: return stored
-    try:
-        elapsed = (datetime.now() - datetime.fromisoformat(updated)).total_seconds() / 60.0
-        return min(max_e, stored + int(elapsed / ENERGY_REGEN_MINUTES))
-    except: return stored
+    ts = player["energy_ts"]
+    if not ts: return stored
+    return min(max_e, stored + max(0, int(time.time()) - ts) // (ENERGY_REGEN_MINUTES * 60))
+
+def energy_full_at(player):
+    """Когда энергия восстановится полностью (секунды epoch); None — уже полная или не тратилась"""
+    stored, max_e, ts = player["energy"], player["max_energy"], player["energy_ts"]
+    if stored >= max_e or not ts: return None
+    return ts + (max_e - stored) * ENERGY_REGEN_MINUTES * 60
+
+async def energy_refills():
+    """[(user_id, время полного восстановления)] ещё не восстановившихся игроков — для таймеров при старте"""
+    now = int(time.time())
+    async with _read() as db:
+        cur = await db.execute("SELECT user_id,energy,max_energy,energy_ts FROM players WHERE energy<max_energy")
+        rows = await cur.fetchall()
+    return [(r["user_id"], at) for r in rows if (at := energy_full_at(dict(r))) and at > now]
 
 async def spend_energy(user_id, amount, current):
-    now = datetime.now().isoformat()
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET energy=?,energy_updated_at=? WHERE user_id=?", (current - amount, now, user_id))
-        await db.commit()
+    await _write(lambda db: db.execute("UPDATE players SET energy=?,energy_ts=? WHERE user_id=?", (current - amount, int(time.time()), user_id)), user_id)
 
 async def set_energy(user_id, amount):
-    now = datetime.now().isoformat()
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET energy=?,energy_updated_at=? WHERE user_id=?", (amount, now, user_id))
-        await db.commit()
+    await _write(lambda db: db.execute("UPDATE players SET energy=?,energy_ts=? WHERE user_id=?", (amount, int(time.time()), user_id)), user_id)
 
 # ======== РЕСУРСЫ ========
 async def add_gold(user_id, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET gold=gold+? WHERE user_id=?", (amount, user_id)); await db.commit()
+    await _write(lambda db: db.execute("UPDATE players SET gold=gold+? WHERE user_id=?", (amount, user_id)), user_id)
 
 async def add_crystals(user_id, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET crystals=crystals+? WHERE user_id=?", (amount, user_id)); await db.commit()
+    await _write(lambda db: db.execute("UPDATE players SET crystals=crystals+? WHERE user_id=?", (amount, user_id)), user_id)
 
 async def spend_gold(user_id, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT gold FROM players WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        if not row or row[0] < amount: return False
-        await db.execute("UPDATE players SET gold=gold-? WHERE user_id=?", (amount, user_id)); await db.commit()
-        return True
+    async def job(db):
+        cur = await db.execute("UPDATE players SET gold=gold-? WHERE user_id=? AND gold>=?", (amount, user_id, amount))
+        return cur.rowcount > 0
+    return await _write(job, user_id)
 
 async def spend_crystals(user_id, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT crystals FROM players WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        if not row or row[0] < amount: return False
-        await db.execute("UPDATE players SET crystals=crystals-? WHERE user_id=?", (amount, user_id)); await db.commit()
-        return True
+    async def job(db):
+        cur = await db.execute("UPDATE players SET crystals=crystals-? WHERE user_id=? AND crystals>=?", (amount, user_id, amount))
+        return cur.rowcount > 0
+    return await _write(job, user_id)
 
 # ======== XP ========
 async def add_xp(user_id, xp):
     from game_data import xp_for_level
-    player = await get_player(user_id)
-    if not player: return []
-    cur_xp, cur_lvl, new_levels = player["xp"] + xp, player["level"], []
-    while cur_xp >= xp_for_level(cur_lvl):
-        cur_xp -= xp_for_level(cur_lvl); cur_lvl += 1; new_levels.append(cur_lvl)
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET xp=?,level=? WHERE user_id=?", (cur_xp, cur_lvl, user_id)); await db.commit()
-    return new_levels
+    async def job(db):
+        cur = await db.execute("SELECT xp, level FROM players WHERE user_id=?", (user_id,))
+        row = await cur.fetchone()
+        if not row: return []
+        cur_xp, cur_lvl, new_levels = row[0] + xp, row[1], []
+        while cur_xp >= xp_for_level(cur_lvl):
+            cur_xp -= xp_for_level(cur_lvl); cur_lvl += 1; new_levels.append(cur_lvl)
+        await db.execute("UPDATE players SET xp=?,level=? WHERE user_id=?", (cur_xp, cur_lvl, user_id))
+        return new_levels
+    return await _write(job, user_id)
 
 async def record_hunt(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET total_hunts=total_hunts+1,total_kills=total_kills+1 WHERE user_id=?", (user_id,))
-        await db.commit()
+    await _write(lambda db: db.execute("UPDATE players SET total_hunts=total_hunts+1,total_kills=total_kills+1 WHERE user_id=?", (user_id,)), user_id)
+
+# ======== ДНЕВНЫЕ СЧЁТЧИКИ ========
+# Счётчик хранится вместе с номером дня, когда он менялся. Сброса нет: если день
+# в строке не сегодняшний, счётчик читается как 0, а первое увеличение за день
+# записывает 1 и новый день. Проверка лимита — чистая функция от строки из кэша.
+_EPOCH = date(1970, 1, 1).toordinal()
+
+# имя: (столбец счётчика, столбец дня, лимит в день)
+DAILY_COUNTERS = {
+    "arena": ("arena_fights_today", "arena_day", ARENA_FIGHTS_PER_DAY),
+    "tower": ("tower_attempts_today", "tower_day", TOWER_ATTEMPTS_PER_DAY),
+}
+
+def today_day():
+    """Номер сегодняшнего (по локальному времени) дня с 1970-01-01"""
+    return date.today().toordinal() - _EPOCH
+
+def daily_used(player, name):
+    count, day, _ = DAILY_COUNTERS[name]
+    return player[count] if player[day] == today_day() else 0
+
+def daily_left(player, name):
+    return max(0, DAILY_COUNTERS[name][2] - daily_used(player, name))
+
+def _daily_incr_sql(name):
+    """Фрагмент SET: +1 к счётчику за сегодня (параметры: день, день)"""
+    count, day, _ = DAILY_COUNTERS[name]
+    return f"{count}=CASE WHEN {day}=? THEN {count}+1 ELSE 1 END,{day}=?"
 
 # ======== АРЕНА ========
 async def get_arena_fights_left(user_id):
-    from config import ARENA_FIGHTS_PER_DAY
     player = await get_player(user_id)
-    if not player: return 0
-    today = datetime.now().strftime("%Y-%m-%d")
-    if player["arena_last_reset"] != today:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute("UPDATE players SET arena_fights_today=0,arena_last_reset=? WHERE user_id=?", (today, user_id))
-            await db.commit()
-        return ARENA_FIGHTS_PER_DAY
-    return max(0, ARENA_FIGHTS_PER_DAY - player["arena_fights_today"])
+    return daily_left(player, "arena") if player else 0
 
 async def record_arena_fight(user_id, won, rating_change):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        if won:
-            await db.execute("UPDATE players SET arena_wins=arena_wins+1,arena_fights_today=arena_fights_today+1,arena_rating=MAX(0,arena_rating+?) WHERE user_id=?", (rating_change, user_id))
+    d = today_day()
+    if won:
+        await _write(lambda db: db.execute(f"UPDATE players SET arena_wins=arena_wins+1,{_daily_incr_sql('arena')},arena_rating=MAX(0,arena_rating+?) WHERE user_id=?", (d, d, rating_change, user_id)), user_id)
+    else:
+        await _write(lambda db: db.execute(f"UPDATE players SET arena_losses=arena_losses+1,{_daily_incr_sql('arena')},arena_rating=MAX(0,arena_rating-?) WHERE user_id=?", (d, d, abs(rating_change), user_id)), user_id)
+
+_ARENA_FIELDS = ("user_id", "username", "first_name", "class", "level", "arena_rating")
+
+def _arena_entry(player):
+    """Запись индекса арены: поля для экрана боя и готовые боевые статы"""
+    from game_data import get_class_stats, get_total_stats
+    entry = {k: player[k] for k in _ARENA_FIELDS}
+    entry["stats"] = get_total_stats(get_class_stats(player["class"], player["level"]), equipment_bonuses(player))
+    return entry
+
+# Столбцы игрока, из которых строятся индекс арены и рейтинги
+_INDEX_COLS = tuple(dict.fromkeys(LEADER_FIELDS + _ARENA_FIELDS + ("eq_attack", "eq_defense", "eq_hp", "eq_crit")))
+_synced_seq = 0  # последняя запись player_changes, уже учтённая в индексах
+
+def _index_put(row):
+    _arena.put(_arena_entry(row)); _leaders.put(row)
+
+async def load_player_indexes():
+    """Заполнить индекс арены и рейтинги из БД (при старте)"""
+    global _synced_seq
+    async with _read() as db:
+        # Позицию журнала — до чтения игроков: изменения во время чтения применятся повторно
+        _synced_seq = (await (await db.execute("SELECT COALESCE(MAX(seq),0) FROM player_changes")).fetchone())[0]
+        cur = await db.execute(f"SELECT {','.join(_INDEX_COLS)} FROM players WHERE class!=''")
+        rows = await cur.fetchall()
+    _arena.clear(); _leaders.clear()
+    for r in rows: _index_put(dict(r))
+
+def _change_log_sql(worker):
+    """Временные (только на соединении писателя этого процесса) триггеры журнала player_changes.
+    Пишется любое изменение строки: чужие процессы держат её в кэше целиком"""
+    log = f"BEGIN INSERT INTO player_changes (user_id,ts,worker) VALUES (NEW.user_id,CAST(strftime('%s','now') AS INTEGER),{int(worker)}); END"
+    return [f"CREATE TEMP TRIGGER IF NOT EXISTS log_player_insert AFTER INSERT ON main.players {log}",
+            f"CREATE TEMP TRIGGER IF NOT EXISTS log_player_update AFTER UPDATE ON main.players {log}"]
+
+async def resync_player_indexes(shard):
+    """Подтянуть изменения игроков, записанные другими процессами с прошлого раза: их строки
+    сбрасываются в кэше, записи индексов перечитываются. shard=(номер, всего); чужие записи
+    бывают и у игроков своего шарда (покупка на аукционе начисляет золото продавцу).
+    Если нужные записи журнала уже удалены (процесс долго отставал) — перечитать всё"""
+    global _synced_seq
+    async with _read() as db:
+        low, top = await (await db.execute(
+            "SELECT (SELECT MIN(seq) FROM player_changes),(SELECT MAX(seq) FROM player_changes)")).fetchone()
+        if top is None or top <= _synced_seq: return 0
+        if low > _synced_seq + 1: stale = True
         else:
-            await db.execute("UPDATE players SET arena_losses=arena_losses+1,arena_fights_today=arena_fights_today+1,arena_rating=MAX(0,arena_rating-?) WHERE user_id=?", (abs(rating_change), user_id))
-        await db.commit()
+            stale = False
+            args = (_synced_seq, top, shard[0])
+            cur = await db.execute("SELECT DISTINCT user_id FROM player_changes WHERE seq>? AND seq<=? AND worker!=?", args)
+            changed = [r[0] for r in await cur.fetchall()]
+            cur = await db.execute(f"""SELECT {','.join(_INDEX_COLS)} FROM players WHERE class!='' AND user_id IN (
+                SELECT user_id FROM player_changes WHERE seq>? AND seq<=? AND worker!=?)""", args)
+            rows = await cur.fetchall()
+    if stale:
+        for reading in _player_reads.values(): reading[0] += 1
+        _players.clear()
+        await load_player_indexes(); return len(_leaders)
+    for uid in changed: _forget_player(uid)
+    for r in rows: _index_put(dict(r))
+    _synced_seq = top
+    return len(changed)
+
+async def prune_player_changes():
+    """Удалить записи журнала старше 10 интервалов пересинхронизации: отставший сильнее воркер перечитает всё"""
+    old = int(time.time()) - 10 * SHARD_RESYNC_SECONDS
+    await _write(lambda db: db.execute("DELETE FROM player_changes WHERE ts<?", (old,)))
+
+async def index_resyncer(shard):
+    """Фоновая задача воркера шардированного режима: писать свои изменения игроков в журнал
+    и раз в SHARD_RESYNC_SECONDS подтягивать чужие. Воркер 0 чистит журнал от старых записей"""
+    async def job(db):
+        for sql in _change_log_sql(shard[0]): await db.execute(sql)
+    await _write(job)
+    while True:
+        await asyncio.sleep(SHARD_RESYNC_SECONDS)
+        try:
+            await resync_player_indexes(shard)
+            if shard[0] == 0: await prune_player_changes()
+        except Exception as e: logger.error("Index resync failed: %s", e)
 
-async def get_arena_opponent(user_id):
+async def get_arena_opponent(user_id, rng=random):
+    """Случайный соперник ±ARENA_LEVEL_SPREAD уровней, иначе — один из ближайших по рейтингу.
+    Возвращает поля игрока и его боевые статы в ["stats"]"""
     player = await get_player(user_id)
     if not player: return None
-    lvl = player["level"]
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM players WHERE user_id!=? AND class!='' AND level BETWEEN ? AND ? ORDER BY RANDOM() LIMIT 1", (user_id, max(1,lvl-5), lvl+5))
-        row = await cur.fetchone()
-        if row: return dict(row)
-        cur = await db.execute("SELECT * FROM players WHERE user_id!=? AND class!='' ORDER BY RANDOM() LIMIT 1", (user_id,))
-        row = await cur.fetchone()
-        return dict(row) if row else None
+    opp = (_arena.pick_by_level(user_id, player["level"], ARENA_LEVEL_SPREAD, rng)
+           or _arena.pick_by_rating(user_id, player["arena_rating"], ARENA_RATING_WINDOW, rng))
+    return {**opp, "stats": dict(opp["stats"])} if opp else None
 
 # ======== БАШНЯ ========
 async def get_tower_attempts(user_id):
-    from config import TOWER_ATTEMPTS_PER_DAY
     player = await get_player(user_id)
-    if not player: return 0
-    today = datetime.now().strftime("%Y-%m-%d")
-    if player["tower_last_reset"] != today:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute("UPDATE players SET tower_attempts_today=0,tower_last_reset=? WHERE user_id=?", (today, user_id))
-            await db.commit()
-        return TOWER_ATTEMPTS_PER_DAY
-    return max(0, TOWER_ATTEMPTS_PER_DAY - player["tower_attempts_today"])
+    return daily_left(player, "tower") if player else 0
 
 async def use_tower_attempt(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET tower_attempts_today=tower_attempts_today+1 WHERE user_id=?", (user_id,))
-        await db.commit()
+    d = today_day()
+    await _write(lambda db: db.execute(f"UPDATE players SET {_daily_incr_sql('tower')} WHERE user_id=?", (d, d, user_id)), user_id)
 
 async def advance_tower(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET tower_floor=tower_floor+1 WHERE user_id=?", (user_id,))
-        await db.commit()
+    await _write(lambda db: db.execute("UPDATE players SET tower_floor=tower_floor+1 WHERE user_id=?", (user_id,)), user_id)
 
 # ======== ИНВЕНТАРЬ ========
+_ITEM_INSERT_SQL = "INSERT INTO inventory (user_id,item_type,name,rarity,bonus_attack,bonus_defense,bonus_hp,bonus_crit) VALUES (?,?,?,?,?,?,?,?)"
+
+def _item_row(user_id, item):
+    return (user_id, item["item_type"], item["name"], item["rarity"], item.get("bonus_attack",0), item.get("bonus_defense",0), item.get("bonus_hp",0), item.get("bonus_crit",0))
+
 async def add_item(user_id, item):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("INSERT INTO inventory (user_id,item_type,name,rarity,bonus_attack,bonus_defense,bonus_hp,bonus_crit) VALUES (?,?,?,?,?,?,?,?)",
-            (user_id, item["item_type"], item["name"], item["rarity"], item.get("bonus_attack",0), item.get("bonus_defense",0), item.get("bonus_hp",0), item.get("bonus_crit",0)))
-        await db.commit()
+    async def job(db):
+        cur = await db.execute(_ITEM_INSERT_SQL, _item_row(user_id, item))
         return cur.lastrowid
+    return await _write(job)
 
 async def get_inventory(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM inventory WHERE user_id=? ORDER BY is_equipped DESC, rarity DESC, id", (user_id,))
         return [dict(r) for r in await cur.fetchall()]
 
 async def get_item(item_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM inventory WHERE id=?", (item_id,))
         row = await cur.fetchone()
         return dict(row) if row else None
 
 async def equip_item(user_id, item_id):
-    item = await get_item(item_id)
-    if not item or item["user_id"] != user_id: return
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE inventory SET is_equipped=0 WHERE user_id=? AND item_type=? AND is_equipped=1", (user_id, item["item_type"]))
+    async def job(db):
+        cur = await db.execute("SELECT item_type FROM inventory WHERE id=? AND user_id=?", (item_id, user_id))
+        item = await cur.fetchone()
+        if not item: return
+        await db.execute("UPDATE inventory SET is_equipped=0 WHERE user_id=? AND item_type=? AND is_equipped=1", (user_id, item[0]))
         await db.execute("UPDATE inventory SET is_equipped=1 WHERE id=? AND user_id=?", (item_id, user_id))
-        await db.commit()
+        await db.execute(_EQUIP_RECALC_SQL, (user_id,))
+    await _write(job, user_id)
 
 async def sell_item(user_id, item_id):
     from game_data import SELL_PRICES
-    item = await get_item(item_id)
-    if not item or item["user_id"] != user_id or item["is_equipped"]: return 0
-    gold = SELL_PRICES.get(item["rarity"], 30)
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async def job(db):
+        cur = await db.execute("SELECT rarity FROM inventory WHERE id=? AND user_id=? AND is_equipped=0", (item_id, user_id))
+        item = await cur.fetchone()
+        if not item: return 0
+        gold = SELL_PRICES.get(item[0], 30)
         await db.execute("DELETE FROM inventory WHERE id=?", (item_id,))
         await db.execute("UPDATE players SET gold=gold+? WHERE user_id=?", (gold, user_id))
-        await db.commit()
-    return gold
+        return gold
+    return await _write(job, user_id)
+
+def equipment_bonuses(player):
+    """Бонусы надетой экипировки из строки игрока (поддерживаются equip_item/delete_items)"""
+    return {"attack": player["eq_attack"], "defense": player["eq_defense"], "hp": player["eq_hp"], "crit": player["eq_crit"]}
 
 async def get_equipment_bonuses(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT COALESCE(SUM(bonus_attack),0),COALESCE(SUM(bonus_defense),0),COALESCE(SUM(bonus_hp),0),COALESCE(SUM(bonus_crit),0) FROM inventory WHERE user_id=? AND is_equipped=1", (user_id,))
-        r = await cur.fetchone()
-        return {"attack": r[0], "defense": r[1], "hp": r[2], "crit": r[3]}
+    player = await get_player(user_id)
+    if not player: return {"attack": 0, "defense": 0, "hp": 0, "crit": 0}
+    return equipment_bonuses(player)
+
+async def check_equipment_bonuses(fix=False):
+    """Пересчитать бонусы экипировки всех игроков с нуля.
+    Возвращает {user_id: (сохранено, фактически)} для расхождений; fix=True — исправить"""
+    async with _read() as db:
+        cur = await db.execute("""SELECT p.user_id,p.eq_attack,p.eq_defense,p.eq_hp,p.eq_crit,
+            COALESCE(SUM(i.bonus_attack),0),COALESCE(SUM(i.bonus_defense),0),COALESCE(SUM(i.bonus_hp),0),COALESCE(SUM(i.bonus_crit),0)
+            FROM players p LEFT JOIN inventory i ON i.user_id=p.user_id AND i.is_equipped=1 GROUP BY p.user_id""")
+        drift = {}
+        for r in await cur.fetchall():
+            stored, actual = tuple(r[1:5]), tuple(r[5:9])
+            if stored[:3] != actual[:3] or abs((stored[3] or 0) - actual[3]) > 1e-6:
+                drift[r[0]] = (stored, actual)
+    if fix and drift:
+        await _write(lambda db: db.executemany(_EQUIP_RECALC_SQL, [(uid,) for uid in drift]), *drift)
+    return drift
 
 async def get_equipped_items(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM inventory WHERE user_id=? AND is_equipped=1", (user_id,))
         return [dict(r) for r in await cur.fetchall()]
 
 async def count_inventory(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("SELECT COUNT(*) FROM inventory WHERE user_id=?", (user_id,)); return (await cur.fetchone())[0]
 
 async def get_items_by_rarity(user_id, rarity):
     """Получить ненадетые предметы определённой редкости"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM inventory WHERE user_id=? AND rarity=? AND is_equipped=0 ORDER BY id", (user_id, rarity))
         return [dict(r) for r in await cur.fetchall()]
 
 async def delete_items(item_ids):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        for iid in item_ids:
-            await db.execute("DELETE FROM inventory WHERE id=?", (iid,))
-        await db.commit()
+    async def job(db):
+        marks = ",".join("?" * len(item_ids))
+        cur = await db.execute(f"SELECT DISTINCT user_id FROM inventory WHERE id IN ({marks}) AND is_equipped=1", list(item_ids))
+        owners = [r[0] for r in await cur.fetchall()]
+        await db.executemany("DELETE FROM inventory WHERE id=?", [(iid,) for iid in item_ids])
+        # Удалили надетое — пересчитать бонусы владельцев
+        await db.executemany(_EQUIP_RECALC_SQL, [(uid,) for uid in owners])
+        return owners
+    if not item_ids: return
+    for uid in await _write(job):
+        _forget_player(uid)
 
 # ======== КВЕСТЫ ========
+_QUEST_PROGRESS_SQL = """UPDATE quests SET progress=MIN(progress+?,target),
+            is_completed=CASE WHEN progress+?>=target THEN 1 ELSE 0 END
+            WHERE user_id=? AND quest_type=? AND date=? AND is_claimed=0"""
+
+# Прогресс копится в _quests (QuestEngine) и пишется пачкой раз в QUEST_FLUSH_SECONDS
+# (задача quest_flusher), а для одного игрока — перед показом и получением награды.
+_quests = QuestEngine()
+
+def _quest_date():
+    return datetime.now().strftime("%Y-%m-%d")
+
+def _quest_progress_params(items):
+    return [(amount, amount, uid, qtype, day) for uid, qtype, day, amount in items]
+
+async def flush_quests(user_id=None):
+    """Записать накопленный прогресс квестов (всех игроков или одного)"""
+    items = _quests.take(user_id)
+    if not items: return
+    try:
+        await _write(lambda db: db.executemany(_QUEST_PROGRESS_SQL, _quest_progress_params(items)))
+    except Exception:
+        _quests.requeue(items)
+        raise
+
+async def quest_flusher():
+    """Фоновая задача: сбрасывать прогресс квестов, пока не отменят"""
+    while True:
+        await asyncio.sleep(QUEST_FLUSH_SECONDS)
+        try:
+            await flush_quests()
+            _quests.prune(_quest_date())
+        except Exception as e: logger.error("Quest flush failed: %s", e)
+
 async def get_daily_quests(user_id):
-    today = datetime.now().strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM quests WHERE user_id=? AND date=?", (user_id, today))
+    await flush_quests(user_id)
+    async with _read() as db:
+        cur = await db.execute("SELECT * FROM quests WHERE user_id=? AND date=?", (user_id, _quest_date()))
         return [dict(r) for r in await cur.fetchall()]
 
+_QUEST_COLS = "user_id,quest_type,description,target,reward_gold,reward_crystals,reward_xp,date"
+
+def _quest_rows(user_id, quests, day):
+    return [(user_id, q["type"], q["desc"].replace("{t}", str(q["target"])), q["target"], q["gold"], q["crystals"], q["xp"], day) for q in quests]
+
+def _quest_remaining(pairs):
+    """(тип, осталось) -> {тип: максимум осталось} для QuestEngine.load"""
+    left = {}
+    for qtype, n in pairs: left[qtype] = max(left.get(qtype, 0), n)
+    return left
+
 async def create_daily_quests(user_id, quests):
-    today = datetime.now().strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        for q in quests:
-            desc = q["desc"].replace("{t}", str(q["target"]))
-            await db.execute("INSERT INTO quests (user_id,quest_type,description,target,reward_gold,reward_crystals,reward_xp,date) VALUES (?,?,?,?,?,?,?,?)",
-                (user_id, q["type"], desc, q["target"], q["gold"], q["crystals"], q["xp"], today))
-        await db.commit()
+    """Выдать квесты (шаблоны generate_daily_quests) на сегодня одним INSERT ... RETURNING
+    и вернуть созданные строки. Если квесты на сегодня уже есть — вернуть их"""
+    today = _quest_date()
+    rows = _quest_rows(user_id, quests, today)
+    async def job(db):
+        cur = await db.execute("SELECT * FROM quests WHERE user_id=? AND date=?", (user_id, today))
+        existing = [dict(r) for r in await cur.fetchall()]
+        if existing: return False, existing
+        cur = await db.execute(f"INSERT INTO quests ({_QUEST_COLS}) VALUES {','.join(['(?,?,?,?,?,?,?,?)'] * len(rows))} RETURNING *",
+                               [v for row in rows for v in row])
+        return True, sorted((dict(r) for r in await cur.fetchall()), key=lambda q: q["id"])
+    created, result = await _write(job)
+    if created or not _quests.known(user_id, today):
+        _quests.load(user_id, today, _quest_remaining((q["quest_type"], q["target"] - q["progress"]) for q in result if not q["is_completed"]))
+    return result
+
+async def pregenerate_daily_quests(shard=None):
+    """Выдать квесты на сегодня всем, у кого они были вчера. Возвращает число игроков.
+    shard=(номер, всего) — только игрокам своего шарда: прогресс квестов копится в памяти
+    того процесса, который обрабатывает игрока, туда же надо загрузить и новые квесты"""
+    from game_data import generate_daily_quests, rng_for
+    today, yesterday = _quest_date(), (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    async with _read() as db:
+        cur = await db.execute("SELECT DISTINCT user_id FROM quests WHERE date=?", (yesterday,))
+        plans = {r[0]: generate_daily_quests(3, rng_for(r[0], "quests")) for r in await cur.fetchall()
+                 if not shard or r[0] % shard[1] == shard[0]}
+    async def job(db):
+        cur = await db.execute("SELECT DISTINCT user_id FROM quests WHERE date=?", (today,))
+        have = {r[0] for r in await cur.fetchall()}
+        todo = {uid: q for uid, q in plans.items() if uid not in have}
+        await db.executemany(f"INSERT INTO quests ({_QUEST_COLS}) VALUES (?,?,?,?,?,?,?,?)",
+                             [row for uid, q in todo.items() for row in _quest_rows(uid, q, today)])
+        return todo
+    created = await _write(job)
+    for uid, quests in created.items():
+        _quests.load(uid, today, _quest_remaining((q["type"], q["target"]) for q in quests))
+    return len(created)
+
+async def quest_rollover(shard=None):
+    """Фоновая задача: сразу после полуночи выдать квесты вчерашним игрокам (своего шарда)"""
+    while True:
+        midnight = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((midnight - datetime.now()).total_seconds() + 1)
+        try: logger.info("Daily quests pregenerated for %s players", await pregenerate_daily_quests(shard))
+        except Exception as e: logger.error("Quest pregeneration failed: %s", e)
 
 async def update_quest_progress(user_id, quest_type, amount=1):
-    today = datetime.now().strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""UPDATE quests SET progress=MIN(progress+?,target),
-            is_completed=CASE WHEN progress+?>=target THEN 1 ELSE 0 END
-            WHERE user_id=? AND quest_type=? AND date=? AND is_claimed=0""",
-            (amount, amount, user_id, quest_type, today))
-        await db.commit()
+    """Учесть событие квеста в памяти. Квесты игрока за день читаются один раз, при первом событии"""
+    today = _quest_date()
+    if not _quests.known(user_id, today):
+        async with _read() as db:
+            cur = await db.execute("SELECT quest_type,MAX(target-progress) FROM quests WHERE user_id=? AND date=? AND is_completed=0 GROUP BY quest_type", (user_id, today))
+            remaining = {r[0]: r[1] for r in await cur.fetchall()}
+        # Пока ждали чтения, состояние мог загрузить параллельный вызов
+        if not _quests.known(user_id, today): _quests.load(user_id, today, remaining)
+    _quests.record(user_id, today, quest_type, amount)
 
 async def claim_quest(user_id, quest_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    items = _quests.take(user_id)
+    async def job(db):
+        if items: await db.executemany(_QUEST_PROGRESS_SQL, _quest_progress_params(items))
         cur = await db.execute("SELECT * FROM quests WHERE id=? AND user_id=? AND is_completed=1 AND is_claimed=0", (quest_id, user_id))
         q = await cur.fetchone()
         if not q: return None
         q = dict(q)
         await db.execute("UPDATE quests SET is_claimed=1 WHERE id=?", (quest_id,))
         await db.execute("UPDATE players SET gold=gold+?,crystals=crystals+? WHERE user_id=?", (q["reward_gold"], q["reward_crystals"], user_id))
-        await db.commit()
         return q
+    try:
+        return await _write(job, user_id)
+    except Exception:
+        _quests.requeue(items)
+        raise
 
 # ======== ЭКСПЕДИЦИИ ========
+# Незабранные экспедиции — в памяти (user_id -> строка + "ends_at", время окончания в секундах):
+# загружаются при старте и меняются только через функции ниже, проверки в хэндлерах — без БД.
+_expeditions = {}
+
+def _expedition_entry(row):
+    exp = dict(row)
+    exp["ends_at"] = exp["started_ts"] + exp["duration_minutes"] * 60 if exp["started_ts"] else float("inf")
+    return exp
+
+async def load_expeditions():
+    """Заполнить незабранные экспедиции из БД (при старте)"""
+    async with _read() as db:
+        cur = await db.execute("SELECT * FROM expeditions WHERE is_collected=0 ORDER BY id")
+        rows = await cur.fetchall()
+    _expeditions.clear()
+    for row in rows: _expeditions[row["user_id"]] = _expedition_entry(row)
+
+def active_expeditions():
+    """Все незабранные экспедиции — для планировщика уведомлений"""
+    return [dict(e) for e in _expeditions.values()]
+
+def _forget_expedition(user_id, exp_id):
+    if (exp := _expeditions.get(user_id)) and exp["id"] == exp_id: del _expeditions[user_id]
+
 async def get_active_expedition(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM expeditions WHERE user_id=? AND is_collected=0 ORDER BY id DESC LIMIT 1", (user_id,))
-        row = await cur.fetchone()
-        return dict(row) if row else None
+    exp = _expeditions.get(user_id)
+    return dict(exp) if exp else None
 
 async def start_expedition(user_id, exp_type, duration, rewards):
-    now = datetime.now().isoformat()
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("INSERT INTO expeditions (user_id,exp_type,duration_minutes,started_at,reward_gold,reward_xp,reward_crystals,reward_item_rarity) VALUES (?,?,?,?,?,?,?,?)",
+    """Начать экспедицию; None — у игрока уже есть незабранная"""
+    now = int(time.time())
+    async def job(db):
+        cur = await db.execute("SELECT 1 FROM expeditions WHERE user_id=? AND is_collected=0", (user_id,))
+        if await cur.fetchone(): return None
+        cur = await db.execute("INSERT INTO expeditions (user_id,exp_type,duration_minutes,started_ts,reward_gold,reward_xp,reward_crystals,reward_item_rarity) VALUES (?,?,?,?,?,?,?,?) RETURNING *",
             (user_id, exp_type, duration, now, rewards["gold"], rewards["xp"], rewards["crystals"], rewards.get("item_rarity","")))
-        await db.commit()
+        return await cur.fetchone()
+    row = await _write(job)
+    if row is None: return None
+    _expeditions[user_id] = exp = _expedition_entry(row)
+    return dict(exp)
 
 def is_expedition_done(expedition):
-    try:
-        started = datetime.fromisoformat(expedition["started_at"])
-        return datetime.now() >= started + timedelta(minutes=expedition["duration_minutes"])
-    except: return False
+    return int(time.time()) >= expedition["ends_at"]
 
 def expedition_time_left(expedition):
-    try:
-        started = datetime.fromisoformat(expedition["started_at"])
-        end = started + timedelta(minutes=expedition["duration_minutes"])
-        left = end - datetime.now()
-        if left.total_seconds() <= 0: return "Готово!"
-        mins = int(left.total_seconds() / 60)
-        if mins >= 60: return f"{mins//60}ч {mins%60}мин"
-        return f"{mins}мин"
-    except: return "?"
+    left = expedition["ends_at"] - int(time.time())
+    if left <= 0: return "Готово!"
+    if left == float("inf"): return "?"
+    mins = left // 60
+    if mins >= 60: return f"{mins//60}ч {mins%60}мин"
+    return f"{mins}мин"
 
 async def collect_expedition(user_id, exp_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE expeditions SET is_collected=1 WHERE id=? AND user_id=?", (exp_id, user_id))
-        await db.commit()
+    await _write(lambda db: db.execute("UPDATE expeditions SET is_collected=1 WHERE id=? AND user_id=?", (exp_id, user_id)))
+    _forget_expedition(user_id, exp_id)
 
 # ======== КОЛЕСО ========
+def wheel_available(player):
+    return player["wheel_day"] != today_day()
+
 async def can_spin_wheel(user_id):
     player = await get_player(user_id)
     if not player: return False
-    return player.get("wheel_last_spin", "") != datetime.now().strftime("%Y-%m-%d")
+    return wheel_available(player)
 
 async def use_wheel_spin(user_id):
-    today = datetime.now().strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET wheel_last_spin=? WHERE user_id=?", (today, user_id))
-        await db.commit()
+    await _write(lambda db: db.execute("UPDATE players SET wheel_day=? WHERE user_id=?", (today_day(), user_id)), user_id)
 
 # ======== АУКЦИОН ========
 async def list_on_auction(seller_id, item_id, price):
-    item = await get_item(item_id)
-    if not item or item["user_id"] != seller_id or item["is_equipped"]: return False
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async def job(db):
+        cur = await db.execute("SELECT * FROM inventory WHERE id=? AND user_id=? AND is_equipped=0", (item_id, seller_id))
+        item = await cur.fetchone()
+        if not item: return False
         await db.execute("INSERT INTO auction (seller_id,item_name,item_type,item_rarity,item_attack,item_defense,item_hp,item_crit,price) VALUES (?,?,?,?,?,?,?,?,?)",
             (seller_id, item["name"], item["item_type"], item["rarity"], item["bonus_attack"], item["bonus_defense"], item["bonus_hp"], item["bonus_crit"], price))
         await db.execute("DELETE FROM inventory WHERE id=?", (item_id,))
-        await db.commit()
-    return True
+        return True
+    return await _write(job)
 
 async def get_auction_listings(limit=20, offset=0):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM auction ORDER BY listed_at DESC LIMIT ? OFFSET ?", (limit, offset))
         return [dict(r) for r in await cur.fetchall()]
 
 async def get_my_listings(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM auction WHERE seller_id=?", (user_id,))
         return [dict(r) for r in await cur.fetchall()]
 
 async def count_my_listings(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("SELECT COUNT(*) FROM auction WHERE seller_id=?", (user_id,))
         return (await cur.fetchone())[0]
 
 async def buy_from_auction(buyer_id, listing_id):
     """Купить предмет с аукциона. Возвращает (успех, инфо)"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async def job(db):
         cur = await db.execute("SELECT * FROM auction WHERE id=?", (listing_id,))
         listing = await cur.fetchone()
         if not listing: return False, "Лот не найден"
         listing = dict(listing)
         if listing["seller_id"] == buyer_id: return False, "Нельзя купить свой лот"
-        cur = await db.execute("SELECT gold FROM players WHERE user_id=?", (buyer_id,))
-        buyer = await cur.fetchone()
-        if not buyer or buyer[0] < listing["price"]: return False, "Не хватает золота"
         # Списать золото у покупателя
-        await db.execute("UPDATE players SET gold=gold-? WHERE user_id=?", (listing["price"], buyer_id))
+        cur = await db.execute("UPDATE players SET gold=gold-? WHERE user_id=? AND gold>=?", (listing["price"], buyer_id, listing["price"]))
+        if cur.rowcount == 0: return False, "Не хватает золота"
         # Начислить продавцу (минус комиссия)
         seller_gold = int(listing["price"] * 0.9)
         await db.execute("UPDATE players SET gold=gold+? WHERE user_id=?", (seller_gold, listing["seller_id"]))
@@ -400,12 +924,14 @@ async def buy_from_auction(buyer_id, listing_id):
             (buyer_id, listing["item_type"], listing["item_name"], listing["item_rarity"], listing["item_attack"], listing["item_defense"], listing["item_hp"], listing["item_crit"]))
         # Удалить лот
         await db.execute("DELETE FROM auction WHERE id=?", (listing_id,))
-        await db.commit()
-    return True, listing
+        return True, listing
+    ok, info = await _write(job, buyer_id)
+    # Продавца заранее не знаем — сбрасываем его строку в кэше
+    if ok: _forget_player(info["seller_id"])
+    return ok, info
 
 async def cancel_listing(user_id, listing_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async def job(db):
         cur = await db.execute("SELECT * FROM auction WHERE id=? AND seller_id=?", (listing_id, user_id))
         listing = await cur.fetchone()
         if not listing: return False
@@ -414,46 +940,195 @@ async def cancel_listing(user_id, listing_id):
         await db.execute("INSERT INTO inventory (user_id,item_type,name,rarity,bonus_attack,bonus_defense,bonus_hp,bonus_crit) VALUES (?,?,?,?,?,?,?,?)",
             (user_id, listing["item_type"], listing["item_name"], listing["item_rarity"], listing["item_attack"], listing["item_defense"], listing["item_hp"], listing["item_crit"]))
         await db.execute("DELETE FROM auction WHERE id=?", (listing_id,))
-        await db.commit()
-    return True
+        return True
+    return await _write(job)
 
 async def get_auction_count():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("SELECT COUNT(*) FROM auction")
         return (await cur.fetchone())[0]
 
 # ======== ЕЖЕДНЕВНЫЙ БОНУС ========
 async def check_daily(user_id):
-    player = await get_player(user_id)
-    if not player: return None
-    today = datetime.now().strftime("%Y-%m-%d")
-    if player["last_daily"] == today: return None
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    new_streak = player["daily_streak"] + 1 if player["last_daily"] == yesterday else 1
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET last_daily=?,daily_streak=? WHERE user_id=?", (today, new_streak, user_id))
-        await db.commit()
-    return {"daily_streak": new_streak}
+    today = today_day()
+    async def job(db):
+        cur = await db.execute("SELECT daily_day, daily_streak FROM players WHERE user_id=?", (user_id,))
+        player = await cur.fetchone()
+        if not player or player["daily_day"] == today: return None
+        new_streak = player["daily_streak"] + 1 if player["daily_day"] == today - 1 else 1
+        await db.execute("UPDATE players SET daily_day=?,daily_streak=? WHERE user_id=?", (today, new_streak, user_id))
+        return {"daily_streak": new_streak}
+    return await _write(job, user_id)
 
 # ======== ЛИДЕРБОРД ========
+# Рейтинги в памяти (_leaders) обновляются после каждого коммита строки игрока.
+# Экраны топа читают снимки leaderboard_snapshot: refresh_leaderboards() переписывает
+# их из _leaders раз в LEADERBOARD_REFRESH_SECONDS (задача leaderboard_refresher).
+# Текущее поколение снимка каждого рейтинга — leaderboard_meta.gen.
+_SNAPSHOT_COLS = ("board", "gen", "pos", "rank") + LEADER_FIELDS
+_SNAPSHOT_INSERT_SQL = f"INSERT INTO leaderboard_snapshot ({','.join(_SNAPSHOT_COLS)}) VALUES ({','.join('?' * len(_SNAPSHOT_COLS))})"
+_SNAPSHOT_GEN = "gen=(SELECT gen FROM leaderboard_meta WHERE board=?)"
+
+async def refresh_leaderboards():
+    """Новое поколение снимков пишется рядом со старым частями по LEADERBOARD_CHUNK строк —
+    каждая отдельным заданием писателя, между ними проходят действия игроков. Потом короткое
+    задание переключает читателей на новое поколение, старое удаляется такими же частями.
+    Одновременно — только одна задача обновления (leaderboard_refresher)"""
+    now = int(time.time())
+    async with _read() as db:
+        gens = dict(await (await db.execute("SELECT board,gen FROM leaderboard_meta")).fetchall())
+    boards = {b: [(b, gens.get(b, 0) + 1, pos, rank, *(e[k] for k in LEADER_FIELDS)) for pos, (rank, e) in enumerate(_leaders.ranked(b), 1)]
+              for b in _leaders.boards}
+    for board, rows in boards.items():
+        gen = gens.get(board, 0) + 1
+        for i in range(0, len(rows), LEADERBOARD_CHUNK):
+            await _write(lambda db: db.executemany(_SNAPSHOT_INSERT_SQL, rows[i:i + LEADERBOARD_CHUNK]))
+        await _write(lambda db: db.execute("INSERT OR REPLACE INTO leaderboard_meta (board,refreshed_at,gen) VALUES (?,?,?)", (board, now, gen)))
+        async def drop_old(db):
+            cur = await db.execute("""DELETE FROM leaderboard_snapshot WHERE (board,gen,pos) IN (
+                SELECT board,gen,pos FROM leaderboard_snapshot WHERE board=? AND gen<? LIMIT ?)""", (board, gen, LEADERBOARD_CHUNK))
+            return cur.rowcount
+        while await _write(drop_old) == LEADERBOARD_CHUNK: pass
+
+async def leaderboard_refresher():
+    """Фоновая задача: обновлять снимки рейтингов, пока не отменят"""
+    while True:
+        try: await refresh_leaderboards()
+        except Exception as e: logger.error("Leaderboard refresh failed: %s", e)
+        await asyncio.sleep(LEADERBOARD_REFRESH_SECONDS)
+
+async def _snapshot_top(board, limit):
+    async with _read() as db:
+        cur = await db.execute(f"SELECT * FROM leaderboard_snapshot WHERE board=? AND {_SNAPSHOT_GEN} ORDER BY pos LIMIT ?", (board, board, limit))
+        return [dict(r) for r in await cur.fetchall()]
+
 async def get_leaderboard_xp(limit=10):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT user_id,username,first_name,class,level,arena_rating,total_kills,tower_floor FROM players WHERE class!='' ORDER BY level DESC,arena_rating DESC LIMIT ?", (limit,))
-        return [{"user_id":r[0],"username":r[1],"first_name":r[2],"class":r[3],"level":r[4],"arena_rating":r[5],"total_kills":r[6],"tower_floor":r[7]} for r in await cur.fetchall()]
+    return await _snapshot_top("level", limit)
 
 async def get_leaderboard_arena(limit=10):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT user_id,username,first_name,class,level,arena_rating,arena_wins,arena_losses FROM players WHERE class!='' ORDER BY arena_rating DESC LIMIT ?", (limit,))
-        return [{"user_id":r[0],"username":r[1],"first_name":r[2],"class":r[3],"level":r[4],"arena_rating":r[5],"arena_wins":r[6],"arena_losses":r[7]} for r in await cur.fetchall()]
+    return await _snapshot_top("arena", limit)
 
-async def get_player_rank(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT COUNT(*)+1 FROM players WHERE class!='' AND (level>(SELECT level FROM players WHERE user_id=?) OR (level=(SELECT level FROM players WHERE user_id=?) AND arena_rating>(SELECT arena_rating FROM players WHERE user_id=?)))", (user_id, user_id, user_id))
-        return (await cur.fetchone())[0]
+async def get_leaderboard_tower(limit=10):
+    return await _snapshot_top("tower", limit)
+
+async def get_player_rank(user_id, board="level"):
+    """Место игрока в последнем снимке (равные делят место); None — ещё не попал в снимок"""
+    async with _read() as db:
+        row = await (await db.execute(f"SELECT rank FROM leaderboard_snapshot WHERE board=? AND {_SNAPSHOT_GEN} AND user_id=?",
+                                      (board, board, user_id))).fetchone()
+        return row[0] if row else None
+
+async def get_leaderboard_age(board="level"):
+    """Сколько секунд назад сделан снимок; None — снимков ещё не было"""
+    async with _read() as db:
+        row = await (await db.execute("SELECT refreshed_at FROM leaderboard_meta WHERE board=?", (board,))).fetchone()
+        return max(0, int(time.time()) - row[0]) if row else None
 
 async def get_bot_stats():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read() as db:
         t = (await (await db.execute("SELECT COUNT(*) FROM players WHERE class!=''")).fetchone())[0]
         h = (await (await db.execute("SELECT COALESCE(SUM(total_hunts),0) FROM players")).fetchone())[0]
         a = (await (await db.execute("SELECT COALESCE(SUM(arena_wins+arena_losses),0) FROM players")).fetchone())[0]
         return {"total_players": t, "total_hunts": h, "total_arena_fights": a}
+
+
+# ======== ДЕЙСТВИЯ ========
+class _Conflict(Exception):
+    """Строка игрока изменилась после чтения — действие откатывается"""
+
+class Action:
+    """Игровое действие одной транзакцией: одно чтение в action(), все записи — одним
+    заданием писателя в commit(). Изменения сразу видны в act.player. Прогресс квестов
+    учитывается после коммита, в памяти (update_quest_progress).
+
+    Поля, которые действие перезаписывает целиком (xp, энергия, этаж, дневные счётчики), проверяются
+    на неизменность с момента чтения; если кто-то успел их поменять, commit() вернёт False
+    и ничего не запишет."""
+
+    def __init__(self, user_id, player):
+        self.user_id, self.player = user_id, player
+        self._orig = dict(player) if player else {}
+        self._set, self._add = {}, {}
+        self._guards, self._items, self._quests = [], [], {}
+        self._expedition = None
+
+    def _assign(self, field, value):
+        self._set[field] = value; self.player[field] = value
+
+    def _incr(self, field, amount):
+        self._add[field] = self._add.get(field, 0) + amount; self.player[field] += amount
+
+    def spend_energy(self, amount, current):
+        self.set_energy(current - amount)
+
+    def set_energy(self, amount):
+        self._assign("energy", amount); self._assign("energy_ts", int(time.time()))
+
+    def add_gold(self, amount): self._incr("gold", amount)
+
+    def add_crystals(self, amount): self._incr("crystals", amount)
+
+    def add_xp(self, xp):
+        from game_data import xp_for_level
+        cur_xp, cur_lvl, new_levels = self.player["xp"] + xp, self.player["level"], []
+        while cur_xp >= xp_for_level(cur_lvl):
+            cur_xp -= xp_for_level(cur_lvl); cur_lvl += 1; new_levels.append(cur_lvl)
+        self._assign("xp", cur_xp); self._assign("level", cur_lvl)
+        return new_levels
+
+    def record_hunt(self):
+        self._incr("total_hunts", 1); self._incr("total_kills", 1)
+
+    def use_daily(self, name):
+        """+1 к дневному счётчику (DAILY_COUNTERS) с учётом смены дня"""
+        count, day, _ = DAILY_COUNTERS[name]
+        self._assign(count, daily_used(self.player, name) + 1); self._assign(day, today_day())
+
+    def use_tower_attempt(self): self.use_daily("tower")
+
+    def advance_tower(self): self._assign("tower_floor", self.player["tower_floor"] + 1)
+
+    def use_wheel_spin(self): self._assign("wheel_day", today_day())
+
+    def add_item(self, item): self._items.append(_item_row(self.user_id, item))
+
+    def collect_expedition(self, exp_id):
+        self._expedition = exp_id
+        self._guards.append(("UPDATE expeditions SET is_collected=1 WHERE id=? AND user_id=? AND is_collected=0", (exp_id, self.user_id)))
+
+    def quest(self, quest_type, amount=1):
+        self._quests[quest_type] = self._quests.get(quest_type, 0) + amount
+
+    async def commit(self):
+        uid, sets, adds = self.user_id, self._set, self._add
+        async def job(db):
+            if sets or adds:
+                cols = [f"{k}=?" for k in sets] + [f"{k}={k}+?" for k in adds]
+                where = " AND ".join(["user_id=?"] + [f"{k} IS ?" for k in sets])
+                cur = await db.execute(f"UPDATE players SET {','.join(cols)} WHERE {where}",
+                                       (*sets.values(), *adds.values(), uid, *(self._orig[k] for k in sets)))
+                if cur.rowcount == 0: raise _Conflict()
+            for sql, params in self._guards:
+                cur = await db.execute(sql, params)
+                if cur.rowcount == 0: raise _Conflict()
+            if self._items:
+                await db.executemany(_ITEM_INSERT_SQL, self._items)
+        try:
+            await _write(job, uid)
+        except _Conflict:
+            _forget_player(uid)
+            return False
+        if self._expedition: _forget_expedition(uid, self._expedition)
+        # Прогресс квестов — после коммита, в памяти (см. QuestEngine)
+        for qtype, amount in self._quests.items():
+            await update_quest_progress(uid, qtype, amount)
+        return True
+
+async def action(user_id):
+    """Начать действие: строка игрока (с бонусами экипировки) из кэша"""
+    return Action(user_id, await get_player(user_id))
+
+
+if __name__ == "__main__":
+    # python database.py — создать таблицы и применить миграции
+    asyncio.run(migrate_db())
@@ -2,7 +2,33 @@
 ⚔️ Данные игрового мира — текстовая MMO RPG v2
 Классы, монстры, 8 зон, башня, квесты, экспедиции, колесо, крафт, аукцион
 """
+import hashlib
 import random
+import secrets
+from loot import AliasTable
+
+# ============ ГСЧ ============
+# Все случайные функции принимают rng — объект с API random.Random.
+# По умолчанию это модуль random; для воспроизводимых боёв и лута — RngStream.
+
+class RngStream(random.Random):
+    """Поток ГСЧ, который помнит свой сид: RngStream(s) повторяет те же броски"""
+
+    def __init__(self, seed: int):
+        self.seed_value = seed
+        super().__init__(seed)
+
+
+def derive_seed(*parts) -> int:
+    """Детерминированный 64-битный сид из частей (игрок, действие, соль...)"""
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode(), digest_size=8).digest(), "big")
+
+
+def rng_for(user_id: int, action: str, salt: int = None) -> RngStream:
+    """Поток для одного действия игрока. Без salt берётся криптостойкая соль,
+    так что исход нельзя предсказать заранее, но по seed_value его можно переиграть."""
+    return RngStream(derive_seed(user_id, action, secrets.randbits(64) if salt is None else salt))
+
 
 # ============ РЕДКОСТЬ ============
 RARITIES = ["common", "uncommon", "rare", "epic", "legendary"]
@@ -158,22 +184,26 @@ ZONES = [
 ]
 
 
+ZONES_BY_ID = {z["id"]: z for z in ZONES}
+ZONE_DROP_TABLES = {z["id"]: AliasTable.from_rates(z["drop_rates"]) for z in ZONES}
+
+
 def get_available_zones(level: int) -> list:
     return [z for z in ZONES if level >= z["min_level"]]
 
 
-def pick_monster(zone_id: int) -> tuple:
+def pick_monster(zone_id: int, rng=random) -> tuple:
     """Выбрать монстра. Возвращает (monster, is_boss)"""
-    zone = next(z for z in ZONES if z["id"] == zone_id)
+    zone = ZONES_BY_ID[zone_id]
     # 8% шанс встретить мини-босса
-    if random.randint(1, 100) <= 8 and zone.get("boss"):
+    if rng.randint(1, 100) <= 8 and zone.get("boss"):
         return zone["boss"], True
-    return random.choice(zone["monsters"]), False
+    return rng.choice(zone["monsters"]), False
 
 
 # ============ БАШНЯ ИСПЫТАНИЙ ============
 
-def get_tower_monster(floor: int) -> dict:
+def get_tower_monster(floor: int, rng=random) -> dict:
     """Сгенерировать монстра башни для этажа"""
     is_boss = floor % 10 == 0
     mult = 2.0 if is_boss else 1.0
@@ -190,11 +220,11 @@ def get_tower_monster(floor: int) -> dict:
     emojis_boss = ["👑", "🔱", "💎", "⭐", "🏆"]
 
     if is_boss:
-        name = f"🔴 {random.choice(names_boss)} (Этаж {floor})"
-        emoji = random.choice(emojis_boss)
+        name = f"🔴 {rng.choice(names_boss)} (Этаж {floor})"
+        emoji = rng.choice(emojis_boss)
     else:
-        name = f"{random.choice(names_normal)} (Этаж {floor})"
-        emoji = random.choice(emojis_normal)
+        name = f"{rng.choice(names_normal)} (Этаж {floor})"
+        emoji = rng.choice(emojis_normal)
 
     return {
         "name": name,
@@ -206,28 +236,30 @@ def get_tower_monster(floor: int) -> dict:
     }
 
 
-def tower_rewards(floor: int) -> dict:
+def tower_rewards(floor: int, rng=random) -> dict:
     """Награды за этаж башни"""
     is_boss = floor % 10 == 0
     return {
         "gold": (100 + floor * 12) * (3 if is_boss else 1),
         "xp": (15 + floor * 5) * (3 if is_boss else 1),
         "crystals": (floor // 5) + (10 if is_boss else 0),
-        "drop_item": is_boss or random.randint(1, 100) <= 10 + floor // 5,
-        "drop_rarity": _tower_drop_rarity(floor),
+        "drop_item": is_boss or rng.randint(1, 100) <= 10 + floor // 5,
+        "drop_rarity": _tower_drop_rarity(floor, rng),
     }
 
 
-def _tower_drop_rarity(floor: int) -> str:
-    if floor >= 80:
-        return random.choices(["epic", "legendary"], [40, 60])[0]
-    if floor >= 50:
-        return random.choices(["rare", "epic", "legendary"], [20, 50, 30])[0]
-    if floor >= 30:
-        return random.choices(["uncommon", "rare", "epic"], [20, 50, 30])[0]
-    if floor >= 15:
-        return random.choices(["common", "uncommon", "rare"], [20, 50, 30])[0]
-    return random.choices(["common", "uncommon", "rare"], [50, 35, 15])[0]
+# (минимальный этаж, таблица редкости) — от верхних этажей к нижним
+TOWER_DROP_TIERS = [
+    (80, AliasTable(["epic", "legendary"], [40, 60])),
+    (50, AliasTable(["rare", "epic", "legendary"], [20, 50, 30])),
+    (30, AliasTable(["uncommon", "rare", "epic"], [20, 50, 30])),
+    (15, AliasTable(["common", "uncommon", "rare"], [20, 50, 30])),
+    (0, AliasTable(["common", "uncommon", "rare"], [50, 35, 15])),
+]
+
+
+def _tower_drop_rarity(floor: int, rng=random) -> str:
+    return next(t for f, t in TOWER_DROP_TIERS if floor >= f).sample(rng)
 
 
 # ============ КВЕСТЫ ============
@@ -247,19 +279,20 @@ QUEST_TEMPLATES = [
 ]
 
 
-def generate_daily_quests(count: int = 3) -> list:
-    """Сгенерировать ежедневные квесты"""
-    # Берём разные типы
-    types_used = set()
-    quests = []
-    shuffled = random.sample(QUEST_TEMPLATES, len(QUEST_TEMPLATES))
-    for q in shuffled:
-        if q["type"] not in types_used and len(quests) < count:
-            quests.append(q.copy())
-            types_used.add(q["type"])
-    # Если не набрали — добираем любые
+QUESTS_BY_TYPE = {t: [q for q in QUEST_TEMPLATES if q["type"] == t] for t in dict.fromkeys(q["type"] for q in QUEST_TEMPLATES)}
+
+
+def generate_daily_quests(count: int = 3, rng=random) -> list:
+    """Сгенерировать ежедневные квесты разных типов.
+    Тип выбирается с весом по числу его шаблонов (без повторов), шаблон внутри типа — равновероятно:
+    то же распределение, что у перемешивания всех шаблонов и взятия первого каждого типа."""
+    types, weights, quests = list(QUESTS_BY_TYPE), [len(v) for v in QUESTS_BY_TYPE.values()], []
+    while types and len(quests) < count:
+        i = rng.choices(range(len(types)), weights)[0]
+        quests.append(rng.choice(QUESTS_BY_TYPE[types.pop(i)]).copy()); weights.pop(i)
+    # Если типов меньше, чем нужно, — добираем любые
     while len(quests) < count:
-        quests.append(random.choice(QUEST_TEMPLATES).copy())
+        quests.append(rng.choice(QUEST_TEMPLATES).copy())
     return quests
 
 
@@ -277,19 +310,18 @@ EXPEDITIONS = [
 ]
 
 
-def generate_expedition_rewards(exp_id: str) -> dict:
+EXPEDITIONS_BY_ID = {e["id"]: e for e in EXPEDITIONS}
+EXPEDITION_ITEM_TABLE = AliasTable(["uncommon", "rare", "epic", "legendary"], [40, 35, 20, 5])
+
+
+def generate_expedition_rewards(exp_id: str, rng=random) -> dict:
     """Сгенерировать награды экспедиции"""
-    exp = next(e for e in EXPEDITIONS if e["id"] == exp_id)
-    gold = random.randint(*exp["gold"])
-    xp = random.randint(*exp["xp"])
-    crystals = random.randint(*exp["crystals"])
-    has_item = random.randint(1, 100) <= exp["item_chance"]
-    item_rarity = ""
-    if has_item:
-        item_rarity = random.choices(
-            ["uncommon", "rare", "epic", "legendary"],
-            [40, 35, 20, 5]
-        )[0]
+    exp = EXPEDITIONS_BY_ID[exp_id]
+    gold = rng.randint(*exp["gold"])
+    xp = rng.randint(*exp["xp"])
+    crystals = rng.randint(*exp["crystals"])
+    has_item = rng.randint(1, 100) <= exp["item_chance"]
+    item_rarity = EXPEDITION_ITEM_TABLE.sample(rng) if has_item else ""
     return {"gold": gold, "xp": xp, "crystals": crystals, "item_rarity": item_rarity}
 
 
@@ -312,9 +344,11 @@ WHEEL_PRIZES = [
 ]
 
 
-def spin_wheel() -> dict:
-    weights = [p["weight"] for p in WHEEL_PRIZES]
-    return random.choices(WHEEL_PRIZES, weights=weights)[0]
+WHEEL_TABLE = AliasTable(WHEEL_PRIZES, [p["weight"] for p in WHEEL_PRIZES])
+
+
+def spin_wheel(rng=random) -> dict:
+    return WHEEL_TABLE.sample(rng)
 
 
 # ============ ПРЕДМЕТЫ ============
@@ -406,58 +440,52 @@ GACHA_10X_COST = 450
 
 GACHA_RATES_FREE = {"common": 50, "uncommon": 30, "rare": 15, "epic": 4, "legendary": 1}
 GACHA_RATES_PREMIUM = {"uncommon": 30, "rare": 40, "epic": 25, "legendary": 5}
+GACHA_TABLE_FREE = AliasTable.from_rates(GACHA_RATES_FREE)
+GACHA_TABLE_PREMIUM = AliasTable.from_rates(GACHA_RATES_PREMIUM)
 
 
-def _pick_rarity(rates: dict) -> str:
-    roll = random.randint(1, 100)
-    cumulative = 0
-    for rarity, chance in rates.items():
-        cumulative += chance
-        if roll <= cumulative:
-            return rarity
-    return list(rates.keys())[-1]
-
-
-def generate_item(rarity: str, item_type: str = None) -> dict:
+def generate_item(rarity: str, item_type: str = None, rng=random) -> dict:
     if not item_type:
-        item_type = random.choice(["weapon", "armor", "accessory"])
+        item_type = rng.choice(["weapon", "armor", "accessory"])
     templates = {"weapon": WEAPONS, "armor": ARMORS, "accessory": ACCESSORIES}
     pool = templates[item_type].get(rarity, templates[item_type]["common"])
-    base = random.choice(pool)
+    base = rng.choice(pool)
 
     def vary(val):
         if val == 0: return 0
-        return max(1, int(val * random.uniform(0.85, 1.15)))
+        return max(1, int(val * rng.uniform(0.85, 1.15)))
 
     return {
         "item_type": item_type, "name": base["name"], "rarity": rarity,
         "bonus_attack": vary(base["attack"]), "bonus_defense": vary(base["defense"]),
-        "bonus_hp": vary(base["hp"]), "bonus_crit": round(base["crit"] * random.uniform(0.9, 1.1), 1),
+        "bonus_hp": vary(base["hp"]), "bonus_crit": round(base["crit"] * rng.uniform(0.9, 1.1), 1),
     }
 
 
-def gacha_pull(is_premium=False):
-    rarity = _pick_rarity(GACHA_RATES_PREMIUM if is_premium else GACHA_RATES_FREE)
-    return generate_item(rarity)
+def gacha_pull(is_premium=False, rng=random):
+    rarity = (GACHA_TABLE_PREMIUM if is_premium else GACHA_TABLE_FREE).sample(rng)
+    return generate_item(rarity, rng=rng)
 
 
-def gacha_pull_10x():
-    items = [gacha_pull(is_premium=True) for _ in range(10)]
+def gacha_pull_10x(rng=random):
+    items = [generate_item(r, rng=rng) for r in GACHA_TABLE_PREMIUM.sample_k(10, rng)]
     if not any(i["rarity"] in ("epic", "legendary") for i in items):
-        items[-1] = generate_item(random.choice(["epic", "legendary"]))
+        items[-1] = generate_item(rng.choice(["epic", "legendary"]), rng=rng)
     return items
 
 
 # ============ БОЕВАЯ СИСТЕМА ============
+MAX_COMBAT_ROUNDS = 25
+
 
-def simulate_combat(attacker: dict, defender: dict) -> dict:
+def simulate_combat(attacker: dict, defender: dict, rng=random) -> dict:
     atk_hp, def_hp = attacker["hp"], defender["hp"]
     log, total_dealt, total_received, crits, rounds = [], 0, 0, 0, 0
 
-    while atk_hp > 0 and def_hp > 0 and rounds < 25:
+    while atk_hp > 0 and def_hp > 0 and rounds < MAX_COMBAT_ROUNDS:
         rounds += 1
-        is_crit = random.random() * 100 < attacker.get("crit", 5)
-        dmg = max(1, int(attacker["attack"] * random.uniform(0.8, 1.2) - defender["defense"] * 0.3))
+        is_crit = rng.random() * 100 < attacker.get("crit", 5)
+        dmg = max(1, int(attacker["attack"] * rng.uniform(0.8, 1.2) - defender["defense"] * 0.3))
         if is_crit:
             dmg *= 2
             crits += 1
@@ -466,7 +494,7 @@ def simulate_combat(attacker: dict, defender: dict) -> dict:
         log.append(f"⚔️ Ты: -{dmg} HP{'💥' if is_crit else ''}")
         if def_hp <= 0:
             break
-        dmg_b = max(1, int(defender["attack"] * random.uniform(0.8, 1.2) - attacker["defense"] * 0.3))
+        dmg_b = max(1, int(defender["attack"] * rng.uniform(0.8, 1.2) - attacker["defense"] * 0.3))
         atk_hp -= dmg_b
         total_received += dmg_b
         log.append(f"👹 Враг: -{dmg_b} HP")
@@ -507,8 +535,8 @@ def format_item_stats(item):
     if item.get("bonus_crit", 0): p.append(f"+{item['bonus_crit']}%КР")
     return ", ".join(p) if p else "—"
 
-def try_drop_item(zone_id):
-    zone = next((z for z in ZONES if z["id"] == zone_id), None)
+def try_drop_item(zone_id, rng=random):
+    zone = ZONES_BY_ID.get(zone_id)
     if not zone: return None
-    if random.randint(1, 100) > zone["drop_chance"]: return None
-    return generate_item(_pick_rarity(zone["drop_rates"]))
+    if rng.randint(1, 100) > zone["drop_chance"]: return None
+    return generate_item(ZONE_DROP_TABLES[zone_id].sample(rng), rng=rng)
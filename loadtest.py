@@ -0,0 +1,194 @@
+"""
+🧪 Нагрузочный тест MMO RPG v2
+Синтетические апдейты Telegram от тысяч игроков прогоняются через dp без сети:
+сессия бота только считает вызовы API (edit_text, answer, ...) и отвечает заглушкой.
+
+    python loadtest.py --users 2000 --updates 20000 --concurrency 200
+    python loadtest.py --mix hunt=1,afight=1 --updates 5000
+
+Каждый апдейт — нажатие под своим сообщением (message_id = номер апдейта): UserLocks
+не склеивает их как повторные, но нажатия одного игрока по-прежнему идут по очереди.
+
+Отчёт: пропускная способность, p50/p99 времени обработки апдейта и время в БД
+(ожидание _read/_write) по хэндлерам. БД — временный файл (или --db),
+пул, кэш и пачки писателя — как в config.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+# Доля апдейта каждого вида в потоке (переопределяется --mix)
+MIX = {"hunt": 40, "afight": 15, "tw_go": 10, "gacha": 10, "invp": 15, "auc_b": 10}
+
+_db_spent = ContextVar("db_spent")
+
+
+def _percentile(xs: list, q: float) -> float:
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+
+
+def _kind(data: str) -> str:
+    """hz_3 -> hz, invp_2 -> invp, auc_bp_4 -> auc_bp"""
+    return re.sub(r"_?\d+$", "", data)
+
+
+def _instrument(db):
+    """Время, проведённое апдейтом в _read/_write, копится в его _db_spent"""
+    read, write = db._read, db._write
+
+    @asynccontextmanager
+    async def timed_read():
+        t = time.perf_counter()
+        try:
+            async with read() as conn: yield conn
+        finally:
+            if (spent := _db_spent.get(None)) is not None: spent[0] += time.perf_counter() - t
+
+    async def timed_write(job, *touched):
+        t = time.perf_counter()
+        try: return await write(job, *touched)
+        finally:
+            if (spent := _db_spent.get(None)) is not None: spent[0] += time.perf_counter() - t
+
+    db._read, db._write = timed_read, timed_write
+
+
+def _session():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message
+
+    class RecordingSession(BaseSession):
+        """Сессия без сети: считает методы API, Message-методам отвечает пустым сообщением"""
+        def __init__(self):
+            super().__init__(); self.calls = Counter(); self.ids = itertools.count(1)
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls[type(method).__name__] += 1
+            if method.__returning__ is Message:
+                return Message(message_id=next(self.ids), date=datetime.now(), chat=Chat(id=0, type="private"))
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self): pass
+
+    return RecordingSession()
+
+
+def _updates(users: list, n: int, mix: dict, rng: random.Random):
+    """n апдейтов: (вид, Update) от случайных игроков, виды — по весам mix"""
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+    from game_data import ZONES
+    kinds, weights = list(mix), list(mix.values())
+    for i in range(n):
+        uid, level = rng.choice(users)
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "hunt": data = f"hz_{rng.choice([z['id'] for z in ZONES if z['min_level'] <= level])}"
+        elif kind == "invp": data = f"invp_{rng.randint(1, 3)}"
+        elif kind == "auc_b": data = f"auc_bp_{rng.randint(1, 6)}"
+        elif kind == "gacha": data = rng.choice(["gfree", "gprem", "g10x"])
+        else: data = kind
+        user = User(id=uid, is_bot=False, first_name=f"U{uid}")
+        msg = Message(message_id=i + 1, date=datetime.now(), chat=Chat(id=uid, type="private"), from_user=user, text="x")
+        yield _kind(data), Update(update_id=i + 1, callback_query=CallbackQuery(
+            id=str(i + 1), from_user=user, chat_instance="lt", message=msg, data=data))
+
+
+async def _seed(db, n_users: int, items: int, listings: int, rng: random.Random) -> list:
+    """Игроки случайных классов и уровней с запасом ресурсов, вещами и лотами аукциона"""
+    from game_data import CLASSES, generate_item
+    users = [(10**6 + i, rng.randint(1, 50)) for i in range(n_users)]
+    await asyncio.gather(*(db.create_player(uid, f"u{uid}", f"U{uid}", rng.choice(list(CLASSES))) for uid, _ in users))
+    async def job(conn):
+        await conn.executemany("UPDATE players SET level=?,gold=10000000,crystals=1000000,energy=1000000,max_energy=1000000 WHERE user_id=?",
+                               [(lvl, uid) for uid, lvl in users])
+    await db._write(job, *(uid for uid, _ in users))
+    rarities = ["common", "uncommon", "rare", "epic", "legendary"]
+    ids = await asyncio.gather(*(db.add_item(uid, generate_item(rng.choice(rarities), rng=rng))
+                                 for uid, _ in users for _ in range(items)))
+    owners = [uid for uid, _ in users for _ in range(items)]
+    picks = rng.sample(range(len(ids)), min(listings, len(ids)))
+    await asyncio.gather(*(db.list_on_auction(owners[i], ids[i], rng.randint(50, 5000)) for i in picks))
+    await db.load_player_indexes()
+    return users
+
+
+async def run(args) -> dict:
+    import bot as B, database as db
+    # Сиды действий бот пишет в INFO — в нагрузочном тесте это тысячи строк
+    for name in ("aiogram", "bot"): logging.getLogger(name).setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    await db.init_db()
+    t = time.perf_counter()
+    users = await _seed(db, args.users, args.items, args.listings, rng)
+    print(f"🌱 {args.users} игроков, {args.users * args.items} вещей за {time.perf_counter() - t:.1f}с")
+    _instrument(db)
+    session = _session()
+    B.bot.session = session
+    mix = dict(MIX) if not args.mix else {k: float(v) for k, v in (p.split("=") for p in args.mix.split(","))}
+    queue = asyncio.Queue()
+    for item in _updates(users, args.updates, mix, rng): queue.put_nowait(item)
+    lat, dbt, errors = defaultdict(list), defaultdict(list), Counter()
+
+    async def worker():
+        while not queue.empty():
+            kind, update = queue.get_nowait()
+            spent = [0.0]; _db_spent.set(spent)
+            t0 = time.perf_counter()
+            try: await B.dp.feed_update(B.bot, update)
+            except Exception as e: errors[f"{kind}: {type(e).__name__}({e})"] += 1
+            lat[kind].append(time.perf_counter() - t0); dbt[kind].append(spent[0])
+
+    t = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - t
+    await db.close_db()
+    return {"wall": wall, "lat": lat, "db": dbt, "errors": errors, "calls": session.calls}
+
+
+def report(res: dict, n: int):
+    lat, dbt = res["lat"], res["db"]
+    allx = sorted(x for xs in lat.values() for x in xs)
+    print(f"\n⚡ {n} апдейтов за {res['wall']:.2f}с — {n / res['wall']:.0f} апд/с, "
+          f"p50 {_percentile(allx, .5) * 1000:.1f}мс, p99 {_percentile(allx, .99) * 1000:.1f}мс\n")
+    print(f"{'хэндлер':<10}{'кол-во':>8}{'p50 мс':>9}{'p99 мс':>9}{'БД мс':>9}{'БД %':>7}")
+    for kind in sorted(lat, key=lambda k: -len(lat[k])):
+        xs, total, spent = sorted(lat[kind]), sum(lat[kind]), sum(dbt[kind])
+        print(f"{kind:<10}{len(xs):>8}{_percentile(xs, .5) * 1000:>9.1f}{_percentile(xs, .99) * 1000:>9.1f}"
+              f"{spent / len(xs) * 1000:>9.2f}{spent / total * 100 if total else 0:>6.0f}%")
+    print("\n📡 Вызовы API: " + ", ".join(f"{k} {v}" for k, v in res["calls"].most_common()))
+    for err, cnt in res["errors"].most_common():
+        print(f"❌ {cnt}× {err}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Нагрузочный тест хэндлеров бота")
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--updates", type=int, default=20000)
+    ap.add_argument("--concurrency", type=int, default=200, help="апдейтов в обработке одновременно")
+    ap.add_argument("--items", type=int, default=12, help="вещей у каждого игрока")
+    ap.add_argument("--listings", type=int, default=200, help="лотов на аукционе")
+    ap.add_argument("--mix", default="", help="вид=вес через запятую, виды: " + ",".join(MIX))
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--db", default="", help="файл БД (по умолчанию — временный)")
+    args = ap.parse_args()
+    # Настройки читаются config при импорте — задаём до импорта bot/database
+    os.environ["DATABASE_PATH"] = args.db or os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    if not os.environ.get("BOT_TOKEN"): os.environ["BOT_TOKEN"] = "0:loadtest"
+    os.environ["EXPEDITION_NOTIFY"] = os.environ["ENERGY_NOTIFY"] = "0"
+    report(asyncio.run(run(args)), args.updates)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+🎲 Таблицы лута MMO RPG v2
+Взвешенный выбор за O(1) методом алиасов (Vose): таблица строится один раз,
+каждый бросок — одно случайное число и одно сравнение
+"""
+import random
+
+
+class AliasTable:
+    """Исходы items с весами weights (любые неотрицательные числа, сумма > 0)"""
+    __slots__ = ("items", "weights", "_n", "_prob", "_alias")
+
+    def __init__(self, items, weights):
+        self.items, self.weights = list(items), [float(w) for w in weights]
+        n = self._n = len(self.items)
+        total = sum(self.weights)
+        if n == 0 or n != len(self.weights) or total <= 0 or min(self.weights) < 0:
+            raise ValueError("AliasTable: нужны исходы и неотрицательные веса с суммой > 0")
+        scaled = [w * n / total for w in self.weights]
+        self._prob, self._alias = [1.0] * n, list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self._prob[s], self._alias[s] = scaled[s], l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Остатки (ошибка округления) — вероятность 1, они уже выставлены
+
+    @classmethod
+    def from_rates(cls, rates: dict):
+        """{исход: шанс} -> таблица (как GACHA_RATES_* и drop_rates зон)"""
+        return cls(rates.keys(), rates.values())
+
+    def sample(self, rng=random):
+        u = rng.random() * self._n
+        i = int(u)
+        return self.items[i if u - i < self._prob[i] else self._alias[i]]
+
+    def sample_k(self, k: int, rng=random) -> list:
+        """k независимых бросков за один вызов"""
+        n, prob, alias, items, rand = self._n, self._prob, self._alias, self.items, rng.random
+        out = []
+        for _ in range(k):
+            u = rand() * n
+            i = int(u)
+            out.append(items[i if u - i < prob[i] else alias[i]])
+        return out
+
+    def probabilities(self) -> list:
+        """Вероятности исходов (в порядке items), восстановленные из таблицы — для проверки"""
+        p = [0.0] * self._n
+        for i in range(self._n):
+            p[i] += self._prob[i] / self._n
+            p[self._alias[i]] += (1.0 - self._prob[i]) / self._n
+        return p
+
+    def __len__(self):
+        return self._n
@@ -0,0 +1,82 @@
+"""
+⚔️ Подбор соперников арены MMO RPG v2
+Индекс в памяти вместо ORDER BY RANDOM(): корзины по уровню и список по рейтингу
+"""
+import bisect
+import random
+
+
+class ArenaIndex:
+    """Игроки с выбранным классом. Запись игрока — словарь с полями для экрана боя
+    (user_id, username, first_name, class, level, arena_rating) и боевыми статами в "stats".
+
+    _levels: уровень -> список user_id (удаление обменом с последним за O(1));
+    _ratings: отсортированный список (рейтинг, user_id) для поиска по близости рейтинга."""
+
+    def __init__(self):
+        self._entries = {}
+        self._levels = {}
+        self._pos = {}
+        self._ratings = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, entry: dict):
+        """Добавить игрока или обновить его уровень/рейтинг/статы. Смена рейтинга — поиск
+        O(log n) и сдвиг списка _ratings O(n) (memmove), на десятках тысяч игроков — микросекунды"""
+        uid = entry["user_id"]
+        old = self._entries.get(uid)
+        if old:
+            if old["level"] != entry["level"]:
+                self._bucket_remove(uid, old["level"]); self._bucket_add(uid, entry["level"])
+            if old["arena_rating"] != entry["arena_rating"]:
+                self._ratings.pop(bisect.bisect_left(self._ratings, (old["arena_rating"], uid)))
+                bisect.insort(self._ratings, (entry["arena_rating"], uid))
+        else:
+            self._bucket_add(uid, entry["level"])
+            bisect.insort(self._ratings, (entry["arena_rating"], uid))
+        self._entries[uid] = entry
+
+    def clear(self):
+        self._entries.clear(); self._levels.clear(); self._pos.clear(); self._ratings.clear()
+
+    def _bucket_add(self, uid, level):
+        bucket = self._levels.setdefault(level, [])
+        self._pos[uid] = len(bucket)
+        bucket.append(uid)
+
+    def _bucket_remove(self, uid, level):
+        bucket, i = self._levels[level], self._pos.pop(uid)
+        last = bucket.pop()
+        if last != uid:
+            bucket[i] = last; self._pos[last] = i
+        if not bucket: del self._levels[level]
+
+    def pick_by_level(self, user_id, level: int, spread: int, rng=random):
+        """Случайный соперник с уровнем в [level-spread, level+spread], кроме самого игрока.
+        Равновероятно среди всех подходящих: O(spread) корзин, без сортировки"""
+        buckets = [b for lvl in range(max(1, level - spread), level + spread + 1) if (b := self._levels.get(lvl))]
+        total = sum(len(b) for b in buckets)
+        own = self._entries.get(user_id)
+        if total - (own is not None and abs(own["level"] - level) <= spread) <= 0:
+            return None
+        while True:
+            r = rng.randrange(total)
+            for b in buckets:
+                if r < len(b): break
+                r -= len(b)
+            if b[r] != user_id: return self._entries[b[r]]
+
+    def pick_by_rating(self, user_id, rating: int, window: int, rng=random):
+        """Случайный из window ближайших по рейтингу соперников, O(log n + window)"""
+        i = bisect.bisect_left(self._ratings, (rating, user_id))
+        lo, hi, found = i - 1, i, []
+        while len(found) < window and (lo >= 0 or hi < len(self._ratings)):
+            # Берём того, чей рейтинг ближе, с той или другой стороны
+            if hi >= len(self._ratings) or (lo >= 0 and rating - self._ratings[lo][0] <= self._ratings[hi][0] - rating):
+                cand, lo = self._ratings[lo][1], lo - 1
+            else:
+                cand, hi = self._ratings[hi][1], hi + 1
+            if cand != user_id: found.append(cand)
+        return self._entries[rng.choice(found)] if found else None
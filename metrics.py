@@ -0,0 +1,185 @@
+"""
+📈 Метрики MMO RPG v2
+Гистограммы и счётчики в памяти процесса; отдаются на /metrics в текстовом формате Prometheus
+"""
+import bisect
+import functools
+import inspect
+import re
+import time
+from contextvars import ContextVar
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.filters import Command
+from aiogram.types import CallbackQuery, Message
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+_REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(label, value, **extra) -> str:
+    pairs = ([(label, value)] if label else []) + list(extra.items())
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, label=None):
+        self.name, self.help, self.label, self.values = name, help, label, {}
+        _REGISTRY.append(self)
+
+    def inc(self, value="", amount=1):
+        self.values[value] = self.values.get(value, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name}_total {self.help}"
+        yield f"# TYPE {self.name}_total counter"
+        for value, total in sorted(self.values.items()):
+            yield f"{self.name}_total{_labels(self.label, value)} {total}"
+
+
+class Histogram:
+    """values: значение метки -> [счётчики по корзинам (последняя — +Inf), сумма, количество]"""
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label, self.buckets, self.values = name, help, label, buckets, {}
+        _REGISTRY.append(self)
+
+    def observe(self, amount, value=""):
+        entry = self.values.get(value)
+        if entry is None: entry = self.values[value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, amount)] += 1
+        entry[1] += amount; entry[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for value, (counts, total, n) in sorted(self.values.items()):
+            acc = 0
+            for le, c in zip((*self.buckets, "+Inf"), counts):
+                acc += c
+                yield f"{self.name}_bucket{_labels(self.label, value, le=le)} {acc}"
+            yield f"{self.name}_sum{_labels(self.label, value)} {total:.6f}"
+            yield f"{self.name}_count{_labels(self.label, value)} {n}"
+
+
+def render() -> str:
+    return "\n".join(line for m in _REGISTRY for line in m.render()) + "\n"
+
+
+HANDLER_SECONDS = Histogram("rpg_handler_seconds", "Время обработки апдейта", "handler")
+HANDLER_ERRORS = Counter("rpg_handler_errors", "Исключений в хэндлерах", "handler")
+DB_CALL_SECONDS = Histogram("rpg_db_call_seconds", "Время вызова функции database", "call")
+DB_READS_PER_UPDATE = Histogram("rpg_db_reads_per_update", "Читающих соединений взято за апдейт", "handler", COUNT_BUCKETS)
+DB_WRITES_PER_UPDATE = Histogram("rpg_db_writes_per_update", "Заданий писателю за апдейт", "handler", COUNT_BUCKETS)
+DB_POOL_WAIT_SECONDS = Histogram("rpg_db_pool_wait_seconds", "Ожидание свободного читающего соединения")
+DB_COMMITS = Counter("rpg_db_commits", "Коммитов писателя")
+DB_WRITE_BATCH = Histogram("rpg_db_write_batch", "Заданий в одном коммите", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+# ============ ОБРАЩЕНИЯ К БД ЗА АПДЕЙТ ============
+# [чтений, записей] текущего апдейта; вне хэндлера (фоновые задачи) — None
+_update_db = ContextVar("update_db", default=None)
+
+
+def note_db_read():
+    if (counts := _update_db.get()) is not None: counts[0] += 1
+
+
+def note_db_write():
+    if (counts := _update_db.get()) is not None: counts[1] += 1
+
+
+# Команды с хэндлерами (register_commands); остальное, что начинается с «/», — метка "other",
+# иначе каждый присланный текст заводил бы свой ряд в метриках
+_commands = set()
+
+
+def register_commands(router):
+    """Запомнить команды из фильтров Command/CommandStart хэндлеров router.message"""
+    for h in router.message.handlers:
+        for f in h.filters or ():
+            if isinstance(f.callback, Command):
+                _commands.update(c for c in f.callback.commands if isinstance(c, str))
+
+
+def handler_name(event) -> str:
+    """Метка хэндлера: callback_data без числового хвоста (hz_3 -> hz_), команда или тип апдейта"""
+    if isinstance(event, CallbackQuery): return re.sub(r"\d+$", "", event.data or "")
+    if isinstance(event, Message):
+        if not (event.text and event.text.startswith("/")): return "message"
+        cmd = event.text.split()[0].split("@")[0]
+        return cmd if cmd[1:] in _commands else "other"
+    return type(event).__name__
+
+
+class HandlerTimer(BaseMiddleware):
+    """Время каждого апдейта и число обращений к БД по метке handler_name.
+    Апдейты, которые не взял ни один хэндлер, идут под меткой «other».
+    skip — метки, которые не замеряются (/perf держит хэндлер минутами и портил бы гистограмму)"""
+
+    def __init__(self, skip=()):
+        self.skip = frozenset(skip)
+
+    async def __call__(self, handler, event, data):
+        name, counts = handler_name(event), [0, 0]
+        if name in self.skip: return await handler(event, data)
+        token = _update_db.set(counts)
+        t = time.perf_counter()
+        try:
+            result = await handler(event, data)
+            if result is UNHANDLED: name = "other"
+            return result
+        except Exception:
+            HANDLER_ERRORS.inc(name); raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - t, name)
+            DB_READS_PER_UPDATE.observe(counts[0], name); DB_WRITES_PER_UPDATE.observe(counts[1], name)
+            _update_db.reset(token)
+
+
+def _timed(fn, name):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t = time.perf_counter()
+        try: return await fn(*args, **kwargs)
+        finally: DB_CALL_SECONDS.observe(time.perf_counter() - t, name)
+    return wrapper
+
+
+def instrument_module(module, skip=()):
+    """Обернуть публичные async-функции модуля (и async-методы его классов) замером времени.
+    Внутренние вызовы модуля идут через его глобальные имена — они тоже замеряются"""
+    for name, obj in list(vars(module).items()):
+        if name.startswith("_") or name in skip or getattr(obj, "__module__", None) != module.__name__: continue
+        if inspect.iscoroutinefunction(obj):
+            setattr(module, name, _timed(obj, name))
+        elif inspect.isclass(obj):
+            for attr, fn in list(vars(obj).items()):
+                if not attr.startswith("_") and inspect.iscoroutinefunction(fn):
+                    setattr(obj, attr, _timed(fn, f"{name}.{attr}"))
+
+
+# ============ HTTP ============
+async def _handle(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+def add_routes(app):
+    app.router.add_get("/metrics", _handle)
+
+
+async def start_server(host: str, port: int, setup=None):
+    """Отдельный aiohttp-сервер с /metrics (setup(app) — добавить свои маршруты); вернуть runner для cleanup()"""
+    app = web.Application(); add_routes(app)
+    if setup: setup(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
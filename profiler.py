@@ -0,0 +1,85 @@
+"""
+🔬 Семплирующий профайлер MMO RPG v2
+Стеки потока цикла событий снимаются из фонового потока; результат — collapsed stacks
+(формат flamegraph.pl / speedscope): «корень;функция;...;лист количество»
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+_lock = asyncio.Lock()
+
+
+def busy() -> bool:
+    return _lock.locked()
+
+
+def _stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Раз в interval секунд поток-семплер берёт стек потока цикла (sys._current_frames):
+    без sys.setprofile, так что обработка апдейтов почти не замедляется.
+
+    Задача в цикле отмечает пульс каждые interval секунд. Если пульс старше stall —
+    цикл заблокирован синхронной работой; такие семплы идут под корень «stall»,
+    остальные — под «loop». Каждая блокировка и её длительность пишется в stalls."""
+
+    def __init__(self, interval: float = 0.005, stall: float = 0.1):
+        self.interval, self.stall = interval, stall
+        self.samples = Counter()
+        self.stalls = []
+        self._beat = 0.0
+        self._done = threading.Event()
+
+    def _sample(self, thread_id):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None: continue
+            root = "stall" if time.perf_counter() - self._beat > self.stall else "loop"
+            self.samples[f"{root};{_stack(frame)}"] += 1
+
+    async def _pulse(self):
+        while not self._done.is_set():
+            before = time.perf_counter()
+            self._beat = before
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - before - self.interval
+            if lag > self.stall: self.stalls.append(lag)
+
+    async def run(self, seconds: float):
+        self._beat = time.perf_counter()
+        sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), name="profiler", daemon=True)
+        pulse = asyncio.create_task(self._pulse())
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._done.set()
+            await pulse
+            sampler.join()
+
+    def collapsed(self) -> bytes:
+        return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common()).encode()
+
+    def summary(self) -> dict:
+        stalled = sum(n for stack, n in self.samples.items() if stack.startswith("stall;"))
+        return {"samples": sum(self.samples.values()), "stall_samples": stalled,
+                "stalls": len(self.stalls), "max_stall": max(self.stalls, default=0.0)}
+
+
+async def profile(seconds: float, interval: float = 0.005, stall: float = 0.1) -> SamplingProfiler:
+    """Профилировать текущий процесс seconds секунд; одновременно — только один запуск"""
+    async with _lock:
+        prof = SamplingProfiler(interval, stall)
+        await prof.run(seconds)
+        return prof
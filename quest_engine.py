@@ -0,0 +1,54 @@
+"""
+📜 Прогресс квестов MMO RPG v2
+События копятся в памяти и пишутся в quests пачками
+"""
+
+
+class QuestEngine:
+    """_active: user_id -> (день, {тип: сколько ещё нужно}) — незавершённые квесты игрока за день.
+    Событие типа, которого у игрока нет (или который уже добит), ничего не делает.
+    _pending: (user_id, тип, день) -> накопленное приращение, ждёт записи в БД"""
+
+    def __init__(self):
+        self._active = {}
+        self._pending = {}
+
+    def known(self, user_id, day) -> bool:
+        entry = self._active.get(user_id)
+        return entry is not None and entry[0] == day
+
+    def load(self, user_id, day, remaining: dict):
+        """Задать незавершённые квесты игрока за день: {тип: осталось до цели}"""
+        self._active[user_id] = (day, {t: left for t, left in remaining.items() if left > 0})
+
+    def record(self, user_id, day, quest_type, amount=1) -> bool:
+        """Учесть событие. False — у игрока нет такого незавершённого квеста"""
+        entry = self._active.get(user_id)
+        if entry is None or entry[0] != day or quest_type not in entry[1]: return False
+        left = entry[1]
+        left[quest_type] -= amount
+        if left[quest_type] <= 0: del left[quest_type]
+        key = (user_id, quest_type, day)
+        self._pending[key] = self._pending.get(key, 0) + amount
+        return True
+
+    def take(self, user_id=None) -> list:
+        """Забрать накопленное: [(user_id, тип, день, приращение)] — всё или одного игрока"""
+        if user_id is None:
+            items, self._pending = self._pending, {}
+        else:
+            items = {k: self._pending.pop(k) for k in [k for k in self._pending if k[0] == user_id]}
+        return [(*k, amount) for k, amount in items.items()]
+
+    def requeue(self, items):
+        """Вернуть забранное, если запись не удалась"""
+        for uid, quest_type, day, amount in items:
+            key = (uid, quest_type, day)
+            self._pending[key] = self._pending.get(key, 0) + amount
+
+    def prune(self, day):
+        """Забыть состояние за прошедшие дни"""
+        self._active = {uid: e for uid, e in self._active.items() if e[0] == day}
+
+    def pending_count(self) -> int:
+        return len(self._pending)
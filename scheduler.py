@@ -0,0 +1,86 @@
+"""
+⏰ Планировщик MMO RPG v2
+Таймеры на одной задаче asyncio: куча по времени срабатывания, ключ — на каждый таймер
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """schedule(key, when, callback) — вызвать callback() в момент when (time.time()).
+    Повторный schedule с тем же ключом переносит таймер, cancel(key) — отменяет.
+    Записи в куче не удаляются сразу: устаревшие пропускаются при извлечении."""
+
+    def __init__(self):
+        self._heap = []
+        self._timers = {}
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def when(self, key):
+        timer = self._timers.get(key)
+        return timer[0] if timer else None
+
+    def schedule(self, key, when: float, callback):
+        seq = next(self._seq)
+        self._timers[key] = (when, seq, callback)
+        heapq.heappush(self._heap, (when, seq, key))
+        if self._heap[0][1] == seq: self._wake.set()
+
+    def cancel(self, key):
+        self._timers.pop(key, None)
+
+    def start(self):
+        if not self._task: self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task: return
+        self._task.cancel()
+        try: await self._task
+        except asyncio.CancelledError: pass
+        self._task = None
+
+    def _due(self, now):
+        """Снять с кучи все наступившие таймеры"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            if self._live(item):
+                due.append((item[2], self._timers.pop(item[2])[2]))
+        # Устаревшие записи на вершине тоже выбрасываем, чтобы не просыпаться ради них
+        while self._heap and not self._live(self._heap[0]):
+            heapq.heappop(self._heap)
+        return due
+
+    def _live(self, item):
+        timer = self._timers.get(item[2])
+        return timer is not None and timer[1] == item[1]
+
+    async def _run(self):
+        while True:
+            for key, callback in self._due(time.time()):
+                try:
+                    res = callback()
+                    if asyncio.iscoroutine(res): asyncio.create_task(self._guard(key, res))
+                except Exception as e: logger.error("Timer %s failed: %s", key, e)
+            self._wake.clear()
+            timeout = max(0.0, self._heap[0][0] - time.time()) if self._heap else None
+            try: await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError: pass
+
+    @staticmethod
+    async def _guard(key, coro):
+        try: await coro
+        except Exception as e: logger.error("Timer %s failed: %s", key, e)
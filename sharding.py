@@ -0,0 +1,138 @@
+"""
+🔀 Шардирование MMO RPG v2
+Фронт-процесс принимает апдейты (long polling или webhook) и раздаёт их WORKERS воркерам
+по user_id % WORKERS: все апдейты игрока попадают в один процесс и в порядке поступления.
+Воркеру апдейты идут SHARD_LANES полосами: в полосе — строго по одному (следующий — после
+того, как воркер обработал предыдущий), игрок всегда в одной полосе.
+Воркеры — тот же bot.py с RUN_MODE=worker: слушают 127.0.0.1:SHARD_BASE_PORT+номер
+и делят одну БД SQLite (WAL). Фронт запускает их сам и перезапускает упавших.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import sys
+import aiohttp
+from aiohttp import web
+import config, metrics
+
+logger = logging.getLogger(__name__)
+
+ROUTED = metrics.Counter("rpg_front_updates", "Апдейтов передано воркерам", "worker")
+WORKER_PATH = "/update"
+
+# Поля апдейта, у события в которых есть автор (from)
+_EVENT_KEYS = ("message", "edited_message", "callback_query", "pre_checkout_query", "shipping_query",
+               "inline_query", "chosen_inline_result", "my_chat_member", "chat_member", "chat_join_request")
+
+
+def shard_of(user_id: int, workers: int) -> int:
+    return user_id % workers
+
+
+def update_user_id(update: dict):
+    """Автор апдейта (JSON от Telegram); None — у апдейта нет пользователя"""
+    for key in _EVENT_KEYS:
+        if (event := update.get(key)) and (user := event.get("from")): return user["id"]
+    return None
+
+
+class Front:
+    """Очередь на каждую полосу каждого воркера; апдейты без пользователя идут воркеру 0"""
+
+    def __init__(self, workers: int, base_port: int, secret: str, lanes: int = 1):
+        self.workers, self.base_port, self.secret, self.lanes = workers, base_port, secret, lanes
+        self.queues = [[asyncio.Queue() for _ in range(lanes)] for _ in range(workers)]
+
+    def route(self, update: dict):
+        uid = update_user_id(update)
+        if uid is None: self.queues[0][0].put_nowait(update); return
+        self.queues[shard_of(uid, self.workers)][uid // self.workers % self.lanes].put_nowait(update)
+
+    async def deliver(self, worker: int, lane: int, session: aiohttp.ClientSession):
+        """Передавать апдейты полосы по одному: воркер отвечает, когда обработал апдейт,
+        так что порядок апдейтов игрока сохраняется. Пока воркер недоступен (старт,
+        перезапуск), апдейт повторяется. Ошибку хэндлера (5xx) не повторяем — иначе
+        действие игрока выполнилось бы дважды"""
+        url, queue = f"http://127.0.0.1:{self.base_port + worker}{WORKER_PATH}", self.queues[worker][lane]
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret}
+        while True:
+            update = await queue.get()
+            while True:
+                try:
+                    async with session.post(url, json=update, headers=headers) as resp:
+                        if resp.status >= 400: logger.warning("Worker %s failed update %s: %s", worker, update.get("update_id"), resp.status)
+                        break
+                except aiohttp.ClientConnectionError: pass
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning("Worker %s did not answer update %s: %s", worker, update.get("update_id"), e); break
+                await asyncio.sleep(0.5)
+            ROUTED.inc(str(worker))
+
+
+async def _supervise(worker: int, secret: str):
+    """Держать воркер запущенным: упал — перезапустить через секунду"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    env = {**os.environ, "RUN_MODE": "worker", "WORKER_ID": str(worker), "SHARD_SECRET": secret}
+    while True:
+        proc = await asyncio.create_subprocess_exec(sys.executable, script, env=env)
+        try:
+            code = await proc.wait()
+        except asyncio.CancelledError:
+            proc.terminate(); await proc.wait()
+            raise
+        logger.error("Worker %s exited with %s, restarting", worker, code)
+        await asyncio.sleep(1)
+
+
+async def _poll(bot, front: Front, allowed: list):
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=25, allowed_updates=allowed)
+        except Exception as e:
+            logger.warning("get_updates failed: %s", e); await asyncio.sleep(1); continue
+        for upd in updates:
+            front.route(upd.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = upd.update_id + 1
+
+
+async def _webhook(bot, front: Front, allowed: list, setup=None):
+    async def receive(request):
+        if config.WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != config.WEBHOOK_SECRET:
+            return web.Response(status=401)
+        front.route(await request.json())
+        return web.Response()
+    app = web.Application()
+    app.router.add_post(config.WEBHOOK_PATH, receive)
+    if setup: setup(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, config.WEB_HOST, config.WEB_PORT).start()
+    await bot.set_webhook(config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH, secret_token=config.WEBHOOK_SECRET or None,
+                          allowed_updates=allowed, drop_pending_updates=True)
+    try: await asyncio.Event().wait()
+    finally: await runner.cleanup()
+
+
+async def run_front(bot, allowed: list, setup=None):
+    """Фронт: запустить воркеров и раздавать им апдейты, пока не отменят.
+    setup(app) — добавить маршруты (например, /health) к веб-приложению фронта"""
+    if config.RUN_MODE == "webhook" and not config.WEBHOOK_URL: raise SystemExit("RUN_MODE=webhook требует WEBHOOK_URL")
+    secret = secrets.token_urlsafe(16)
+    front = Front(config.WORKERS, config.SHARD_BASE_PORT, secret, config.SHARD_LANES)
+    logger.info("🔀 Front: %s workers on 127.0.0.1:%s+", config.WORKERS, config.SHARD_BASE_PORT)
+    # Соединение на каждую полосу; воркер отвечает не позже чем через ~55 с (дальше — обработка в фоне)
+    connector = aiohttp.TCPConnector(limit=config.WORKERS * config.SHARD_LANES)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as session:
+        tasks = [asyncio.create_task(_supervise(i, secret)) for i in range(config.WORKERS)]
+        tasks += [asyncio.create_task(front.deliver(i, lane, session)) for i in range(config.WORKERS) for lane in range(config.SHARD_LANES)]
+        stats_server = await metrics.start_server(config.METRICS_HOST, config.METRICS_PORT, setup) if config.METRICS_PORT else None
+        try:
+            if config.RUN_MODE == "webhook": await _webhook(bot, front, allowed, setup)
+            else: await _poll(bot, front, allowed)
+        finally:
+            for t in tasks: t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if stats_server: await stats_server.cleanup()
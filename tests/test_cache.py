@@ -0,0 +1,51 @@
+"""LRU-кэш и защита кэша игроков от устаревшего чтения"""
+import asyncio
+import cache
+import database as db
+from cache import LRUCache
+
+
+def test_lru_evicts_least_recent():
+    c = LRUCache(2, 60)
+    c.put(1, "a"); c.put(2, "b")
+    assert c.get(1) == "a"  # 1 свежее 2
+    c.put(3, "c")
+    assert c.get(2) is None and c.get(1) == "a" and c.get(3) == "c"
+    assert len(c) == 2 and c.hits == 3 and c.misses == 1
+
+
+def test_lru_ttl_and_pop(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    c = LRUCache(10, 5)
+    c.put(1, "a"); c.put(2, "b")
+    assert c.pop(2) == "b" and c.pop(2) is None
+    now[0] += 6
+    assert c.get(1) is None and len(c) == 0
+
+
+def test_stale_read_not_cached(tmp_path, monkeypatch):
+    """Промах get_player, во время которого писатель опубликовал строку, не затирает её
+    в кэше, а отметки чтений не копятся"""
+    monkeypatch.setattr(db, "DATABASE_PATH", str(tmp_path / "cache.db"))
+
+    async def run():
+        await db.init_db()
+        try:
+            await db.create_player(1, "u", "U", "warrior")
+            db._players.clear()
+            fetch = db._fetch_player
+
+            async def slow_fetch(conn, user_id):
+                row = await fetch(conn, user_id)
+                monkeypatch.setattr(db, "_fetch_player", fetch)  # писатель читает строку тем же _fetch_player
+                await db.add_gold(user_id, 100)  # публикуется, пока чтение ещё идёт
+                return row
+            monkeypatch.setattr(db, "_fetch_player", slow_fetch)
+            stale = await db.get_player(1)
+            assert (await db.get_player(1))["gold"] == stale["gold"] + 100
+            assert not db._player_reads
+        finally:
+            await db.close_db()
+
+    asyncio.run(run())
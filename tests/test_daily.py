@@ -0,0 +1,41 @@
+"""Дневные счётчики без сброса: вчерашний счётчик читается как 0, первое увеличение за день пишет 1"""
+import asyncio
+import database as db
+
+
+def test_counter_reads_zero_on_other_day(monkeypatch):
+    monkeypatch.setattr(db, "today_day", lambda: 100)
+    player = {"arena_fights_today": 4, "arena_day": 100, "tower_attempts_today": 2, "tower_day": 99}
+    assert db.daily_used(player, "arena") == 4 and db.daily_used(player, "tower") == 0
+    assert db.daily_left(player, "tower") == db.DAILY_COUNTERS["tower"][2]
+    player["arena_fights_today"] = 10 ** 6
+    assert db.daily_left(player, "arena") == 0
+
+
+def test_counters_roll_over_at_day_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_PATH", str(tmp_path / "daily.db"))
+    day = [20000]
+    monkeypatch.setattr(db, "today_day", lambda: day[0])
+    limit = db.DAILY_COUNTERS["tower"][2]
+
+    async def run():
+        await db.init_db()
+        try:
+            await db.create_player(1, "u", "U", "warrior")
+            await db.use_tower_attempt(1); await db.use_tower_attempt(1)
+            await db.record_arena_fight(1, True, 10)
+            assert await db.get_tower_attempts(1) == limit - 2
+            day[0] += 1  # полночь: в БД ничего не пишется, счётчики читаются как 0
+            assert await db.get_tower_attempts(1) == limit
+            await db.use_tower_attempt(1)
+            p = await db.get_player(1)
+            assert (p["tower_attempts_today"], p["tower_day"]) == (1, day[0]) and db.daily_used(p, "arena") == 0
+            act = await db.action(1)
+            act.use_daily("arena"); act.use_tower_attempt()
+            assert await act.commit()
+            p = await db.get_player(1)
+            assert db.daily_used(p, "tower") == 2 and (p["arena_fights_today"], p["arena_day"]) == (1, day[0])
+        finally:
+            await db.close_db()
+
+    asyncio.run(run())
@@ -0,0 +1,49 @@
+"""Рейтинги в памяти и их снимки в БД: частями, со сменой поколения"""
+import asyncio
+import sqlite3
+import database as db
+from leaderboard import Leaderboards
+
+
+def _player(uid, level=1, rating=1000, floor=0):
+    return {"user_id": uid, "username": "", "first_name": "", "class": "warrior", "level": level, "arena_rating": rating,
+            "arena_wins": 0, "arena_losses": 0, "total_kills": 0, "tower_floor": floor}
+
+
+def test_ranked_shares_places_and_moves_on_put():
+    lb = Leaderboards()
+    for uid, level, rating in ((1, 5, 1000), (2, 7, 900), (3, 5, 1000), (4, 5, 1100)):
+        lb.put(_player(uid, level, rating))
+    assert [(rank, e["user_id"]) for rank, e in lb.ranked("level")] == [(1, 2), (2, 4), (3, 1), (3, 3)]
+    lb.put(_player(3, 8, 1000))
+    assert [e["user_id"] for _, e in lb.ranked("level")] == [3, 2, 4, 1]
+    assert [rank for rank, _ in lb.ranked("tower")] == [1, 1, 1, 1]
+    lb.clear()
+    assert len(lb) == 0 and not list(lb.ranked("arena"))
+
+
+def test_refresh_in_chunks_replaces_generation(tmp_path, monkeypatch):
+    path = str(tmp_path / "lb.db")
+    monkeypatch.setattr(db, "DATABASE_PATH", path)
+    monkeypatch.setattr(db, "LEADERBOARD_CHUNK", 2)
+
+    async def run():
+        await db.init_db()
+        try:
+            for uid in range(1, 6):
+                await db.create_player(uid, f"u{uid}", f"U{uid}", "warrior")
+                await db.add_xp(uid, uid * 300)
+            await db.refresh_leaderboards()
+            assert [r["user_id"] for r in await db.get_leaderboard_xp()] == [5, 4, 3, 2, 1]
+            await db.add_xp(1, 5000)
+            await db.refresh_leaderboards()
+            assert [r["user_id"] for r in await db.get_leaderboard_xp(3)] == [1, 5, 4]
+            assert await db.get_player_rank(1) == 1 and await db.get_player_rank(5) == 2
+        finally:
+            await db.close_db()
+
+    asyncio.run(run())
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT DISTINCT gen FROM leaderboard_snapshot").fetchall() == [(2,)]
+    assert conn.execute("SELECT COUNT(*) FROM leaderboard_snapshot").fetchone()[0] == 5 * len(db._leaders.boards)
+    conn.close()
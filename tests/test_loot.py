@@ -0,0 +1,43 @@
+"""Таблицы алиасов: восстановленные вероятности совпадают с весами игровых таблиц"""
+import random
+import pytest
+import game_data as gd
+from loot import AliasTable
+
+
+def _expected(weights):
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def _tables():
+    yield from ((f"zone {z['id']}", gd.ZONE_DROP_TABLES[z["id"]], list(z["drop_rates"].values())) for z in gd.ZONES)
+    yield from ((f"tower {f}+", t, t.weights) for f, t in gd.TOWER_DROP_TIERS)
+    yield "expedition", gd.EXPEDITION_ITEM_TABLE, gd.EXPEDITION_ITEM_TABLE.weights
+    yield "wheel", gd.WHEEL_TABLE, [p["weight"] for p in gd.WHEEL_PRIZES]
+    yield "gacha free", gd.GACHA_TABLE_FREE, list(gd.GACHA_RATES_FREE.values())
+    yield "gacha premium", gd.GACHA_TABLE_PREMIUM, list(gd.GACHA_RATES_PREMIUM.values())
+
+
+@pytest.mark.parametrize("name,table,weights", list(_tables()), ids=lambda v: v if isinstance(v, str) else "")
+def test_probabilities_match_weights(name, table, weights):
+    assert table.probabilities() == pytest.approx(_expected(weights), abs=1e-12)
+
+
+def test_zone_tables_keep_rarity_order():
+    for z in gd.ZONES:
+        assert gd.ZONE_DROP_TABLES[z["id"]].items == list(z["drop_rates"])
+
+
+def test_sampling_follows_probabilities():
+    table = AliasTable("abcd", [1, 0, 3, 6])
+    counts = dict.fromkeys("abcd", 0)
+    for x in table.sample_k(100_000, random.Random(7)): counts[x] += 1
+    assert counts["b"] == 0
+    for item, p in zip(table.items, table.probabilities()):
+        assert counts[item] / 100_000 == pytest.approx(p, abs=0.01)
+
+
+def test_rejects_bad_weights():
+    for items, weights in (([], []), ("ab", [1]), ("ab", [0, 0]), ("ab", [1, -1])):
+        with pytest.raises(ValueError): AliasTable(items, weights)
@@ -0,0 +1,50 @@
+"""Подбор соперников арены: окно уровней и ближайшие по рейтингу"""
+import random
+from matchmaking import ArenaIndex
+
+
+def _entry(uid, level, rating):
+    return {"user_id": uid, "level": level, "arena_rating": rating}
+
+
+def _index(*entries):
+    idx = ArenaIndex()
+    for e in entries: idx.put(_entry(*e))
+    return idx
+
+
+def test_pick_by_level_stays_in_window_and_skips_self():
+    idx = _index((1, 10, 1000), (2, 8, 1000), (3, 12, 1000), (4, 13, 1000), (5, 5, 1000))
+    rng = random.Random(1)
+    picked = {idx.pick_by_level(1, 10, 2, rng)["user_id"] for _ in range(200)}
+    assert picked == {2, 3}
+
+
+def test_pick_by_level_empty_window():
+    idx = _index((1, 10, 1000), (2, 20, 1000))
+    assert idx.pick_by_level(1, 10, 3) is None
+    assert idx.pick_by_level(1, 1, 0) is None  # пустые корзины, уровень ниже 1
+
+
+def test_pick_by_level_follows_level_change():
+    idx = _index((1, 10, 1000), (2, 10, 1000), (3, 10, 1000))
+    idx.put(_entry(2, 30, 1000))
+    rng = random.Random(2)
+    assert {idx.pick_by_level(1, 10, 1, rng)["user_id"] for _ in range(50)} == {3}
+    assert idx.pick_by_level(3, 30, 0, rng)["user_id"] == 2
+
+
+def test_pick_by_rating_takes_nearest_window():
+    idx = _index((1, 1, 1000), (2, 1, 990), (3, 1, 1015), (4, 1, 1100), (5, 1, 800), (6, 1, 1003))
+    rng = random.Random(3)
+    picked = {idx.pick_by_rating(1, 1000, 3, rng)["user_id"] for _ in range(200)}
+    assert picked == {6, 2, 3}
+    assert {idx.pick_by_rating(1, 1000, 10, rng)["user_id"] for _ in range(300)} == {2, 3, 4, 5, 6}
+
+
+def test_pick_by_rating_follows_rating_change():
+    idx = _index((1, 1, 1000), (2, 1, 1001), (3, 1, 1500))
+    idx.put(_entry(2, 1, 2000))
+    assert idx.pick_by_rating(1, 1000, 1)["user_id"] == 3
+    idx.clear()
+    assert idx.pick_by_rating(1, 1000, 5) is None and len(idx) == 0
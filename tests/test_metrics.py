@@ -0,0 +1,25 @@
+"""Замер хэндлеров: метки команд и пропуск /perf"""
+import asyncio
+from datetime import datetime
+from aiogram.types import Chat, Message, User
+import metrics
+
+
+def _msg(text):
+    return Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"),
+                   from_user=User(id=1, is_bot=False, first_name="U"), text=text)
+
+
+def test_timer_labels_commands_and_skips_perf(monkeypatch):
+    monkeypatch.setattr(metrics, "_commands", {"perf", "stats"})
+    timer = metrics.HandlerTimer(skip=("/perf",))
+
+    async def handler(event, data): return True
+
+    async def run():
+        for text in ("/perf 0", "/stats", "/stats@bot", "/nope"): assert await timer(handler, _msg(text), {})
+
+    before = {k: v[2] for k, v in metrics.HANDLER_SECONDS.values.items()}
+    asyncio.run(run())
+    counts = {k: v[2] - before.get(k, 0) for k, v in metrics.HANDLER_SECONDS.values.items()}
+    assert counts.get("/perf", 0) == 0 and counts["/stats"] == 2 and counts["other"] == 1
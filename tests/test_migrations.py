@@ -0,0 +1,33 @@
+"""Миграции: строковые столбцы старой схемы переносятся в числовые и удаляются"""
+import asyncio
+import sqlite3
+from datetime import date, datetime
+import database as db
+
+
+def test_legacy_text_columns_backfilled_and_dropped(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    monkeypatch.setattr(db, "DATABASE_PATH", path)
+    migrations = db._MIGRATIONS
+    monkeypatch.setattr(db, "_MIGRATIONS", migrations[:9])
+    asyncio.run(db.migrate_db())
+
+    # Строки, которые старый код записал уже после миграций 4 и 6
+    conn = sqlite3.connect(path)
+    spent = datetime(2026, 3, 1, 12, 30)
+    conn.execute("INSERT INTO players (user_id,class,energy,energy_ts,energy_updated_at,tower_last_reset,tower_day) VALUES (1,'mage',40,0,?,?,0)",
+                 (spent.isoformat(), "2026-03-01"))
+    conn.execute("INSERT INTO expeditions (user_id,exp_type,duration_minutes,started_at,started_ts) VALUES (1,'short',30,?,0)",
+                 (spent.isoformat(),))
+    conn.commit(); conn.close()
+
+    monkeypatch.setattr(db, "_MIGRATIONS", migrations)
+    asyncio.run(db.migrate_db())
+    conn = sqlite3.connect(path)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(players)")}
+    assert not cols & {"energy_updated_at", "arena_last_reset", "tower_last_reset", "wheel_last_spin", "last_daily"}
+    assert "started_at" not in {r[1] for r in conn.execute("PRAGMA table_info(expeditions)")}
+    assert conn.execute("SELECT energy_ts,tower_day FROM players").fetchone() == (int(spent.timestamp()), date(2026, 3, 1).toordinal() - db._EPOCH)
+    assert conn.execute("SELECT started_ts FROM expeditions").fetchone()[0] == int(spent.timestamp())
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(migrations)
+    conn.close()
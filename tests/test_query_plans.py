@@ -0,0 +1,125 @@
+"""
+Планы запросов: на свежей БД после всех миграций прогоняется типовая игровая нагрузка,
+каждый выполненный запрос (set_trace_callback на всех соединениях пула) проверяется
+через EXPLAIN QUERY PLAN — сканирований (SCAN, в том числе по покрывающему индексу)
+быть не должно, кроме перечисленных в FULL_SCAN_OK с причиной.
+"""
+import asyncio
+import random
+import re
+import sqlite3
+import pytest
+import database as db
+from game_data import generate_daily_quests, generate_expedition_rewards, generate_item
+
+# Запросы (регулярные выражения), которые читают таблицу целиком намеренно, и почему.
+# Всё остальное должно идти поиском (SEARCH).
+FULL_SCAN_OK = {
+    r"FROM players WHERE energy<max_energy": "energy_refills — таймеры восстановления при старте",
+    r"FROM players WHERE class!=''$": "load_player_indexes при старте и get_bot_stats (/stats) — все игроки",
+    r"FROM expeditions WHERE is_collected=0": "load_expeditions — активные экспедиции при старте",
+    r"^SELECT COALESCE\(SUM\(\w+(\+\w+)?\),0\) FROM players$": "get_bot_stats — сумма по всем игрокам",
+    r"FROM players p LEFT JOIN inventory i": "check_equipment_bonuses — админская сверка всех игроков",
+    r"^SELECT COUNT\(\*\) FROM auction$": "get_auction_count — число страниц аукциона, по наименьшему индексу",
+    r"^SELECT \* FROM auction ORDER BY listed_at DESC LIMIT": "get_auction_listings — обход индекса по времени, читается LIMIT+OFFSET строк",
+    r"^SELECT board,gen FROM leaderboard_meta$": "refresh_leaderboards — по строке на рейтинг",
+}
+
+_DML = re.compile(r"^\s*(SELECT|UPDATE|DELETE|INSERT|WITH)\b", re.I)
+
+
+async def _workload():
+    rng = random.Random(1)
+    a, b = 1001, 1002
+    for uid in (a, b): await db.create_player(uid, f"u{uid}", f"U{uid}", "warrior")
+    await db.update_player_name(a, "ua", "UA")
+    p = await db.get_player(a)
+    await db.spend_energy(a, 10, db.calculate_energy(p)); await db.set_energy(a, 50)
+    await db.add_gold(a, 1000); await db.add_crystals(a, 100)
+    await db.spend_gold(a, 10); await db.spend_crystals(a, 10)
+    await db.add_xp(a, 500); await db.record_hunt(a)
+    await db.get_arena_fights_left(a); await db.record_arena_fight(a, True, 10); await db.record_arena_fight(b, False, 10)
+    await db.get_arena_opponent(a, rng)
+    await db.get_tower_attempts(a); await db.use_tower_attempt(a); await db.advance_tower(a)
+
+    ids = [await db.add_item(a, generate_item(r, rng=rng)) for r in ("common", "rare", "epic")]
+    await db.get_inventory(a); await db.get_item(ids[0])
+    await db.equip_item(a, ids[0]); await db.get_equipment_bonuses(a); await db.get_equipped_items(a)
+    await db.count_inventory(a); await db.get_items_by_rarity(a, "rare")
+    await db.sell_item(a, ids[1]); await db.delete_items([ids[2]])
+
+    await db.create_daily_quests(a, generate_daily_quests(3, rng))
+    await db.update_quest_progress(a, "hunt", 100); await db.update_quest_progress(b, "hunt")
+    quests = await db.get_daily_quests(a)
+    await db.claim_quest(a, quests[0]["id"]); await db.flush_quests()
+    await db.pregenerate_daily_quests()
+
+    exp = await db.start_expedition(a, "short", 1, generate_expedition_rewards("short", rng))
+    await db.get_active_expedition(a); await db.collect_expedition(a, exp["id"])
+    await db.can_spin_wheel(a); await db.use_wheel_spin(a); await db.check_daily(a)
+
+    item = await db.add_item(b, generate_item("rare", rng=rng))
+    await db.list_on_auction(b, item, 100)
+    listings = await db.get_auction_listings(); await db.get_my_listings(b); await db.count_my_listings(b)
+    await db.get_auction_count(); await db.buy_from_auction(a, listings[0]["id"])
+    item = await db.add_item(b, generate_item("common", rng=rng))
+    await db.list_on_auction(b, item, 100)
+    await db.cancel_listing(b, (await db.get_my_listings(b))[0]["id"])
+
+    await db.refresh_leaderboards(); await db.refresh_leaderboards()  # второй — со сменой поколения
+    for get in (db.get_leaderboard_xp, db.get_leaderboard_arena, db.get_leaderboard_tower): await get()
+    for board in ("level", "arena", "tower"): await db.get_player_rank(a, board)
+    await db.get_leaderboard_age()
+    await db.resync_player_indexes((0, 2)); await db.prune_player_changes()
+    await db.energy_refills(); await db.get_bot_stats()
+    await db._write(lambda c: c.execute("UPDATE players SET eq_attack=eq_attack+1 WHERE user_id=?", (a,)), a)
+    assert await db.check_equipment_bonuses(fix=True)
+
+    act = await db.action(a)
+    act.spend_energy(1, 10); act.set_energy(5); act.add_gold(1); act.add_crystals(1); act.add_xp(10); act.record_hunt()
+    act.use_tower_attempt(); act.advance_tower(); act.use_wheel_spin()
+    act.add_item(generate_item("common", rng=rng)); act.quest("hunt")
+    assert await act.commit()
+    exp = await db.start_expedition(a, "short", 1, generate_expedition_rewards("short", rng))
+    act = await db.action(a); act.collect_expedition(exp["id"])
+    assert await act.commit()
+
+
+@pytest.fixture
+def executed(tmp_path, monkeypatch):
+    """Все запросы, выполненные пулом за init_db() и нагрузку, без повторов"""
+    path = str(tmp_path / "plans.db")
+    monkeypatch.setattr(db, "DATABASE_PATH", path)
+    statements = {}
+
+    async def run():
+        await db.migrate_db()  # бэкфиллы миграций — не горячие запросы
+        await db.open_pool()
+        for conn in (db._writer, *db._reader_conns):
+            await conn.set_trace_callback(lambda sql: statements.setdefault(sql, None))
+        try:
+            await db.init_db()
+            await _workload()
+        finally:
+            await db.close_db()
+
+    asyncio.run(run())
+    return path, [sql for sql in statements if _DML.match(sql)]
+
+
+def test_no_full_table_scans(executed):
+    path, statements = executed
+    assert len(statements) > 50
+    conn = sqlite3.connect(path)
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    bad, allowed = {}, set()
+    for sql in statements:
+        if (ok := next((ok for ok in FULL_SCAN_OK if re.search(ok, sql.strip())), None)):
+            allowed.add(ok); continue
+        plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        # «SCAN 3 CONSTANT ROWS» (VALUES) — не таблица
+        if any(step.split()[1] in tables for step in plan if step.startswith("SCAN ")):
+            bad[sql] = plan
+    conn.close()
+    assert allowed == set(FULL_SCAN_OK), f"нагрузка не выполнила: {set(FULL_SCAN_OK) - allowed}"
+    assert not bad, "\n".join(f"{sql}\n    {'; '.join(plan)}" for sql, plan in bad.items())
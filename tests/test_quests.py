@@ -0,0 +1,64 @@
+"""Прогресс квестов: накопление в памяти, запись пачкой и выдача квестов после полуночи"""
+import asyncio
+from datetime import datetime, timedelta
+import database as db
+from quest_engine import QuestEngine
+
+QUESTS = [{"type": "hunt", "desc": "Охота {t}", "target": 3, "gold": 10, "crystals": 0, "xp": 5},
+          {"type": "arena", "desc": "Арена {t}", "target": 2, "gold": 10, "crystals": 1, "xp": 5}]
+
+
+def test_engine_records_only_open_quests():
+    q = QuestEngine()
+    q.load(1, "d1", {"hunt": 2, "arena": 0})
+    assert q.known(1, "d1") and not q.known(1, "d2")
+    assert q.record(1, "d1", "hunt") and q.record(1, "d1", "hunt", 5)
+    assert not q.record(1, "d1", "hunt")  # уже добит
+    assert not q.record(1, "d1", "arena") and not q.record(2, "d1", "hunt") and not q.record(1, "d2", "hunt")
+    assert q.pending_count() == 1 and q.take() == [(1, "hunt", "d1", 6)] and q.pending_count() == 0
+
+
+def test_engine_take_one_player_requeue_and_prune():
+    q = QuestEngine()
+    q.load(1, "d1", {"hunt": 5}); q.load(2, "d1", {"hunt": 5}); q.load(3, "d0", {"hunt": 5})
+    q.record(1, "d1", "hunt"); q.record(2, "d1", "hunt", 2)
+    items = q.take(2)
+    assert items == [(2, "hunt", "d1", 2)] and q.pending_count() == 1
+    q.requeue(items); q.requeue(items)
+    assert sorted(q.take()) == [(1, "hunt", "d1", 1), (2, "hunt", "d1", 4)]
+    q.prune("d1")
+    assert q.known(1, "d1") and not q.known(3, "d0")
+
+
+def test_flush_and_rollover(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_PATH", str(tmp_path / "quests.db"))
+    today = datetime.now().strftime("%Y-%m-%d")
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    async def run():
+        await db.init_db()
+        try:
+            await db.create_daily_quests(1, QUESTS)
+            for _ in range(4): await db.update_quest_progress(1, "hunt")
+            await db.update_quest_progress(1, "tower")  # такого квеста нет — не копится
+            assert db._quests.pending_count() == 1
+            await db.flush_quests()
+            assert db._quests.pending_count() == 0
+            hunt = next(q for q in await db.get_daily_quests(1) if q["quest_type"] == "hunt")
+            assert hunt["progress"] == 3 and hunt["is_completed"] == 1
+
+            # Вчерашние квесты игроков 2 и 3; после полуночи шард (0, 2) выдаёт новые только игроку 2
+            monkeypatch.setattr(db, "_quest_date", lambda: yesterday)
+            for uid in (2, 3): await db.create_daily_quests(uid, QUESTS)
+            monkeypatch.setattr(db, "_quest_date", lambda: today)
+            assert await db.pregenerate_daily_quests((0, 2)) == 1
+            assert db._quests.known(2, today) and not db._quests.known(3, today)
+            assert len(await db.get_daily_quests(2)) == 3 and not await db.get_daily_quests(3)
+            assert await db.pregenerate_daily_quests((0, 2)) == 0  # повторно — не дублирует
+            assert db._quests.known(3, yesterday)
+            db._quests.prune(today)
+            assert not db._quests.known(3, yesterday) and db._quests.known(2, today)
+        finally:
+            await db.close_db()
+
+    asyncio.run(run())
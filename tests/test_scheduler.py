@@ -0,0 +1,38 @@
+"""Планировщик: порядок срабатывания, перенос и отмена таймеров"""
+import asyncio
+import time
+from scheduler import Scheduler
+
+
+def test_fires_in_time_order_with_reschedule_and_cancel():
+    async def run():
+        s, fired = Scheduler(), []
+        s.start()
+        now = time.time()
+        for key, delay in (("c", 0.06), ("a", 0.02), ("b", 0.04), ("x", 0.03)):
+            s.schedule(key, now + delay, lambda key=key: fired.append(key))
+        s.schedule("a", now + 0.08, lambda: fired.append("a"))  # перенос: старая запись в куче пропускается
+        s.cancel("x")
+        assert "a" in s and "x" not in s and len(s) == 3 and s.when("a") == now + 0.08 and s.when("x") is None
+        await asyncio.sleep(0.15)
+        await s.stop()
+        assert fired == ["b", "c", "a"] and len(s) == 0 and s.when("a") is None
+
+    asyncio.run(run())
+
+
+def test_earlier_timer_wakes_sleeping_loop_and_errors_are_isolated():
+    async def run():
+        s, fired = Scheduler(), []
+        s.start()
+        s.schedule("late", time.time() + 60, lambda: fired.append("late"))
+        await asyncio.sleep(0.01)  # цикл спит до «late»
+
+        async def coro(): fired.append("coro")
+        s.schedule("bad", time.time(), lambda: 1 / 0)
+        s.schedule("early", time.time() + 0.02, coro)
+        await asyncio.sleep(0.1)
+        await s.stop()
+        assert fired == ["coro"] and "late" in s and "bad" not in s
+
+    asyncio.run(run())
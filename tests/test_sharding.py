@@ -0,0 +1,51 @@
+"""Шардирование: маршрутизация апдейтов фронтом и пересинхронизация воркеров через журнал"""
+import asyncio
+import random
+import sqlite3
+import database as db
+from sharding import Front, shard_of, update_user_id
+
+
+def _cb(uid):
+    return {"update_id": uid, "callback_query": {"id": "1", "from": {"id": uid}, "data": "x"}}
+
+
+def test_update_user_id():
+    assert update_user_id(_cb(42)) == 42
+    assert update_user_id({"update_id": 1, "message": {"from": {"id": 7}, "text": "/start"}}) == 7
+    assert update_user_id({"update_id": 1, "poll": {"id": "p"}}) is None
+
+
+def test_route_keeps_player_in_one_lane():
+    front = Front(3, 9000, "s", lanes=4)
+    for uid in (5, 8, 5, 11, 5, 100):
+        front.route(_cb(uid))
+    front.route({"update_id": 0, "poll": {"id": "p"}})
+    lanes = {(w, l): [u["update_id"] for u in q._queue] for w, qs in enumerate(front.queues) for l, q in enumerate(qs) if q.qsize()}
+    assert lanes[(shard_of(5, 3), 5 // 3 % 4)] == [5, 5, 5]
+    assert all(shard_of(uid, 3) == w for (w, _), uids in lanes.items() for uid in uids if uid)
+    assert 0 in lanes[(0, 0)]  # апдейт без пользователя — воркеру 0
+
+
+def test_resync_forgets_rows_changed_by_other_worker(tmp_path, monkeypatch):
+    path = str(tmp_path / "shard.db")
+    monkeypatch.setattr(db, "DATABASE_PATH", path)
+
+    async def run():
+        await db.init_db()
+        try:
+            await db.create_player(10, "u", "U", "warrior")
+            assert (await db.get_player(10))["gold"] == 500  # строка в кэше воркера 0
+            other = sqlite3.connect(path, isolation_level=None)  # «воркер 1»
+            for sql in db._change_log_sql(1): other.execute(sql)
+            other.execute("INSERT INTO players (user_id,class,level) VALUES (11,'mage',1)")
+            other.execute("UPDATE players SET gold=gold+70 WHERE user_id=10")  # продажа на аукционе игроку своего шарда
+            other.close()
+            assert await db.resync_player_indexes((0, 2)) == 2
+            assert (await db.get_player(10))["gold"] == 570
+            assert (await db.get_arena_opponent(10, random.Random(1)))["user_id"] == 11
+            assert await db.resync_player_indexes((0, 2)) == 0
+        finally:
+            await db.close_db()
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+"""Очередь действий игрока: апдейты одного игрока по одному, повторное нажатие отвечается без выполнения"""
+import asyncio
+from datetime import datetime
+from aiogram.types import CallbackQuery, Chat, Message, User
+from user_locks import COALESCED, UserLocks
+
+
+def _cb(uid, data, mid=1):
+    user = User(id=uid, is_bot=False, first_name="U")
+    msg = Message(message_id=mid, date=datetime.now(), chat=Chat(id=uid, type="private"), text="x")
+    return CallbackQuery(id="1", from_user=user, chat_instance="c", message=msg, data=data)
+
+
+def test_serializes_player_and_coalesces_duplicates():
+    async def run():
+        locks, log, release = UserLocks(), [], asyncio.Event()
+
+        async def handler(event, data):
+            log.append(("start", event.from_user.id, event.data))
+            if event.data == "slow_1": await release.wait()
+            log.append(("end", event.from_user.id, event.data))
+            return event.data
+
+        before = COALESCED.values.get("slow_", 0)
+        first = asyncio.create_task(locks(handler, _cb(1, "slow_1"), {}))
+        await asyncio.sleep(0)
+        dup = await locks(handler, _cb(1, "slow_1"), {})  # то же нажатие, пока первое выполняется
+        other = asyncio.create_task(locks(handler, _cb(1, "profile"), {}))  # другая кнопка — ждёт очереди
+        another_msg = asyncio.create_task(locks(handler, _cb(1, "slow_1", mid=2), {}))  # другое сообщение — не дубль
+        assert await locks(handler, _cb(2, "profile"), {}) == "profile"  # другой игрок не ждёт
+        await asyncio.sleep(0)
+        assert dup is None and COALESCED.values["slow_"] == before + 1
+        assert [e for e in log if e[1] == 1] == [("start", 1, "slow_1")]
+        release.set()
+        assert await asyncio.gather(first, other, another_msg) == ["slow_1", "profile", "slow_1"]
+        assert [e for e in log if e[1] == 1] == [("start", 1, "slow_1"), ("end", 1, "slow_1"), ("start", 1, "profile"),
+                                                 ("end", 1, "profile"), ("start", 1, "slow_1"), ("end", 1, "slow_1")]
+        assert not locks._locks and not locks._inflight
+        assert await locks(handler, _cb(1, "profile"), {}) == "profile"  # после завершения — снова выполняется
+
+    asyncio.run(run())
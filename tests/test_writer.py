@@ -0,0 +1,54 @@
+"""Писатель: блокировка записи, которую держит другой процесс, не останавливает очередь"""
+import asyncio
+import sqlite3
+import pytest
+import database as db
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    path = str(tmp_path / "writer.db")
+    monkeypatch.setattr(db, "DATABASE_PATH", path)
+    monkeypatch.setitem(db.DB_PRAGMAS, "busy_timeout", 20)
+    monkeypatch.setattr(db, "DB_BEGIN_RETRIES", 3)
+    return path
+
+
+def _hold_write_lock(path):
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    return other
+
+
+def test_begin_retries_until_lock_released(path):
+    async def run():
+        await db.init_db()
+        try:
+            await db.create_player(1, "u", "U", "warrior")
+            other = _hold_write_lock(path)
+            asyncio.get_running_loop().call_later(0.08, other.rollback)
+            await db.add_gold(1, 5)
+            other.close()
+            assert (await db.get_player(1))["gold"] == 505
+        finally:
+            await db.close_db()
+
+    asyncio.run(run())
+
+
+def test_locked_batch_fails_writer_survives(path):
+    async def run():
+        await db.init_db()
+        try:
+            await db.create_player(1, "u", "U", "warrior")
+            other = _hold_write_lock(path)
+            with pytest.raises(sqlite3.OperationalError):
+                await db.add_gold(1, 5)
+            other.rollback(); other.close()
+            assert not db._writer_task.done()
+            await db.add_gold(1, 7)
+            assert (await db.get_player(1))["gold"] == 507
+        finally:
+            await db.close_db()
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+"""
+🔒 Очередь действий игрока MMO RPG v2
+Апдейты одного игрока обрабатываются строго по одному: хэндлеры читают состояние
+(энергию, золото, попытки) и пишут результат отдельными вызовами БД, и параллельный
+двойной тап тратил бы одно и то же дважды. Повторное нажатие той же кнопки, пока
+первое ещё в обработке, не выполняется вовсе — на него сразу отвечаем.
+"""
+import asyncio
+import logging
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COALESCED = metrics.Counter("rpg_callbacks_coalesced", "Повторных нажатий, отвеченных без выполнения", "handler")
+
+
+class UserLocks(BaseMiddleware):
+    """Внешний middleware для dp.callback_query. Команды (dp.message) не ставятся в очередь:
+    /perf держит хэндлер минутами, и кнопки админа ждали бы его.
+
+    _locks: user_id -> [Lock, сколько апдейтов держат или ждут его]; запись удаляется,
+    когда игрок ничего не ждёт. _inflight — ключи нажатий (игрок, сообщение, data),
+    которые сейчас ждут очереди или выполняются"""
+
+    def __init__(self):
+        self._locks = {}
+        self._inflight = set()
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, "from_user", None)
+        if user is None: return await handler(event, data)
+        key = None
+        if isinstance(event, CallbackQuery):
+            key = (user.id, event.message.message_id if event.message else event.inline_message_id, event.data)
+            if key in self._inflight:
+                COALESCED.inc(metrics.handler_name(event))
+                try: await event.answer()
+                except Exception as e: logger.debug("Answer to duplicate callback failed: %s", e)
+                return None
+            self._inflight.add(key)
+        entry = self._locks.get(user.id)
+        if entry is None: entry = self._locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]: return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]: del self._locks[user.id]
+            if key: self._inflight.discard(key)